@@ -1,6 +1,19 @@
 import phylib;
 import os;
 import sqlite3;
+import array;
+import collections;
+import threading;
+import struct;
+import math;
+import time;
+import bisect;
+import zlib;
+import weakref;
+import queue;
+import atexit;
+import multiprocessing;
+from concurrent.futures import Future;
 
 ################################################################################
 # import constants from phylib to global varaibles
@@ -14,6 +27,15 @@ VEL_EPSILON = phylib.PHYLIB_VEL_EPSILON
 DRAG = phylib.PHYLIB_DRAG
 MAX_TIME = phylib.PHYLIB_MAX_TIME
 MAX_OBJECTS = phylib.PHYLIB_MAX_OBJECTS
+STATE_SIZE = phylib.PHYLIB_STATE_SIZE
+
+# simulation engines accepted by Table.segment()
+ENGINE_STEP = phylib.PHYLIB_ENGINE_STEP
+ENGINE_EVENT = phylib.PHYLIB_ENGINE_EVENT
+
+# ball types in the rows of Table.exportBalls() and Table.importBalls()
+STILL_BALL = phylib.PHYLIB_STILL_BALL
+ROLLING_BALL = phylib.PHYLIB_ROLLING_BALL
 
 HEADER = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
 <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN"
@@ -27,6 +49,23 @@ FOOTER = """</svg>\n"""
 
 FRAME_INTERVAL = 0.01 # NEW FOR A3
 
+# HEADER, cushions and holes of every table's svg, built by staticSVG()
+STATIC_SVG = None
+
+# first bytes of a FrameEncoder stream
+FRAME_MAGIC = b"PHYF"
+
+# first bytes and format version of a shot packed by packShot()
+SHOT_MAGIC = b"PHYS"
+SHOT_VERSION = 1
+
+# how Game saves the tables of a shot: a TTable row per frame, or one packed ShotData row per shot
+STORAGE_ROWS = 0
+STORAGE_PACKED = 1
+
+# version of the database schema, kept in PRAGMA user_version and brought up to date by Database.migrateDB()
+SCHEMA_VERSION = 3
+
 ################################################################################
 # the standard colours of pool balls
 # if you are curious check this out:  
@@ -51,6 +90,40 @@ BALL_COLOURS = [
     "SANDYBROWN",       # no LIGHTBROWN 
     ];
 
+# the colours drawn for still balls (StillBall.svg()), the 5 and 8 balls differ from BALL_COLOURS
+STILL_BALL_COLOURS = {
+    0: "WHITE",      # Cue ball
+    1: "YELLOW",     # 1-ball
+    2: "BLUE",       # 2-ball
+    3: "RED",        # 3-ball
+    4: "PURPLE",     # 4-ball
+    5: "BLACK",     # 5-ball
+    6: "GREEN",      # 6-ball
+    7: "BROWN",      # 7-ball
+    8: "ORANGE",      # 8-ball
+    9: "LIGHTYELLOW",     # 9-ball
+    10: "LIGHTBLUE",      # 10-ball
+    11: "PINK",       # 11-ball
+    12: "MEDIUMPURPLE",    # 12-ball
+    13: "LIGHTSALMON",    # 13-ball
+    14: "LIGHTGREEN",     # 14-ball
+    15: "SANDYBROWN",     # 15-ball
+    }
+
+# precomputed svg markup of every ball by (type, number), filled in with the
+# ball's position using %; the same markup StillBall.svg() and RollingBall.svg() build
+BALL_TEMPLATES = {}
+for number, color in STILL_BALL_COLOURS.items():
+    if number == 0:
+        BALL_TEMPLATES[ (phylib.PHYLIB_STILL_BALL, number) ] = \
+            '<circle id="cue-ball" cx="%%d" cy="%%d" r="%d" fill="%s" />\n' % (int(BALL_RADIUS), color)
+    else:
+        BALL_TEMPLATES[ (phylib.PHYLIB_STILL_BALL, number) ] = \
+            '<circle cx="%%s" cy="%%s" r="%s" fill="%s" />\n' % (BALL_RADIUS, color)
+for number, color in enumerate(BALL_COLOURS):
+    BALL_TEMPLATES[ (phylib.PHYLIB_ROLLING_BALL, number) ] = \
+        '<circle cx="%%s" cy="%%s" r="%s" fill="%s" />\n' % (BALL_RADIUS, color)
+
 ################################################################################
 class Coordinate( phylib.phylib_coord ):
     """
@@ -84,25 +157,7 @@ class StillBall( phylib.phylib_object ):
 
     # add an svg method here
     def svg(self):
-        ball_colors_new = {
-        0: "WHITE",      # Cue ball
-        1: "YELLOW",     # 1-ball
-        2: "BLUE",       # 2-ball
-        3: "RED",        # 3-ball
-        4: "PURPLE",     # 4-ball
-        5: "BLACK",     # 5-ball
-        6: "GREEN",      # 6-ball
-        7: "BROWN",      # 7-ball
-        8: "ORANGE",      # 8-ball
-        9: "LIGHTYELLOW",     # 9-ball
-        10: "LIGHTBLUE",      # 10-ball
-        11: "PINK",       # 11-ball
-        12: "MEDIUMPURPLE",    # 12-ball
-        13: "LIGHTSALMON",    # 13-ball
-        14: "LIGHTGREEN",     # 14-ball
-        15: "SANDYBROWN",     # 15-ball
-        }
-        color = ball_colors_new[self.obj.still_ball.number]
+        color = STILL_BALL_COLOURS[self.obj.still_ball.number]
         # Using the ball number to choose a color, modulo ensures it wraps around if more than 16 balls
         # color = BALL_COLOURS[self.obj.still_ball.number % len(BALL_COLOURS)]
         # Generating SVG string for a still ball
@@ -236,15 +291,16 @@ class Table( phylib.phylib_table ):
             result += "  [%02d] = %s\n" % (i,obj);  # append object description
         return result;  # return the string
 
-    def segment( self ):
+    def segment( self, engine=ENGINE_STEP ):
         """
         Calls the segment method from phylib.i (which calls the phylib_segment
-        functions in phylib.c.
+        functions in phylib.c, or phylib_segment_event if engine is
+        ENGINE_EVENT).
         Sets the __class__ of the returned phylib_table object to Table
         to make it a Table object.
         """
 
-        result = phylib.phylib_table.segment( self );
+        result = phylib.phylib_table.segment( self, engine );
         if result:
             result.__class__ = Table;
             result.current = -1;
@@ -254,17 +310,18 @@ class Table( phylib.phylib_table ):
     def svg(self):
         """
         Generates an SVG representation of the pool table and its objects.
+        The cushions and holes never move, so they come from a layer that is
+        built once (see staticSVG()) and each ball is drawn from its
+        precomputed template in BALL_TEMPLATES.
         """
-        svg_elements = [HEADER]  # Start with the HEADER
-
-        for obj in self:  # Iterate over all objects in the table
-            if obj is not None:
-                svg_elements.append(obj.svg())  # Append the SVG string from each object
+        return staticSVG() + ballsSVG( self.balls() ) + FOOTER
 
-        svg_elements.append(FOOTER)  # Finish with the FOOTER
-
-        # Concatenate all SVG elements into a single string and return
-        return ''.join(svg_elements)
+    def balls(self):
+        """
+        Returns (type, number, x, y) for every ball on the table, in order,
+        read in one call to phylib.i.
+        """
+        return phylib.phylib_table.balls( self )
     
     # START OF A3:
     # SQL for storing tables, games, shots, players, etc
@@ -299,14 +356,739 @@ class Table( phylib.phylib_table ):
 
     # This helper method finds and returns the cue ball, which is the ball with number 0.
     def cueBall(self):
-        for ball in self:
-            if isinstance(ball, (StillBall, RollingBall)) and ball.obj.still_ball.number == 0:
-                return ball
-        return None  # If the cue ball is not found
+        # get_ball looks the ball up natively, without going through every object
+        ball = self.get_ball(0)
+        if ball is None:
+            return None  # If the cue ball is not found
+        ball.__class__ = StillBall if ball.type == STILL_BALL else RollingBall
+        return ball
+
+    def exportBalls( self ):
+        """
+        Returns every ball on the table, read in one native call, as a
+        memoryview of doubles of shape (balls, 8): number, type, x, y, vx,
+        vy, ax, ay, in the order of the objects. Still balls have a
+        velocity and acceleration of 0.
+        """
+        balls, data = self.export_balls();
+        data = memoryview( data ).cast( 'd' );
+        if balls:       # memoryview can't have a 0 in its shape
+            data = data.cast( 'B' ).cast( 'd', [ balls, 8 ] );
+        return data;
+
+    def importBalls( self, balls ):
+        """
+        Replaces every ball on the table, in one native call, by balls:
+        (number, type, x, y, vx, vy, ax, ay) rows as returned by
+        exportBalls(), either as a sequence of rows or a C-contiguous
+        buffer of doubles. type is STILL_BALL or ROLLING_BALL. Returns
+        the table.
+        """
+        try:
+            buffer = memoryview( balls );
+            if buffer.format != 'd' or not buffer.c_contiguous:
+                raise TypeError;
+        except TypeError:
+            # flatten the rows into one packed array of doubles
+            buffer = array.array( 'd', [ value for ball in balls for value in ball ] );
+        self.import_balls( buffer );
+        return self;
+
+    def shoot( self, xvel, yvel, engine=ENGINE_STEP ):
+        """
+        Strikes the cue ball with velocity (xvel, yvel) and simulates the
+        whole shot in one native call (phylib_shoot in phylib.c). Returns
+        the Table once every ball is at rest; this table is left untouched.
+        """
+        result = phylib.phylib_table.shoot( self, xvel, yvel, engine );
+        result.__class__ = Table;
+        result.current = -1;
+        return result;
+
+    def evaluate( self, velocities, engine=ENGINE_EVENT, threads=1 ):
+        """
+        Evaluates many candidate shots from this table in one native call,
+        without rendering or saving anything. velocities is a sequence of
+        (vx, vy) cue ball velocities, or a C-contiguous buffer of doubles
+        such as an (n, 2) numpy array. Uses the event-driven engine unless
+        told otherwise. The shots are spread over threads native threads
+        (0 uses every core) with the GIL released; the results are the same
+        for any number of threads. Returns two memoryviews of doubles (like
+        Shot.frames()): times[shot] is the table time once the balls are at
+        rest and positions[shot, ball] is (number, x, y) for every ball on
+        this table, with x and y set to nan if it was pocketed.
+        """
+        try:
+            buffer = memoryview( velocities );
+            if buffer.format != 'd' or not buffer.c_contiguous:
+                raise TypeError;
+        except TypeError:
+            # flatten the (vx, vy) pairs into one packed array of doubles
+            buffer = array.array( 'd', [ v for pair in velocities for v in pair ] );
+
+        shots, balls, times, positions = phylib.phylib_table.evaluate( self, buffer, engine, threads );
+        times = memoryview( times ).cast( 'd' );
+        positions = memoryview( positions ).cast( 'd' );
+        if shots and balls:     # memoryview can't have a 0 in its shape
+            positions = positions.cast( 'B' ).cast( 'd', [ shots, balls, 3 ] );
+        return times, positions;
+
+################################################################################
+
+def staticSVG():
+    """
+    Returns the part of a table's SVG that is the same on every table: the
+    HEADER, the cushions and the holes. It is only built the first time.
+    """
+    global STATIC_SVG
+    if STATIC_SVG is None:
+        STATIC_SVG = HEADER + ''.join( obj.svg() for obj in Table() if obj is not None )
+    return STATIC_SVG
+
+def ballFills( number ):
+    """
+    Returns the fill colours of ball number as ( still, rolling ), the
+    colours StillBall.svg() and RollingBall.svg() draw it with.
+    """
+    return ( STILL_BALL_COLOURS.get( number, "" ),
+             BALL_COLOURS[ number ] if number < len( BALL_COLOURS ) else "" )
+
+def ballsSVG( balls ):
+    """
+    Returns the SVG markup of balls, a list of (type, number, x, y) as
+    returned by Table.balls().
+    """
+    return ''.join( [ BALL_TEMPLATES[ (type, number) ] % (x, y) for type, number, x, y in balls ] )
+
+class FrameRenderer:
+    """
+    Renders the animation frames of a shot, like Table.svg(), but only
+    renders a frame again when a ball has moved since the previous frame.
+    """
+
+    def __init__( self ):
+        self.previous = None;
+        self.svg = None;
+
+    def render( self, table ):
+        """
+        Returns the SVG of table, the same string as for the previous frame
+        (without rendering it again) if its balls are exactly where they
+        were then.
+        """
+        balls = table.balls();
+        if balls != self.previous:
+            self.previous = balls;
+            self.svg = staticSVG() + ballsSVG( balls ) + FOOTER;
+        return self.svg;
+
+class FrameEncoder:
+    """
+    Encodes the animation frames of a shot into a compact binary stream,
+    instead of one SVG document per frame (see FrameRenderer). The stream
+    holds the SVG of the first frame once, then for every later frame only
+    the balls that moved, changed type or were pocketed. All numbers are
+    little-endian:
+
+        "PHYF", float32 frame interval, uint16 balls, uint32 frames
+        uint8 number of every ball
+        uint32 length + utf-8 SVG of the first frame
+        uint32 length + utf-8 fills: "still,rolling" per ball, ';' separated
+        per later frame: uint8 changes, then per change
+            uint8 ball, uint8 type, float32 x, float32 y
+
+    ball indexes the balls of the first frame, which are the last circles
+    of its SVG. type is the ball's phylib type, or PHYLIB_NO_OBJECT with x
+    and y set to nan once it has been pocketed.
+    """
+
+    POCKETED = ( phylib.PHYLIB_NO_OBJECT, math.nan, math.nan );
+
+    def __init__( self, interval=FRAME_INTERVAL ):
+        self.interval = interval;
+        self.svg = None;        # svg of the first frame
+        self.numbers = [];      # number of each ball of the first frame
+        self.previous = {};     # number -> (type, x, y) in the last frame
+        self.frames = [];       # encoded changes of every later frame
+
+    def render( self, table ):
+        """
+        Adds table as the next frame. Returns None: the frames are only
+        available together, from data().
+        """
+        balls = { number: ( type, x, y ) for type, number, x, y in table.balls() };
+        if self.svg is None:
+            self.svg = table.svg();
+            self.numbers = list( balls );
+            self.previous = balls;
+            return None;
+
+        changes = [];
+        for index, number in enumerate( self.numbers ):
+            ball = balls.get( number, self.POCKETED );
+            if ball != self.previous.get( number, self.POCKETED ):
+                changes.append( struct.pack( "<BBff", index, *ball ) );
+        self.frames.append( struct.pack( "<B", len( changes ) ) + b"".join( changes ) );
+        self.previous = balls;
+        return None;
+
+    def data( self ):
+        """
+        Returns the encoded stream of every frame added so far.
+        """
+        svg = ( self.svg or "" ).encode( "utf-8" );
+        fills = ";".join( "%s,%s" % ballFills( number ) for number in self.numbers ).encode( "utf-8" );
+        frames = len( self.frames ) + 1 if self.svg is not None else 0;
+        return b"".join( [ FRAME_MAGIC,
+                           struct.pack( "<fHI", self.interval, len( self.numbers ), frames ),
+                           bytes( self.numbers ),
+                           struct.pack( "<I", len( svg ) ), svg,
+                           struct.pack( "<I", len( fills ) ), fills ] + self.frames );
+
+################################################################################
+
+class Shot( phylib.phylib_arena ):
+    """
+    A whole shot simulated in native code. run() strikes the cue ball and
+    simulates every segment in a single call; the tables are kept in a
+    native arena that is reused by the next run().
+    shot[0] is the struck table and shot[i] the table after segment i.
+    """
+
+    def __init__( self ):
+        """
+        Shot constructor method. Calls the phylib_arena constructor.
+        """
+        phylib.phylib_arena.__init__( self );
+
+    def run( self, table, xvel, yvel, engine=ENGINE_STEP ):
+        """
+        Strikes the cue ball of table with velocity (xvel, yvel) and
+        simulates the shot until every ball is at rest. table is left
+        untouched. Returns the number of segments.
+        """
+        return self.shoot( table, xvel, yvel, engine );
+
+    def __len__( self ):
+        """
+        Number of tables in the shot (the struck table plus one per segment).
+        """
+        return self.count;
+
+    @property
+    def nbytes( self ):
+        """
+        Memory held by the shot's arena, in bytes.
+        """
+        return self.capacity * STATE_SIZE;
+
+    def __getitem__( self, index ):
+        """
+        Returns table number index of the shot as a Table object.
+        """
+        if index < 0:
+            index += self.count;
+        result = self.get_table( index );
+        result.__class__ = Table;
+        result.current = -1;
+        return result;
+
+    def segments( self ):
+        """
+        Returns the table at the end of every segment, in order.
+        """
+        return [ self[i] for i in range( 1, self.count ) ];
+
+    def final( self ):
+        """
+        Returns the table once every ball is at rest.
+        """
+        return self[ self.count - 1 ];
+
+    def keyframes( self, offset=0.0 ):
+        """
+        Returns the shot as keyframes, one per table of the shot: the time
+        (plus offset) the table starts at and [number, type, x, y, vx, vy,
+        ax, ay] for every ball on it. Between two keyframes every ball rolls
+        in closed form (see phylib_roll), so any frame of the shot can be
+        computed from the keyframe before it.
+        """
+        keyframes = [];
+        for index in range( self.count ):
+            table = self[ index ];
+            balls = [];
+            for obj in table:
+                if isinstance( obj, RollingBall ):
+                    ball = obj.obj.rolling_ball;
+                    balls.append( [ ball.number, obj.type, ball.pos.x, ball.pos.y,
+                                    ball.vel.x, ball.vel.y, ball.acc.x, ball.acc.y ] );
+                elif isinstance( obj, StillBall ):
+                    ball = obj.obj.still_ball;
+                    balls.append( [ ball.number, obj.type, ball.pos.x, ball.pos.y,
+                                    0.0, 0.0, 0.0, 0.0 ] );
+            keyframes.append( { "time": table.time + offset, "balls": balls } );
+        return keyframes;
+
+    def frames( self, interval=FRAME_INTERVAL ):
+        """
+        Samples every animation frame of the shot in native code, the same
+        frames Table.roll() produces in Game.shoot(). Returns two
+        memoryviews of doubles (usable with numpy.asarray):
+        times[frame] is the table time of each frame and
+        positions[frame, ball] is (number, x, y) for every ball of the
+        struck table, with x and y set to nan once it drops into a hole.
+        """
+        frames, balls, times, positions = self.sample( interval );
+        times = memoryview( times ).cast( 'd' );
+        positions = memoryview( positions ).cast( 'd' );
+        if frames and balls:    # memoryview can't have a 0 in its shape
+            positions = positions.cast( 'B' ).cast( 'd', [ frames, balls, 3 ] );
+        return times, positions;
+
+def packShot( tables ):
+    """
+    Packs the tables of a shot (normally the struck table and the table
+    after every segment, see Shot) into one compact blob. Any frame in
+    between is computed back with Table.roll(), so the frames themselves
+    are never stored. All numbers are little-endian:
+
+        "PHYS", uint16 version, uint32 tables
+        zlib compressed, per table:
+            float64 time, uint16 balls, then per ball
+            float64 number, type, x, y, vx, vy, ax, ay
+
+    the balls are stored exactly as Table.exportBalls() returns them.
+    """
+    body = [];
+    for table in tables:
+        balls = table.exportBalls();
+        body.append( struct.pack( "<dH", table.time, len( balls ) ) );
+        body.append( balls.tobytes() );
+    return SHOT_MAGIC + struct.pack( "<HI", SHOT_VERSION, len( tables ) ) + \
+           zlib.compress( b"".join( body ) );
+
+def unpackShot( data ):
+    """
+    Returns the list of tables packed in data by packShot(). Raises
+    ValueError if data is not a packed shot of a known version.
+    """
+    return list( PackedShot( data ) );
+
+class PackedShot:
+    """
+    A shot packed by packShot(), e.g. simulated somewhere else and sent
+    back (see SimulationPool). Reads like a Shot: shot[0] is the struck
+    table and shot[i] the table after segment i. Only the ball rows are
+    kept (nbytes bytes); every shot[i] is a new Table built from them, so
+    the tables can be changed like the ones a Shot returns. Raises
+    ValueError if data is not a packed shot of a known version.
+    """
+
+    def __init__( self, data ):
+        data = bytes( data );
+        if data[ :4 ] != SHOT_MAGIC or len( data ) < 10:
+            raise ValueError( "not a packed shot" );
+        version, count = struct.unpack_from( "<HI", data, 4 );
+        if version != SHOT_VERSION:
+            raise ValueError( "unsupported packed shot version %d" % version );
+
+        self.body = zlib.decompress( data[ 10: ] );
+        self.tables = [];       # (time, offset of the first ball, balls) of every table
+        offset = 0;
+        for i in range( count ):
+            time, balls = struct.unpack_from( "<dH", self.body, offset );
+            offset += 10;
+            self.tables.append( ( time, offset, balls ) );
+            offset += balls * 64;
+        self.count = count;
+        self.nbytes = len( self.body );
+
+    def __len__( self ):
+        return self.count;
+
+    def __getitem__( self, index ):
+        """
+        Returns table number index of the shot as a new Table.
+        """
+        time, offset, balls = self.tables[ index ];
+        table = Table();
+        table.time = time;
+        return table.importBalls( memoryview( self.body )[ offset : offset + balls * 64 ].cast( 'd' ) );
+
+    segments = Shot.segments;
+    final = Shot.final;
+    keyframes = Shot.keyframes;
+
+def simulateShot( balls, time, xvel, yvel, engine=ENGINE_STEP ):
+    """
+    Simulates the shot struck with velocity (xvel, yvel) on the table
+    holding balls (the bytes of Table.exportBalls()) at time. Returns it
+    packed by packShot(), ready to be sent to another process.
+    """
+    table = Table().importBalls( memoryview( balls ).cast( 'd' ) );
+    table.time = time;
+    shot = Shot();
+    shot.run( table, xvel, yvel, engine );
+    return packShot( [ shot[ i ] for i in range( len( shot ) ) ] );
+
+################################################################################
+
+class ShotCache:
+    """
+    LRU cache of simulated shots, keyed on the engine, the cue velocity and
+    the number, type, position and velocity of every ball. By default a
+    shot is only reused for exactly the same table and cue velocity. Given
+    a tolerance (mm) and velocityTolerance (mm/s), positions and velocities
+    are first quantized to cells of that size, so all the tables falling
+    in the same cells share the shot simulated from the first of them.
+    The cells of every ball are centred on where it is in origin (a Table,
+    e.g. the rack every game starts from, see server.py), or on 0 if it
+    isn't there. The cached Shot's table times start at that table's time.
+    The cached shots are kept under maxBytes (their nbytes), evicting the
+    least recently used first.
+    """
+
+    def __init__( self, maxBytes=64*1024*1024, tolerance=0.0, velocityTolerance=0.0, origin=None ):
+        self.maxBytes = maxBytes;
+        self.tolerance = tolerance;
+        self.velocityTolerance = velocityTolerance;
+        self.origin = {};                        # ball number -> (x, y) its cells are centred on
+        if origin is not None:
+            for number, _, x, y, _, _ in self.balls( origin ):
+                self.origin[ number ] = ( x, y );
+        self.shots = collections.OrderedDict();  # key -> (Shot, size in bytes)
+        self.bytes = 0;
+        self.hits = 0;
+        self.misses = 0;
+        self.lock = threading.Lock();
+
+    def balls( self, table ):
+        """
+        Returns (number, type, x, y, vx, vy) of every ball of table, in
+        order of number.
+        """
+        balls = [];
+        for obj in table:
+            if isinstance( obj, (StillBall, RollingBall) ):
+                ball = obj.obj.rolling_ball;
+                vel = (0.0, 0.0) if isinstance( obj, StillBall ) else (ball.vel.x, ball.vel.y);
+                balls.append( ( ball.number, obj.type, ball.pos.x, ball.pos.y, vel[0], vel[1] ) );
+        balls.sort();
+        return balls;
+
+    def quantize( self, value, tolerance, centre=0.0 ):
+        """
+        Returns the cell of size tolerance, counted from the one centred on
+        centre, that value falls in; value itself if tolerance is 0.
+        """
+        if not tolerance:
+            return value;
+        return round( ( value - centre ) / tolerance );
+
+    def key( self, table, xvel, yvel, engine ):
+        """
+        Returns the canonical fingerprint of a shot: the engine, the
+        quantized cue velocity and the number, type and quantized position
+        and velocity of every ball, in order of number.
+        """
+        balls = [];
+        for number, type, x, y, vx, vy in self.balls( table ):
+            centre = self.origin.get( number, ( 0.0, 0.0 ) );
+            balls.append( ( number, type,
+                            self.quantize( x, self.tolerance, centre[0] ),
+                            self.quantize( y, self.tolerance, centre[1] ),
+                            self.quantize( vx, self.velocityTolerance ),
+                            self.quantize( vy, self.velocityTolerance ) ) );
+        return ( engine, self.quantize( xvel, self.velocityTolerance ),
+                 self.quantize( yvel, self.velocityTolerance ), tuple( balls ) );
+
+    def run( self, table, xvel, yvel, engine=ENGINE_STEP, simulate=None ):
+        """
+        Returns the Shot for striking the cue ball of table with velocity
+        (xvel, yvel), simulating it only if its key isn't cached yet.
+        The returned Shot is shared and must not be run() again. If given,
+        simulate( table, xvel, yvel, engine ) returns the shot instead of
+        a new Shot being run here (see SimulationPool.run()).
+        """
+        key = self.key( table, xvel, yvel, engine );
+        with self.lock:
+            cached = self.shots.get( key );
+            if cached is not None:
+                self.shots.move_to_end( key );
+                self.hits += 1;
+                return cached[ 0 ];
+            self.misses += 1;
+
+        if simulate is not None:
+            shot = simulate( table, xvel, yvel, engine );
+        else:
+            shot = Shot();
+            shot.run( table, xvel, yvel, engine );
+        size = shot.nbytes;
+
+        with self.lock:
+            if key not in self.shots and size <= self.maxBytes:
+                self.shots[ key ] = ( shot, size );
+                self.bytes += size;
+                # evict the least recently used shots until we fit again
+                while self.bytes > self.maxBytes:
+                    _, ( _, evicted ) = self.shots.popitem( last=False );
+                    self.bytes -= evicted;
+        return shot;
+
+    def stats( self ):
+        """
+        Returns the hit/miss counters and the current size of the cache.
+        """
+        with self.lock:
+            return { "hits": self.hits, "misses": self.misses,
+                     "shots": len( self.shots ), "bytes": self.bytes };
+
+    def clear( self ):
+        """
+        Drops every cached shot (the counters are kept).
+        """
+        with self.lock:
+            self.shots.clear();
+            self.bytes = 0;
+
+class ShotFrames:
+    """
+    The animation frames of a shot, computed on demand from its segments
+    (the struck table and the table after every segment, see Shot and
+    packShot()) instead of all at once. Frame i is the table Game.shoot()
+    rolls for its i-th frame; the last frame is the final table.
+    """
+
+    def __init__( self, segments, interval=FRAME_INTERVAL ):
+        self.segments = segments;
+        self.interval = interval;
+        self.starts = [];       # first frame of every segment
+        count = 0;
+        for start, end in zip( segments, segments[ 1: ] ):
+            self.starts.append( count );
+            count += max( int( ( end.time - start.time ) / interval ), 0 );
+        self.count = count + 1 if segments else 0;
+
+    def __len__( self ):
+        return self.count;
+
+    def __getitem__( self, index ):
+        """
+        Returns frame number index as a Table, rolled from its segment.
+        """
+        if index < 0:
+            index += self.count;
+        if not 0 <= index < self.count:
+            raise IndexError( "frame index out of range" );
+        if index == self.count - 1:
+            return self.segments[ -1 ];
+
+        segment = bisect.bisect_right( self.starts, index ) - 1;
+        start = self.segments[ segment ];
+        frameTime = ( index - self.starts[ segment ] ) * self.interval;
+        table = start.roll( frameTime );
+        table.time = start.time + frameTime;
+        return table;
+
+class FramePages:
+    """
+    Serves the frames of saved shots a page (range of frames) at a time,
+    rendering them lazily with ShotFrames. Both the frames of the last
+    maxShots shots and the SVG of the last maxPages pages are kept, so a
+    page asked for again (or by another viewer) is not rendered again.
+    """
+
+    def __init__( self, db, maxShots=16, maxPages=64 ):
+        self.db = db;
+        self.maxShots = maxShots;
+        self.maxPages = maxPages;
+        self.shots = collections.OrderedDict();  # shot ID -> ShotFrames (or list of frame tables)
+        self.pages = collections.OrderedDict();  # (shot ID, start, stop) -> list of SVG
+        self.lock = threading.Lock();
+
+    def remember( self, cache, key, value, limit ):
+        with self.lock:
+            cache[ key ] = value;
+            cache.move_to_end( key );
+            while len( cache ) > limit:
+                cache.popitem( last=False );
+        return value;
+
+    def recall( self, cache, key ):
+        with self.lock:
+            if key in cache:
+                cache.move_to_end( key );
+                return cache[ key ];
+        return None;
+
+    def add( self, shotID, frames ):
+        """
+        Adds the frames of a shot that was just played, so its pages are
+        served without reading it back from the database.
+        """
+        return self.remember( self.shots, shotID, frames, self.maxShots );
+
+    def frames( self, shotID ):
+        """
+        Returns the frames of a shot: a ShotFrames for shots saved packed,
+        the list of saved frame tables otherwise, or None for an unknown
+        shot.
+        """
+        frames = self.recall( self.shots, shotID );
+        if frames is None:
+            segments = self.db.readShotData( shotID );
+            frames = ShotFrames( segments ) if segments else self.db.readShotFrames( shotID );
+            if not frames:
+                return None;
+            self.add( shotID, frames );
+        return frames;
+
+    def page( self, shotID, start, stop ):
+        """
+        Returns ( number of frames of the shot, SVG of frames start to
+        stop ), or None for an unknown shot.
+        """
+        frames = self.frames( shotID );
+        if frames is None:
+            return None;
+        start, stop = max( start, 0 ), min( stop, len( frames ) );
+        svg = self.recall( self.pages, ( shotID, start, stop ) );
+        if svg is None:
+            svg = [ frames[ index ].svg() for index in range( start, stop ) ];
+            self.remember( self.pages, ( shotID, start, stop ), svg, self.maxPages );
+        return len( frames ), svg;
 
 #######################################################################################################
 
 # A class representing a connection to a database that stores table information and tables
+# sqlite3.Connection can't be weakly referenced, this subclass can (see ConnectionManager.open)
+class ManagedConnection(sqlite3.Connection):
+    pass
+
+# Hands every thread its own connection (and cursor) to a database file, opened once and reused by every Database
+# of that thread, so no connection is ever shared between threads or reopened for each Database(). Connections
+# use WAL journaling, so readers never block the writer nor the writer the readers, and wait for a lock for up
+# to timeout seconds instead of failing with "database is locked". A thread's connections close when it ends
+class ConnectionManager:
+
+    def __init__(self, timeout=30.0, cacheSize=16384, statements=256):
+        self.timeout = timeout
+        # Page cache of every connection, in KiB
+        self.cacheSize = cacheSize
+        # Prepared statements each connection keeps for reuse, looked up by their SQL text
+        self.statements = statements
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Every connection still open, from any thread, so closeAll() can reach them
+        self.open = weakref.WeakSet()
+
+    # Returns this thread's (connection, cursor) to the database file name, opening it the first time
+    def get(self, name):
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        entry = connections.get(name)
+        if entry is None or entry[0].closed:
+            entry = connections[name] = self.connect(name)
+        return entry
+
+    # Opens a new connection to name with the journaling and pragmas described above
+    def connect(self, name):
+        # check_same_thread is off only so closeAll() can close it, it is still only used by one thread
+        conn = sqlite3.connect(name, timeout=self.timeout, cached_statements=self.statements,
+                               check_same_thread=False, factory=ManagedConnection)
+        conn.closed = False
+        conn.file = os.path.abspath(name)
+        # Lets Database.compact() give freed pages back a few at a time. Only takes effect on a new database, and
+        # only before it is switched to WAL; an existing one needs a full VACUUM first (see Database.compact()).
+        # Setting it takes the write lock, so it is left alone on an existing one: a new thread connecting while
+        # another one writes would otherwise wait for the whole write
+        if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        # With WAL, NORMAL only syncs at checkpoints: a commit is durable unless the OS itself crashes
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cacheSize)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        with self.lock:
+            self.open.add(conn)
+        return conn, conn.cursor()
+
+    # Commits and closes this thread's connection to name, the next get() opens a new one
+    def close(self, name):
+        entry = getattr(self.local, "connections", {}).pop(name, None)
+        if entry is not None and not entry[0].closed:
+            entry[0].commit()
+            self.release(entry[0])
+
+    # Closes the connection of every thread to name, e.g. before the file is removed. Uncommitted work is lost
+    def closeAll(self, name):
+        with self.lock:
+            connections = list(self.open)
+        for conn in connections:
+            if conn.file == os.path.abspath(name):
+                self.release(conn)
+
+    # Closes conn for good and forgets it
+    def release(self, conn):
+        conn.closed = True
+        conn.close()
+        with self.lock:
+            self.open.discard(conn)
+
+# The connections of every Database
+CONNECTIONS = ConnectionManager()
+
+# LRU cache of the tables read by Database.readTable() and readTables(), so a replay that reads the same tables again
+# doesn't query them again. Tables are kept as their time and exportBalls() data: every read still returns a new Table,
+# built in one native call. Holds at most maxTables tables (about 1 KiB each), of every database file
+class TableCache:
+
+    def __init__(self, maxTables=4096):
+        self.maxTables = maxTables
+        self.tables = collections.OrderedDict()  # (database name, table ID) -> (time, ball data)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Returns a new Table for a cached table, or None if it isn't cached
+    def get(self, name, tableID):
+        with self.lock:
+            entry = self.tables.get((name, tableID))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.tables.move_to_end((name, tableID))
+            self.hits += 1
+        table = Table()
+        table.time = entry[0]
+        return table.importBalls(memoryview(entry[1]).cast('d'))
+
+    def put(self, name, tableID, table):
+        entry = (table.time, table.exportBalls().tobytes())
+        with self.lock:
+            self.tables[(name, tableID)] = entry
+            self.tables.move_to_end((name, tableID))
+            # evict the least recently used tables until we fit again
+            while len(self.tables) > self.maxTables:
+                self.tables.popitem(last=False)
+
+    # Forgets the given tables of a database, after they were written or deleted
+    def discard(self, name, tableIDs):
+        with self.lock:
+            for tableID in tableIDs:
+                self.tables.pop((name, tableID), None)
+
+    # Forgets every table of a database
+    def clear(self, name):
+        with self.lock:
+            for key in [key for key in self.tables if key[0] == name]:
+                del self.tables[key]
+
+# The tables read by every Database
+TABLE_CACHE = TableCache()
+
 class Database:
 
     # Initialize a new Database instance.
@@ -317,13 +1099,23 @@ class Database:
         
         # Check if the database reset clause is true and if the database exists
         if reset and os.path.isfile(self.databaseName):
-            # If so, remove the current database
-            os.remove(self.databaseName)
-
-        # Establish connection to the database file. 'conn' short for connection
-        self.conn = sqlite3.connect(self.databaseName)
-        # Establish cursor to interact with the database
-        self.cursor = self.conn.cursor() # Cursor
+            # If so, close every connection to it and remove the current database along with its WAL files
+            CONNECTIONS.closeAll(self.databaseName)
+            TABLE_CACHE.clear(self.databaseName)
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.isfile(self.databaseName + suffix):
+                    os.remove(self.databaseName + suffix)
+
+    # Connection to the database file, 'conn' short for connection. Each thread gets its own from CONNECTIONS,
+    # so a Database (like Game.db) can be shared by every thread
+    @property
+    def conn(self):
+        return CONNECTIONS.get(self.databaseName)[0]
+
+    # Cursor to interact with the database, also one per thread
+    @property
+    def cursor(self):
+        return CONNECTIONS.get(self.databaseName)[1]
 
     # Creates the database with all the necessary tables to store information about the game if they don't exist
     def createDB(self):
@@ -377,6 +1169,24 @@ class Database:
                                 );
                             """ )
         
+        # Each row in this table holds every table of a shot, packed into one blob by packShot(). Used instead of
+        # TTable, Ball, BallTable and TableShot rows when the shot is saved with writeShotData()
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS ShotData (
+                                    SHOTID  INTEGER PRIMARY KEY NOT NULL,
+                                    DATA    BLOB    NOT NULL,
+                                    FOREIGN KEY (SHOTID) REFERENCES Shot 
+                                );
+                            """ )
+
+        # The table a game was left at when it was put away (see saveGameTable()), one row per game
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS GameTable (
+                                    GAMEID  INTEGER PRIMARY KEY NOT NULL,
+                                    TABLEID INTEGER NOT NULL,
+                                    FOREIGN KEY (GAMEID) REFERENCES Game,
+                                    FOREIGN KEY (TABLEID) REFERENCES TTable 
+                                );
+                            """ )
+
         # Connects GAMEID's to GAMENAME's 
         self.cursor.execute("""CREATE TABLE IF NOT EXISTS Game (
                                     GAMEID   INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
@@ -396,10 +1206,49 @@ class Database:
         # Commit changes made by SQLite3 execution statements
         self.conn.commit()
 
+        # Add the indexes to databases created before them
+        self.migrateDB()
+
+    # Brings the schema of an existing database up to SCHEMA_VERSION. Each step runs once, in order, and
+    # records the version it reached in PRAGMA user_version, so createDB() can call it every time
+    def migrateDB(self):
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+
+        if version < 1:
+            # Without these every lookup below is a full scan that gets slower as the history grows:
+            # the balls of a table (readTable), the tables of a shot (readShotFrames), and the games
+            # and players looked up by name (newShot) or joined by game (getGame)
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS BallTableByTable ON BallTable (TABLEID, BALLID)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS TableShotByShot ON TableShot (SHOTID, TABLEID)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS GameByName ON Game (GAMENAME)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS PlayerByName ON Player (PLAYERNAME)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS PlayerByGame ON Player (GAMEID)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS ShotByGame ON Shot (GAMEID)")
+
+        if version < 2:
+            # When each shot was played, so compact() can tell finished games, and whether it has been compacted.
+            # Shots saved before this migration count as played now
+            self.cursor.execute("ALTER TABLE Shot ADD COLUMN CREATED FLOAT")
+            self.cursor.execute("ALTER TABLE Shot ADD COLUMN COMPACTED INTEGER NOT NULL DEFAULT 0")
+            self.cursor.execute("UPDATE Shot SET CREATED = ?", (time.time(),))
+
+        if version < 3:
+            # removeOrphans() looks up every Ball by its BALLID in BallTable; without this each lookup scans BallTable
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS BallTableByBall ON BallTable (BALLID)")
+
+        if version < SCHEMA_VERSION:
+            self.cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.commit()
+
     # This method queries the database for a table snapshot and all associated balls, 
     # then constructs a Table object with the state of the pool table at the given ID.
     def readTable(self, tableID):
 
+        # Tables read before are rebuilt from the cache, without any query
+        table = TABLE_CACHE.get(self.databaseName, tableID)
+        if table is not None:
+            return table
+
         try:
             # Retrieve the time for the specified table ID, offset by 1 because SQL autoincrement
             # starts at 1 but tableID starts at 0.
@@ -425,33 +1274,9 @@ class Database:
                 WHERE BallTable.TABLEID = ?
                 """, (tableID,))
 
-            # Iterate through all the ball rows and create Ball objects
-            for row in self.cursor.fetchall():
-                ball_no, x, y, x_vel, y_vel = row
-
-                # Determine if the ball is still or rolling based on velocity
-                if x_vel is None and y_vel is None:
-                    # Still balls have no velocity
-                    pos = Coordinate(x, y)
-                    ball = StillBall(ball_no, pos)
-                else:
-                    # Rolling balls DO have velocity
-                    pos = Coordinate(x, y)
-                    vel = Coordinate(x_vel, y_vel)
-
-                    # Calculate the acceleration of the rolling ball the exact way as in A2
-                    speed = (x_vel**2 + y_vel**2)**0.5
-                    if speed > VEL_EPSILON:
-                        acc_x = -(x_vel / speed) * DRAG
-                        acc_y = -(y_vel / speed) * DRAG
-                    else:
-                        acc_x = acc_y = 0
-
-                    acc = Coordinate(acc_x, acc_y)
-                    ball = RollingBall(ball_no, pos, vel, acc)
-
-                # Add the ball object to the table
-                table += ball
+            # Turn every ball row into a (number, type, x, y, vx, vy, ax, ay) row and add them all in one call
+            table.importBalls([self.ballRow(*row) for row in self.cursor.fetchall()])
+            TABLE_CACHE.put(self.databaseName, tableID, table)
 
             # Commit
             self.conn.commit()
@@ -463,6 +1288,83 @@ class Database:
             print(f"An error occurred: {error.args[0]}")
             return None
 
+    # Turns the BALLNO, XPOS, YPOS, XVEL and YVEL of a Ball row into the (number, type, x, y, vx, vy, ax, ay)
+    # row Table.importBalls() takes
+    def ballRow(self, ball_no, x, y, x_vel, y_vel):
+        # Determine if the ball is still or rolling based on velocity
+        if x_vel is None and y_vel is None:
+            # Still balls have no velocity
+            return (ball_no, STILL_BALL, x, y, 0.0, 0.0, 0.0, 0.0)
+
+        # Calculate the acceleration of the rolling ball the exact way as in A2
+        speed = (x_vel**2 + y_vel**2)**0.5
+        if speed > VEL_EPSILON:
+            acc_x = -(x_vel / speed) * DRAG
+            acc_y = -(y_vel / speed) * DRAG
+        else:
+            acc_x = acc_y = 0
+        return (ball_no, ROLLING_BALL, x, y, x_vel, y_vel, acc_x, acc_y)
+
+    # Returns every frame (table) saved for a shot by writeShotTables() or recordTableShot(), in order, read with
+    # a single query instead of one readTable() per frame. Returns an empty list if the shot has no frames
+    def readShotFrames(self, shotID):
+        # One row per ball of every table of the shot; a table without balls still has a row with a NULL BALLNO
+        self.cursor.execute("""
+            SELECT TableShot.TABLEID, TTable.TIME, Ball.BALLNO, Ball.XPOS, Ball.YPOS, Ball.XVEL, Ball.YVEL
+            FROM TableShot
+            INNER JOIN TTable ON TTable.TABLEID = TableShot.TABLEID + 1
+            LEFT JOIN BallTable ON BallTable.TABLEID = TableShot.TABLEID
+            LEFT JOIN Ball ON Ball.BALLID = BallTable.BALLID
+            WHERE TableShot.SHOTID = ?
+            ORDER BY TableShot.TABLEID, BallTable.BALLID
+            """, (shotID,))
+        return [table for _, table in self.buildTables(self.cursor.fetchall())]
+
+    # Returns the tables with IDs start to end (excluded), like readTable() for each of them (None for the IDs
+    # without a table), but reads every table that isn't cached with one query and builds them in a single pass
+    def readTables(self, start, end):
+        tables = [TABLE_CACHE.get(self.databaseName, tableID) for tableID in range(start, end)]
+        missing = [start + index for index, table in enumerate(tables) if table is None]
+        if not missing:
+            return tables
+
+        # Only the span of the missing tables is read, offset by 1 like in readTable()
+        self.cursor.execute("""
+            SELECT TTable.TABLEID - 1, TTable.TIME, Ball.BALLNO, Ball.XPOS, Ball.YPOS, Ball.XVEL, Ball.YVEL
+            FROM TTable
+            LEFT JOIN BallTable ON BallTable.TABLEID = TTable.TABLEID - 1
+            LEFT JOIN Ball ON Ball.BALLID = BallTable.BALLID
+            WHERE TTable.TABLEID BETWEEN ? AND ?
+            ORDER BY TTable.TABLEID, BallTable.BALLID
+            """, (missing[0] + 1, missing[-1] + 1))
+        for tableID, table in self.buildTables(self.cursor.fetchall()):
+            if tables[tableID - start] is None:
+                tables[tableID - start] = table
+                TABLE_CACHE.put(self.databaseName, tableID, table)
+        return tables
+
+    # Builds a Table from every group of (TABLEID, TIME, BALLNO, XPOS, YPOS, XVEL, YVEL) rows with the same TABLEID,
+    # in a single pass over the rows. A NULL BALLNO is a table without balls. Returns (TABLEID, Table) pairs
+    def buildTables(self, rows):
+        tables = []
+        tableID, time, balls = None, None, []
+        for row in rows:
+            if row[0] != tableID:
+                if tableID is not None:
+                    tables.append((tableID, self.frameTable(time, balls)))
+                tableID, time, balls = row[0], row[1], []
+            if row[2] is not None:
+                balls.append(self.ballRow(*row[2:]))
+        if tableID is not None:
+            tables.append((tableID, self.frameTable(time, balls)))
+        return tables
+
+    # Builds the Table of one group of rows read by buildTables()
+    def frameTable(self, time, balls):
+        table = Table()
+        table.time = time
+        return table.importBalls(balls)
+
     # This method inserts the current state of the table, including time and all ball positions and velocities,
     # into the database's TTable and Ball tables. It automatically generates IDs for the new table
     # and ball states and links them together in the BallTable relation.    
@@ -472,42 +1374,37 @@ class Database:
         tableID = self.cursor.lastrowid
         # print(tableID)
 
-        # Iterate over all balls in the table
-        for obj in table:
-            # Check if the object is a StillBall or RollingBall
-            if isinstance(obj, StillBall) or isinstance(obj, RollingBall):
-                # Get ball number and position
-                ballID = obj.obj.still_ball.number
-                x_pos, y_pos = obj.obj.still_ball.pos.x, obj.obj.still_ball.pos.y
-                
-                # Get the velocity only from RollingBall's. StillBall velocity is None since they do not have one
-                x_vel, y_vel = (None, None) if isinstance(obj, StillBall) else (obj.obj.rolling_ball.vel.x, obj.obj.rolling_ball.vel.y)
-
-                # Insert the ball into the Ball table
-                self.cursor.execute("""
-                    INSERT INTO Ball (BALLNO, XPOS, YPOS, XVEL, YVEL)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (ballID, x_pos, y_pos, x_vel, y_vel))
-
-                # Get the generated ID for the new ball
-                ballRowID = self.cursor.lastrowid
-                # print(ballRowID)
-
-                # Link the new ball with the new table in BallTable
-                self.cursor.execute("""
-                    INSERT INTO BallTable (BALLID, TABLEID)
-                    VALUES (?, ?)
-                """, (ballRowID, tableID-1))
+        # Read every ball of the table in one call
+        for ballID, ballType, x_pos, y_pos, x_vel, y_vel, _, _ in table.exportBalls().tolist():
+            # StillBall velocity is None since they do not have one
+            if ballType == STILL_BALL:
+                x_vel, y_vel = None, None
+
+            # Insert the ball into the Ball table
+            self.cursor.execute("""
+                INSERT INTO Ball (BALLNO, XPOS, YPOS, XVEL, YVEL)
+                VALUES (?, ?, ?, ?, ?)
+            """, (int(ballID), x_pos, y_pos, x_vel, y_vel))
+
+            # Get the generated ID for the new ball
+            ballRowID = self.cursor.lastrowid
+
+            # Link the new ball with the new table in BallTable
+            self.cursor.execute("""
+                INSERT INTO BallTable (BALLID, TABLEID)
+                VALUES (?, ?)
+            """, (ballRowID, tableID-1))
 
         # Commit
         self.conn.commit()
+        # A table ID is never reused, but don't serve anything cached under it
+        TABLE_CACHE.discard(self.databaseName, [tableID - 1])
         # Return the SQL adjusted table ID
         return tableID - 1
 
-    # Method to simply commit the database connection and close it
+    # Method to simply commit this thread's database connection and close it
     def close(self):
-        self.conn.commit()
-        self.conn.close()
+        CONNECTIONS.close(self.databaseName)
 
     # Retrieves the game name and player names for a specific game ID.
     def getGame(self, gameID):
@@ -579,7 +1476,7 @@ class Database:
         playerID = player_row[0]
 
         # Insert a new shot for the player in the current game
-        self.cursor.execute("INSERT INTO Shot (PLAYERID, GAMEID) VALUES (?, ?)", (playerID, gameID))
+        self.cursor.execute("INSERT INTO Shot (PLAYERID, GAMEID, CREATED) VALUES (?, ?, ?)", (playerID, gameID, time.time()))
         # Commit
         self.conn.commit()
 
@@ -597,10 +1494,411 @@ class Database:
         except sqlite3.Error as error:
             # Safety net to catch SQL errors. Mainly for testing/debugging reasons
             print(f"An error occurred while recording TableShot: {error}")
+
+    # Returns the next ID an AUTOINCREMENT column of table would assign, so rows can be inserted with their IDs
+    # already known. Must be called inside the transaction that inserts them
+    def nextID(self, table, column):
+        self.cursor.execute(f"SELECT COALESCE(MAX({column}), 0) FROM {table}")
+        largest = self.cursor.fetchone()[0]
+        # AUTOINCREMENT never reuses the IDs of deleted rows either
+        self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ? COLLATE NOCASE", (table,))
+        row = self.cursor.fetchone()
+        return max(largest, row[0] if row else 0) + 1
+
+    # Batched version of writeTable() and recordTableShot() for every table (frame) of a shot. All the TTable, Ball,
+    # BallTable and TableShot rows are written with executemany in one transaction, with their IDs assigned up front
+    # instead of read back from lastrowid. Either every row is written or, on an error, none is. Returns the table IDs
+    def writeShotTables(self, shotID, tables):
+        tableRows, ballRows, ballTableRows, tableShotRows = [], [], [], []
+        try:
+            # Commit anything pending and take the write lock, so no one else can use the IDs we assign
+            self.conn.commit()
+            self.cursor.execute("BEGIN IMMEDIATE")
+            tableID = self.nextID("TTable", "TABLEID")
+            ballID = self.nextID("Ball", "BALLID")
+
+            for table in tables:
+                tableRows.append((tableID, table.time))
+                for ballNo, ballType, x_pos, y_pos, x_vel, y_vel, _, _ in table.exportBalls().tolist():
+                    # StillBall velocity is None since they do not have one
+                    if ballType == STILL_BALL:
+                        x_vel, y_vel = None, None
+                    ballRows.append((ballID, int(ballNo), x_pos, y_pos, x_vel, y_vel))
+                    # Same SQL adjusted (0-based) table IDs as writeTable() and recordTableShot()
+                    ballTableRows.append((ballID, tableID - 1))
+                    ballID += 1
+                tableShotRows.append((tableID - 1, shotID))
+                tableID += 1
+
+            self.cursor.executemany("INSERT INTO TTable (TABLEID, TIME) VALUES (?, ?)", tableRows)
+            self.cursor.executemany("""
+                INSERT INTO Ball (BALLID, BALLNO, XPOS, YPOS, XVEL, YVEL)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, ballRows)
+            self.cursor.executemany("INSERT INTO BallTable (BALLID, TABLEID) VALUES (?, ?)", ballTableRows)
+            self.cursor.executemany("INSERT INTO TableShot (TABLEID, SHOTID) VALUES (?, ?)", tableShotRows)
+            self.conn.commit()
+
+        except BaseException:
+            # All or nothing: drop every row of the batch
+            self.conn.rollback()
+            raise
+
+        tableIDs = [tableID for tableID, _ in tableShotRows]
+        TABLE_CACHE.discard(self.databaseName, tableIDs)
+        return tableIDs
+
+    # Saves the table a game is at with writeTable(), so the game can be put away and picked up again later with
+    # loadGameTable(). Returns the table ID
+    def saveGameTable(self, gameID, table):
+        tableID = self.writeTable(table)
+        self.cursor.execute("INSERT OR REPLACE INTO GameTable (GAMEID, TABLEID) VALUES (?, ?)", (gameID, tableID))
+        self.conn.commit()
+        return tableID
+
+    # Returns the table last saved for a game by saveGameTable(), or None if there is none
+    def loadGameTable(self, gameID):
+        self.cursor.execute("SELECT TABLEID FROM GameTable WHERE GAMEID = ?", (gameID,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        return self.readTable(row[0])
+
+    # Retention job for games nobody has played for maxAge seconds. The frames of each of their shots are cut down
+    # to the first frame after every collision (the segment boundaries) and the final table: every frame dropped
+    # can be rolled back from the frame kept before it, to within tolerance mm. With downsample=False only the
+    # final table of each shot is kept. Then the Ball, BallTable and TableShot rows left without their table are
+    # removed and the freed pages are given back to the file system. Every shot is its own short transaction, so
+    # live writes go on in between. vacuum=True first runs the one full VACUUM an existing database needs before
+    # its pages can be given back incrementally (see ConnectionManager.connect()); that one does block everyone
+    # else. Packed shots (see writeShotData()) have no frames to drop and are only counted. Returns what was removed
+    def compact(self, maxAge=30*24*3600, downsample=True, tolerance=0.01, vacuum=False, now=None):
+        if now is None:
+            now = time.time()
+        stats = {"shots": 0, "frames": 0, "packed": 0, "orphans": 0, "pages": 0}
+
+        if vacuum and self.cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            self.conn.commit()
+            self.cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.cursor.execute("VACUUM")
+
+        # Shots of the games whose last shot is older than maxAge
+        idle = "GAMEID IN (SELECT GAMEID FROM Shot GROUP BY GAMEID HAVING MAX(CREATED) < ?)"
+
+        # Those saved with a row per frame and not compacted yet
+        self.cursor.execute(f"""
+            SELECT SHOTID FROM Shot
+            WHERE COMPACTED = 0 AND {idle} AND EXISTS (SELECT 1 FROM TableShot WHERE TableShot.SHOTID = Shot.SHOTID)
+            ORDER BY SHOTID
+            """, (now - maxAge,))
+        for (shotID,) in self.cursor.fetchall():
+            stats["frames"] += self.compactShot(shotID, downsample, tolerance)
+            stats["shots"] += 1
+
+        # Packed shots (see writeShotData()) only hold their segments already, they are counted but left as they are
+        self.cursor.execute(f"""
+            SELECT COUNT(*) FROM Shot
+            WHERE {idle} AND EXISTS (SELECT 1 FROM ShotData WHERE ShotData.SHOTID = Shot.SHOTID)
+            """, (now - maxAge,))
+        stats["packed"] = self.cursor.fetchone()[0]
+
+        stats["orphans"] = self.removeOrphans()
+        stats["pages"] = self.incrementalVacuum()
+        return stats
+
+    # Drops the frames of one shot as described in compact() and marks it compacted. Returns the frames dropped
+    def compactShot(self, shotID, downsample=True, tolerance=0.01):
+        try:
+            self.conn.commit()
+            self.cursor.execute("BEGIN IMMEDIATE")
+            frames = self.readShotFrames(shotID)
+            self.cursor.execute("""
+                SELECT TableShot.TABLEID FROM TableShot
+                INNER JOIN TTable ON TTable.TABLEID = TableShot.TABLEID + 1
+                WHERE TableShot.SHOTID = ?
+                ORDER BY TableShot.TABLEID
+                """, (shotID,))
+            tableIDs = [row[0] for row in self.cursor.fetchall()]
+
+            keep = set(tableIDs[-1:])
+            if downsample and frames:
+                keep.add(tableIDs[0])
+                kept = frames[0]
+                for tableID, frame in zip(tableIDs[1:], frames[1:]):
+                    # A collision happened since the last kept frame if rolling it no longer gives this frame
+                    if not self.sameBalls(kept.roll(frame.time - kept.time), frame, tolerance):
+                        keep.add(tableID)
+                        kept = frame
+
+            dropped = [(tableID,) for tableID in tableIDs if tableID not in keep]
+            self.cursor.executemany("""
+                DELETE FROM Ball WHERE BALLID IN (SELECT BALLID FROM BallTable WHERE TABLEID = ?)
+                """, dropped)
+            self.cursor.executemany("DELETE FROM BallTable WHERE TABLEID = ?", dropped)
+            self.cursor.executemany("DELETE FROM TTable WHERE TABLEID = ? + 1", dropped)
+            self.cursor.executemany("DELETE FROM TableShot WHERE TABLEID = ?", dropped)
+            self.cursor.execute("UPDATE Shot SET COMPACTED = 1 WHERE SHOTID = ?", (shotID,))
+            self.conn.commit()
+
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+        TABLE_CACHE.discard(self.databaseName, [tableID for (tableID,) in dropped])
+
+        return len(dropped)
+
+    # Whether two tables hold the same balls, of the same type and within tolerance mm of each other
+    def sameBalls(self, table, other, tolerance):
+        balls = {int(row[0]): row for row in table.exportBalls().tolist()}
+        others = {int(row[0]): row for row in other.exportBalls().tolist()}
+        if balls.keys() != others.keys():
+            return False
+        for number, ball in balls.items():
+            otherBall = others[number]
+            if ball[1] != otherBall[1] or abs(ball[2] - otherBall[2]) > tolerance or abs(ball[3] - otherBall[3]) > tolerance:
+                return False
+        return True
+
+    # What makes a row of each table an orphan for removeOrphans(). Every lookup goes through a primary key or an
+    # index (see migrateDB()), so a batch never scans a whole table while it holds the write lock
+    ORPHANS = [("BallTable", "NOT EXISTS (SELECT 1 FROM TTable WHERE TTable.TABLEID = BallTable.TABLEID + 1)"),
+               ("Ball", "NOT EXISTS (SELECT 1 FROM BallTable WHERE BallTable.BALLID = Ball.BALLID)"),
+               ("TableShot", "NOT EXISTS (SELECT 1 FROM TTable WHERE TTable.TABLEID = TableShot.TABLEID + 1)"),
+               ("TableShot", "NOT EXISTS (SELECT 1 FROM Shot WHERE Shot.SHOTID = TableShot.SHOTID)"),
+               ("ShotData", "NOT EXISTS (SELECT 1 FROM Shot WHERE Shot.SHOTID = ShotData.SHOTID)")]
+
+    # Removes the rows nothing refers to any more: balls of no table, links to a table that is gone, and the
+    # frames and packed data of shots that are gone. Tables saved on their own by writeTable() are kept. Each
+    # table is gone through batch rows at a time, one short transaction per batch. Returns the rows removed
+    def removeOrphans(self, batch=50000):
+        removed = 0
+        for table, orphan in self.ORPHANS:
+            last = self.cursor.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+            for start in range(0, last + 1, batch):
+                self.cursor.execute(f"DELETE FROM {table} WHERE rowid BETWEEN ? AND ? AND {orphan}",
+                                    (start, start + batch - 1))
+                removed += self.cursor.rowcount
+                self.conn.commit()
+        # Any cached table may have lost balls
+        if removed:
+            TABLE_CACHE.clear(self.databaseName)
+        return removed
+
+    # Gives the free pages of the file back to the file system, pages at a time so that writers only ever wait for
+    # one short step. Does nothing unless auto_vacuum is INCREMENTAL (see ConnectionManager.connect()). Returns
+    # the pages freed
+    def incrementalVacuum(self, pages=256):
+        freed = 0
+        if self.cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return freed
+        self.conn.commit()
+        while True:
+            free = self.cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                return freed
+            self.cursor.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+            self.conn.commit()
+            left = self.cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            if left >= free:
+                return freed
+            freed += free - left
+
+    # Saves the tables of a shot (the struck table and the table after every segment) as a single ShotData row
+    # packed by packShot(), instead of a TTable, Ball and BallTable row for every frame. The shot is marked
+    # compacted: there are no frames compact() could drop
+    def writeShotData(self, shotID, tables):
+        self.cursor.execute("INSERT OR REPLACE INTO ShotData (SHOTID, DATA) VALUES (?, ?)",
+                            (shotID, packShot(tables)))
+        self.cursor.execute("UPDATE Shot SET COMPACTED = 1 WHERE SHOTID = ?", (shotID,))
+        self.conn.commit()
+
+    # Returns the list of tables saved for a shot by writeShotData(), or None if the shot has none
+    def readShotData(self, shotID):
+        self.cursor.execute("SELECT DATA FROM ShotData WHERE SHOTID = ?", (shotID,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        return unpackShot(row[0])
+
+    # Counterpart of readTable() for a shot saved with writeShotData(): returns the table at the given time of the
+    # shot, rolled from the table of the segment it falls in, or None if the shot has no data
+    def readShotTable(self, shotID, time):
+        tables = self.readShotData(shotID)
+        if not tables:
+            return None
+
+        # The last table that starts at or before time; segments are in chronological order
+        start = tables[0]
+        for table in tables[1:]:
+            if table.time > time:
+                break
+            start = table
+
+        table = start.roll(max(time - start.time, 0.0))
+        table.time = max(time, start.time)
+        return table
         
+# Persists shots on a background thread after the response has gone out ("write-behind"), so saving a shot
+# never waits for the disk. Writes run one at a time, in the order they were submitted. The queue holds at
+# most maxsize writes: submit() blocks while it is full (backpressure), for at most timeout seconds. Whatever
+# is still queued is written before the program exits
+class WriteBehind:
+
+    def __init__(self, maxsize=32, timeout=None):
+        self.queue = queue.Queue(maxsize)
+        self.timeout = timeout
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="WriteBehind", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Queues function(*args) for the writer thread. Raises queue.Full if it is still full after timeout seconds.
+    # Returns a Future that holds the result (or the error) of the write once it is committed
+    def submit(self, function, *args):
+        if self.closed:
+            raise RuntimeError("WriteBehind is closed")
+        future = Future()
+        self.queue.put((future, function, args), timeout=self.timeout)
+        return future
+
+    # Body of the writer thread, stops at the None queued by close()
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                future, function, args = item
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(function(*args))
+                    except BaseException as error:
+                        # Nobody may be waiting on the future, so report it like the other database errors
+                        print(f"An error occurred while writing behind: {error!r}")
+                        future.set_exception(error)
+            finally:
+                self.queue.task_done()
+
+    # Waits until every write submitted so far is committed
+    def flush(self):
+        self.queue.join()
+
+    # Writes everything still queued, then stops the writer thread. Later submit() calls raise RuntimeError
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+# Body of a SimulationPool worker process: simulates every shot received on conn with simulateShot() and sends
+# back (True, packed shot), or (False, error) if it could not be simulated. Stops when the pool closes conn
+def simulationWorker(conn):
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return
+        try:
+            result = (True, simulateShot(*args))
+        except Exception as error:
+            result = (False, error)
+        conn.send(result)
+
+# Simulates shots in a pool of worker processes, so a long shot never holds the GIL (or a request thread) for
+# longer than its deadline. Each shot is given deadline seconds, waiting for a worker included: a shot that is
+# still being simulated by then is cancelled by killing its worker, which is replaced by a new one. At most
+# queueSize shots wait for a worker, more are turned away at once with queue.Full instead of piling up
+class SimulationPool:
+
+    def __init__(self, workers=2, queueSize=8, deadline=10.0):
+        # Worker processes are started from scratch: forking a process with threads running is unsafe
+        self.context = multiprocessing.get_context("spawn")
+        self.deadline = deadline
+        self.admission = threading.BoundedSemaphore(workers + queueSize)
+        self.idle = queue.Queue()  # (process, connection) of every worker not simulating a shot
+        self.closed = False
+        for _ in range(workers):
+            self.idle.put(self.startWorker())
+        atexit.register(self.close)
+
+    # Starts a worker process and returns it with the connection it reads its shots from
+    def startWorker(self):
+        conn, workerConn = self.context.Pipe()
+        process = self.context.Process(target=simulationWorker, args=(workerConn,), name="SimulationWorker", daemon=True)
+        process.start()
+        workerConn.close()
+        return process, conn
+
+    # Stops a worker at once, whatever it is doing
+    def stopWorker(self, worker):
+        process, conn = worker
+        process.kill()
+        process.join()
+        conn.close()
+
+    # Simulates the shot struck with velocity (xvel, yvel) on table in a worker and returns it as a PackedShot.
+    # Raises queue.Full if too many shots are already waiting, and TimeoutError if the shot is not simulated within
+    # deadline seconds (by default the pool's). Any error raised by the simulation is raised again here
+    def run(self, table, xvel, yvel, engine=ENGINE_STEP, deadline=None):
+        if self.closed:
+            raise RuntimeError("SimulationPool is closed")
+        if not self.admission.acquire(blocking=False):
+            raise queue.Full("too many shots are waiting to be simulated")
+        try:
+            end = time.monotonic() + (self.deadline if deadline is None else deadline)
+            try:
+                worker = self.idle.get(timeout=max(end - time.monotonic(), 0))
+            except queue.Empty:
+                # Cancelled before it started
+                raise TimeoutError("no worker was free to simulate the shot in time") from None
+
+            try:
+                _, conn = worker
+                conn.send((table.exportBalls().tobytes(), table.time, xvel, yvel, engine))
+                if not conn.poll(max(end - time.monotonic(), 0)):
+                    raise TimeoutError("the shot was not simulated in time")
+                ok, result = conn.recv()
+            except BaseException:
+                # The worker may still be simulating the shot (or be gone): cancel it and start a new one instead
+                self.stopWorker(worker)
+                worker = self.startWorker()
+                raise
+            finally:
+                self.idle.put(worker)
+        finally:
+            self.admission.release()
+
+        if not ok:
+            raise result
+        return PackedShot(result)
+
+    # Stops every idle worker. Workers still simulating a shot are daemons, they stop with the program
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        while True:
+            try:
+                self.stopWorker(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
 class Game:
     # Class variable to connect to the Database class
     db = Database()
+    # Simulation engine used by shoot(). ENGINE_EVENT jumps straight from one collision to the next
+    engine = ENGINE_STEP
+    # Optional ShotCache used by shoot() so repeated shots are not simulated again
+    cache = None
+    # Optional WriteBehind that saves shots after shoot() has returned, instead of before
+    writer = None
+    # How shots are saved: STORAGE_ROWS writes every frame with writeShotTables(), STORAGE_PACKED only writes
+    # the segments of the shot as one ShotData row with writeShotData()
+    storage = STORAGE_ROWS
+    # Optional SimulationPool that simulates shots in worker processes, within a deadline, instead of on this thread
+    pool = None
 
     #  Initializes the Game object either by loading an existing game using its ID
     # or by creating a new game with names for the game and players
@@ -621,58 +1919,123 @@ class Game:
     # Helper method to load game details from the database into this Game object.
     # It assumes the gameID has already been set for this Game instance
     def loadGame(self):
-        # Assuming db is an instance of the Database class
-        db = Database()
-        self.gameName, self.player1Name, self.player2Name = db.getGame(self.gameID)
+        self.gameName, self.player1Name, self.player2Name = self.db.getGame(self.gameID)
 
     # Helper method to create a new game in the database with the provided names.
     # It assumes the gameName, player1Name, and player2Name have been set for this Game instance.
     def createNewGame(self):
-        # Assuming db is an instance of the Database class
-        db = Database()
         # Create the game in the database and get the new game ID
-        self.gameID = db.setGame(self.gameName, self.player1Name, self.player2Name)
+        self.gameID = self.db.setGame(self.gameName, self.player1Name, self.player2Name)
 
-    def shoot(self, gameName, playerName, table, xvel, yvel):
-        svgString = ""
-        # Create a new shot and get its ID
+    # Adds a shot of playerName to the database with its tables: every frame, or only the table of every
+    # segment when the shot is packed into ShotData. Returns the new shot ID
+    def saveShot(self, gameName, playerName, frameTables, segmentTables):
         shotID = self.db.newShot(gameName, playerName)
-
-        # Find the cue ball
-        for ball in table:
-            if isinstance(ball, (StillBall, RollingBall)) and ball.obj.still_ball.number == 0:
-                cueBall = ball
-
-        # Store the current position of the cue ball
-        xpos, ypos = cueBall.obj.still_ball.pos.x, cueBall.obj.still_ball.pos.y
-
-        # Change the type to RollingBall
-        cueBall.type = phylib.PHYLIB_ROLLING_BALL
-        cueBall.obj.rolling_ball.number = 0
-        cueBall.obj.rolling_ball.pos.x = xpos
-        cueBall.obj.rolling_ball.pos.y = ypos
-        cueBall.obj.rolling_ball.vel.x = xvel
-        cueBall.obj.rolling_ball.vel.y = yvel
-
-        # Calculate the acceleration based on velocity and DRAG. Exact same way as A2 and in readTable
-        speed = (xvel**2 + yvel**2)**0.5
-        if speed > VEL_EPSILON:
-            cueBall.obj.rolling_ball.acc.x = -(xvel / speed) * DRAG
-            cueBall.obj.rolling_ball.acc.y = -(yvel / speed) * DRAG
+        if self.storage == STORAGE_PACKED:
+            # Only the segments are saved, every frame can be rolled back from them (see Database.readShotTable())
+            self.db.writeShotData(shotID, segmentTables)
         else:
-            cueBall.obj.rolling_ball.acc.x = 0
-            cueBall.obj.rolling_ball.acc.y = 0
-
-        # Set the start time to the current time on the table passed before segment
+            # Save every frame of the shot and record it in TableShot, in a single transaction
+            self.db.writeShotTables(shotID, frameTables)
+        return shotID
+
+    # Saves a shot with saveShot(), on the writer thread when there is a writer. Sets self.saved to a Future
+    # of the shot ID, whose result() waits until the shot is committed
+    def save(self, gameName, playerName, frameTables, segmentTables):
+        if self.writer is not None:
+            self.saved = self.writer.submit(self.saveShot, gameName, playerName, frameTables, segmentTables)
+        else:
+            self.saved = Future()
+            self.saved.set_result(self.saveShot(gameName, playerName, frameTables, segmentTables))
+        return self.saved
+
+    # Strikes the cue ball of table and simulates the whole shot in a single native call (or reuses a cached shot).
+    # Returns the Shot and the offset to add to the time of its tables: a cached shot may have started at a different time.
+    # With a pool the shot is simulated by a worker process and is a PackedShot, see SimulationPool.run() for its errors
+    def simulate(self, table, xvel, yvel):
+        simulate = self.pool.run if self.pool is not None else None
+        if self.cache is not None:
+            shot = self.cache.run(table, xvel, yvel, self.engine, simulate)
+        elif simulate is not None:
+            shot = simulate(table, xvel, yvel, self.engine)
+        else:
+            shot = Shot()
+            shot.run(table, xvel, yvel, self.engine)
+        return shot, table.time - shot[0].time
+
+    # Simulates a shot with simulate() and saves only the table at the start of every segment (the keyframes of
+    # the shot), which are then both its frames and its segments. Returns the Shot, its offset and those tables
+    def shootSegments(self, gameName, playerName, table, xvel, yvel):
+        shot, offset = self.simulate(table, xvel, yvel)
+
+        tables = []
+        for index in range(len(shot)):
+            segmentTable = shot[index]
+            segmentTable.time += offset
+            tables.append(segmentTable)
+        self.save(gameName, playerName, tables, tables)
+
+        return shot, offset, tables
+
+    # Like shoot(), but returns the keyframes of the shot (see Shot.keyframes()) instead of rendering every frame,
+    # so the client interpolates the frames itself. Only the table at each keyframe is saved, not every frame
+    def shootKeyframes(self, gameName, playerName, table, xvel, yvel):
+        shot, offset, tables = self.shootSegments(gameName, playerName, table, xvel, yvel)
+        return shot.keyframes(offset), tables[-1]
+
+    # Like shoot(), but nothing is rendered yet: returns the frames of the shot as a ShotFrames, which renders
+    # each one when asked for (see FramePages)
+    def shootFrames(self, gameName, playerName, table, xvel, yvel):
+        _, _, tables = self.shootSegments(gameName, playerName, table, xvel, yvel)
+        return ShotFrames(tables), tables[-1]
+
+    # renderer turns every frame into the svg appended to the returned string. By default a FrameRenderer, which
+    # only renders a frame again when a ball moved; a FrameEncoder keeps the frames itself (see FrameEncoder.data())
+    def shoot(self, gameName, playerName, table, xvel, yvel, renderer=None):
+        frames = self.playShot(gameName, playerName, table, xvel, yvel, renderer)
+        svgFrames = []
+        while True:
+            try:
+                svgFrames.append(next(frames))
+            except StopIteration as stop:
+                # renderShot() returns the table at the end of the shot
+                return "".join(svgFrames), stop.value
+
+    # Behind shoot(): simulates the shot right away, so simulate()'s errors are raised here, and returns a generator
+    # that yields the svg of every frame as soon as it is rendered (see renderShot())
+    def playShot(self, gameName, playerName, table, xvel, yvel, renderer=None):
+        shot, offset = self.simulate(table, xvel, yvel)
+        return self.renderShot(gameName, playerName, shot, offset, renderer)
+
+    # Generator that yields the svg of every frame of a simulated shot as soon as it is rendered, so the frames can be
+    # sent while the rest of the shot is still being rendered. Once every frame has been yielded the shot is saved and
+    # the generator returns the table at the end of the shot. Only the frame being rendered is kept, unless the
+    # shot is saved with a row per frame (STORAGE_ROWS)
+    def renderShot(self, gameName, playerName, shot, offset, renderer=None):
+        svgFrame = ""
+        # Renders each frame from the cached table layer and ball templates, reusing the last one when nothing moved
+        if renderer is None:
+            renderer = FrameRenderer()
+
+        # Every frame's table, saved together with writeShotTables() once the shot is rendered,
+        # or only the table of every segment when the shot is packed into ShotData
+        frameTables = []
+        segmentTables = []
+
+        # Start from the struck table
+        table = shot[0]
+        table.time += offset
+        segmentTables.append(table)
         startTime = table.time
         lastTable = table
-        # Call segment on the table passed and set the new table to a temporary table
-        tempTable = table.segment()
 
-        # Now, repeatedly call the segment method and handle each frame   
-        while tempTable:
+        # Now, handle each segment of the shot and its frames
+        for index in range(1, len(shot)):
+            tempTable = shot[index]
+            tempTable.time += offset
             lastTable = tempTable
-            # Set the end time to the time after segment at the end of the while loop is called
+            segmentTables.append(tempTable)
+            # Set the end time to the time at the end of this segment
             endTime = tempTable.time
             # Calculate the number of frames in this segment by subtracting start time from end time
             segmentTime = endTime - startTime
@@ -687,28 +2050,29 @@ class Game:
 
                     # Roll the table for this frame
                     newTable = table.roll(frameTime)
-                    svgFrame = newTable.svg()
-                    svgString += svgFrame
+                    frameSVG = renderer.render(newTable)
+                    if frameSVG is not None:
+                        svgFrame = frameSVG
+                        yield svgFrame
 
-                    # Set the time for the new table
-                    newTable.time = startTime + frameTime
+                    if self.storage == STORAGE_ROWS:
+                        # Set the time for the new table
+                        newTable.time = startTime + frameTime
 
-                    # Save the new table state to the database
-                    tableID = self.db.writeTable(newTable)
-            
-                    # Record this frame in TableShot
-                    self.db.recordTableShot(tableID, shotID)
+                        # Keep the frame, every frame of the shot is saved to the database at once below
+                        frameTables.append(newTable)
             else:
                 print("Error: Negative frame found!")
 
-            # Set the start time again for the next loop
+            # Set the start time again for the next segment
             startTime = tempTable.time
             # Set the table to the new table
             table = tempTable
-            # Call segment for the next loop
-            tempTable = tempTable.segment()
 
         if svgFrame:
-            svgString += svgFrame # Add the last frame to prevent balls from stopping just before the hole
+            yield svgFrame # Add the last frame to prevent balls from stopping just before the hole
+
+        # Create the shot and save its tables, after returning when there is a writer (see save())
+        self.save(gameName, playerName, frameTables, segmentTables)
             
-        return svgString, lastTable
+        return lastTable
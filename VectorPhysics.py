@@ -0,0 +1,407 @@
+"""
+NumPy simulation backend for batches of pool tables.
+
+TableBatch holds many tables at once as (tables x balls) arrays and advances
+all of them with the rules of phylib.c: balls roll with constant drag, stop
+once slower than VEL_EPSILON, bounce off the cushions, drop into the holes
+and collide elastically. Like Table.segment(), every segment() ends each
+table at its own next event.
+
+Only numpy is needed, so this also works where _phylib.so has not been
+built; Physics.py (and so phylib) is only imported to convert to and from
+Table objects.
+"""
+import numpy as np;
+
+################################################################################
+# these mirror the #defines in phylib.h, so that phylib is not needed here
+BALL_RADIUS   = 28.5;
+BALL_DIAMETER = 2*BALL_RADIUS;
+HOLE_RADIUS   = 2*BALL_DIAMETER;
+TABLE_LENGTH  = 2700.0;
+TABLE_WIDTH   = TABLE_LENGTH/2.0;
+SIM_RATE      = 0.0001;
+VEL_EPSILON   = 0.01;
+DRAG          = 150.0;
+MAX_TIME      = 600;
+
+# state of every (table, ball) slot of a TableBatch
+NO_BALL      = -1;  # pocketed, or an unused slot
+STILL_BALL   = 0;   # same values as phylib_obj
+ROLLING_BALL = 1;
+
+# the cushions and holes of phylib_new_table(), in the order of its objects
+HCUSHIONS = np.array( [ 0.0, TABLE_LENGTH ] );
+VCUSHIONS = np.array( [ 0.0, TABLE_WIDTH ] );
+HOLES = np.array( [ [ 0.0, 0.0 ],
+                    [ 0.0, TABLE_WIDTH ],
+                    [ 0.0, TABLE_LENGTH ],
+                    [ TABLE_WIDTH, 0.0 ],
+                    [ TABLE_LENGTH/2.0, TABLE_LENGTH/2.0 ],
+                    [ TABLE_WIDTH, TABLE_LENGTH ] ] );
+CUSHION_COUNT = len( HCUSHIONS ) + len( VCUSHIONS );
+HOLE_COUNT = len( HOLES );
+
+################################################################################
+
+def drag( vel ):
+    """
+    Returns the acceleration of balls moving with velocities vel (an array
+    of (x, y) pairs), computed like phylib_bounce() does.
+    """
+    speed = np.hypot( vel[..., 0], vel[..., 1] )[..., None];
+    moving = speed > VEL_EPSILON;
+    return np.where( moving, -vel / np.where( moving, speed, 1.0 ) * DRAG, 0.0 );
+
+def advance( pos, vel, acc, rolling, time ):
+    """
+    Rolls every rolling ball in place for time seconds (one per table). Like
+    phylib_advance() in phylib.c an axis never overshoots: once its velocity
+    reaches 0 the ball stays put on that axis and its acceleration is cleared.
+    """
+    time = time[:, None, None];
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        stop = np.where( acc != 0.0, -vel / acc, np.inf );
+    stops = (acc != 0.0) & (stop >= 0.0) & (stop <= time) & rolling[..., None];
+    t = np.where( stops, stop, time );
+
+    moved = rolling[..., None];
+    pos += np.where( moved, vel * t + 0.5 * acc * t * t, 0.0 );
+    vel[:] = np.where( stops, 0.0, np.where( moved, vel + acc * t, vel ) );
+    acc[ stops ] = 0.0;
+
+################################################################################
+
+class TableBatch:
+    """
+    A batch of tables simulated together. Every table has the same balls
+    slots; state[table, ball] is NO_BALL, STILL_BALL or ROLLING_BALL and
+    number, pos, vel and acc hold each ball's number and (x, y) coordinates.
+    time[table] is the table time, like Table.time. The cushions and holes
+    are those of a new Table.
+    """
+
+    def __init__( self, numbers, positions, velocities=None, accelerations=None, times=None ):
+        """
+        TableBatch constructor method. positions is a (tables, balls, 2)
+        array of ball positions, with nan for a missing ball, and numbers
+        the ball numbers, either per table or one row shared by every table.
+        Balls moving faster than VEL_EPSILON are rolling, with drag unless
+        accelerations are given.
+        """
+        self.pos = np.array( positions, dtype=float );
+        if self.pos.ndim != 3 or self.pos.shape[2] != 2:
+            raise ValueError( "positions must be a (tables, balls, 2) array" );
+        shape = self.pos.shape[:2];
+
+        self.number = np.array( np.broadcast_to( numbers, shape ), dtype=int );
+        if velocities is None:
+            self.vel = np.zeros_like( self.pos );
+        else:
+            self.vel = np.array( np.broadcast_to( velocities, self.pos.shape ), dtype=float );
+        if accelerations is None:
+            self.acc = drag( self.vel );
+        else:
+            self.acc = np.array( np.broadcast_to( accelerations, self.pos.shape ), dtype=float );
+        if times is None:
+            self.time = np.zeros( shape[0] );
+        else:
+            self.time = np.array( np.broadcast_to( times, shape[:1] ), dtype=float );
+
+        speed = np.hypot( self.vel[..., 0], self.vel[..., 1] );
+        self.state = np.where( speed > VEL_EPSILON, ROLLING_BALL, STILL_BALL );
+        self.state[ np.isnan( self.pos ).any( axis=2 ) ] = NO_BALL;
+        self.pos[ self.state == NO_BALL ] = 0.0;
+        self.vel[ self.state != ROLLING_BALL ] = 0.0;
+        self.acc[ self.state != ROLLING_BALL ] = 0.0;
+
+    @classmethod
+    def fromTables( cls, tables ):
+        """
+        Builds a batch from a sequence of Table objects, keeping the balls of
+        each table in the order of its objects.
+        """
+        rows = [];
+        for table in tables:
+            row = [];
+            for obj in table:
+                # phylib_obj values: only balls are copied
+                if obj is not None and obj.type in (STILL_BALL, ROLLING_BALL):
+                    ball = obj.obj.rolling_ball;
+                    if obj.type == ROLLING_BALL:
+                        row.append( ( obj.type, ball.number, ball.pos.x, ball.pos.y,
+                                      ball.vel.x, ball.vel.y, ball.acc.x, ball.acc.y ) );
+                    else:
+                        row.append( ( obj.type, ball.number, ball.pos.x, ball.pos.y, 0.0, 0.0, 0.0, 0.0 ) );
+            rows.append( ( table.time, row ) );
+
+        balls = max( [ len( row ) for _, row in rows ], default=0 );
+        data = np.zeros( ( len( rows ), balls, 8 ) );
+        data[..., 0] = NO_BALL;
+        for i, ( _, row ) in enumerate( rows ):
+            if row:
+                data[ i, :len( row ) ] = row;
+
+        batch = cls( data[..., 1], data[..., 2:4], data[..., 4:6], data[..., 6:8],
+                     [ time for time, _ in rows ] );
+        # keep the type of every ball, even a rolling ball slower than VEL_EPSILON
+        batch.state = data[..., 0].astype( int );
+        return batch;
+
+    def __len__( self ):
+        """
+        Number of tables in the batch.
+        """
+        return len( self.time );
+
+    def copy( self ):
+        """
+        Returns an independent copy of the batch.
+        """
+        batch = TableBatch.__new__( TableBatch );
+        for name in ( "number", "state", "pos", "vel", "acc", "time" ):
+            setattr( batch, name, getattr( self, name ).copy() );
+        return batch;
+
+    def rolling( self ):
+        """
+        Returns the number of rolling balls on every table.
+        """
+        return np.count_nonzero( self.state == ROLLING_BALL, axis=1 );
+
+    def positions( self ):
+        """
+        Returns a (tables, balls, 3) array of (number, x, y) for every ball,
+        with x and y set to nan for a missing ball, in the same layout as
+        Table.evaluate().
+        """
+        result = np.empty( self.pos.shape[:2] + (3,) );
+        result[..., 0] = self.number;
+        result[..., 1:] = np.where( (self.state == NO_BALL)[..., None], np.nan, self.pos );
+        return result;
+
+    def table( self, index ):
+        """
+        Returns table number index of the batch as a Table object.
+        """
+        from Physics import Table, StillBall, RollingBall, Coordinate;
+
+        table = Table();
+        table.time = float( self.time[ index ] );
+        for ball in range( self.pos.shape[1] ):
+            number = int( self.number[ index, ball ] );
+            pos = Coordinate( *self.pos[ index, ball ] );
+            if self.state[ index, ball ] == STILL_BALL:
+                table += StillBall( number, pos );
+            elif self.state[ index, ball ] == ROLLING_BALL:
+                table += RollingBall( number, pos,
+                                      Coordinate( *self.vel[ index, ball ] ),
+                                      Coordinate( *self.acc[ index, ball ] ) );
+        return table;
+
+    def tables( self ):
+        """
+        Returns every table of the batch as a list of Table objects.
+        """
+        return [ self.table( i ) for i in range( len( self ) ) ];
+
+    def strike( self, velocities ):
+        """
+        Strikes the cue ball (number 0) of every table with its (vx, vy)
+        velocity: one pair per table, or a single pair for all of them.
+        Raises ValueError if a table has no cue ball.
+        """
+        cue = (self.number == 0) & (self.state != NO_BALL);
+        if not cue.any( axis=1 ).all():
+            raise ValueError( "no cue ball" );
+        index = np.arange( len( self ) ), np.argmax( cue, axis=1 );
+
+        vel = np.array( np.broadcast_to( velocities, ( len( self ), 2 ) ), dtype=float );
+        self.vel[ index ] = vel;
+        self.acc[ index ] = drag( vel );
+        self.state[ index ] = ROLLING_BALL;
+
+    def segment( self, tables=None ):
+        """
+        Simulates one segment on every table that has rolling balls (or only
+        on the tables selected by the boolean mask tables): each of them is
+        advanced until one of its balls stops or hits a cushion, hole or
+        ball, which is then handled like phylib_bounce(). Returns the mask
+        of tables that were advanced; the others are left untouched.
+        """
+        active = (self.state == ROLLING_BALL).any( axis=1 );
+        if tables is not None:
+            active &= tables;
+        self._simulate( active, True );
+        return active;
+
+    def shoot( self, velocities ):
+        """
+        Strikes the cue ball of every table with velocities (see strike())
+        and simulates it until every ball is at rest, or MAX_TIME has passed
+        since the strike, like Table.shoot(). Every table goes through its
+        own segments without waiting for the others. Returns the number of
+        segments simulated on each table.
+        """
+        self.strike( velocities );
+        return self._simulate( np.ones( len( self ), dtype=bool ), False );
+
+    # Advances the selected tables step by step, each for one segment (once)
+    # or until it has no rolling balls, for at most MAX_TIME. Returns the
+    # number of segments of every table.
+    def _simulate( self, tables, once ):
+        elapsed = np.zeros( len( self ) );
+        segments = np.zeros( len( self ), dtype=int );
+
+        pending = np.flatnonzero( tables & (self.state == ROLLING_BALL).any( axis=1 ) );
+        pos, vel, acc, state = self.pos[ pending ], self.vel[ pending ], self.acc[ pending ], self.state[ pending ];
+        geometry = _geometry( pos );
+        while len( pending ):
+            step = np.minimum( _step( geometry, pos, vel, acc, state ), MAX_TIME - elapsed[ pending ] );
+            advance( pos, vel, acc, state == ROLLING_BALL, step );
+            elapsed[ pending ] += step;
+
+            # the balls don't move during an event, so the next step reuses geometry
+            geometry = _geometry( pos );
+            ended = _event( geometry, pos, vel, acc, state ) | (elapsed[ pending ] >= MAX_TIME);
+            segments[ pending ] += ended;
+
+            self.pos[ pending ], self.vel[ pending ], self.acc[ pending ], self.state[ pending ] = pos, vel, acc, state;
+            if once:
+                running = ~ended;
+            else:
+                running = (state == ROLLING_BALL).any( axis=1 ) & (elapsed[ pending ] < MAX_TIME);
+            if not running.all():
+                pending = pending[ running ];
+                pos, vel, acc, state = pos[ running ], vel[ running ], acc[ running ], state[ running ];
+                geometry = [ array[ running ] for array in geometry ];
+
+        self.time += elapsed;
+        return segments;
+
+################################################################################
+# The segments are simulated by conservative advancement: every step is as
+# long as possible without any rolling ball being able to reach another
+# object, but at least SIM_RATE (the resolution of phylib_segment), and never
+# past the moment a ball stops. Steps shrink as objects get closer, so a
+# collision is found within SIM_RATE of when it happens.
+
+def _geometry( pos ):
+    # offsets between the balls of every table, and the gaps between the
+    # balls (contact at 0, a ball and itself are never in contact) and from
+    # every ball to every hole
+    x, y = pos[..., 0], pos[..., 1];
+    dx = x[:, :, None] - x[:, None, :];
+    dy = y[:, :, None] - y[:, None, :];
+    balls = np.sqrt( dx * dx + dy * dy ) - BALL_DIAMETER;
+    index = np.arange( pos.shape[1] );
+    balls[:, index, index] = np.inf;
+
+    hx = x[..., None] - HOLES[:, 0];
+    hy = y[..., None] - HOLES[:, 1];
+    holes = np.sqrt( hx * hx + hy * hy ) - HOLE_RADIUS;
+    return [ dx, dy, balls, holes ];
+
+def _reach( gap, closing ):
+    # time until a gap can close at closing speed, with both objects slowing
+    # down or turning by at most DRAG each (an infinite gap never closes)
+    gap = np.maximum( gap, 0.0 );
+    bound = closing + np.sqrt( closing * closing + 4.0 * DRAG * gap );
+    with np.errstate( invalid='ignore' ):
+        times = np.divide( 2.0 * gap, bound, out=np.zeros_like( gap ), where=bound > 0.0 );
+    return np.where( np.isinf( gap ), np.inf, times );
+
+def _cushions( pos, vel ):
+    # gap from every ball to each cushion and its speed towards it, in the
+    # order of a Table's objects
+    gaps, towards = [], [];
+    for axis, cushions in ( ( 1, HCUSHIONS ), ( 0, VCUSHIONS ) ):
+        gaps.append( np.abs( pos[..., axis, None] - cushions ) - BALL_RADIUS );
+        towards.append( np.sign( cushions - pos[..., axis, None] ) * vel[..., axis, None] );
+    return np.concatenate( gaps, axis=2 ), np.concatenate( towards, axis=2 );
+
+def _step( geometry, pos, vel, acc, state ):
+    # returns the length of the next step of every table
+    dx, dy, balls, holes = geometry;
+    rolling = state == ROLLING_BALL;
+    speed = np.where( rolling, np.sqrt( vel[..., 0] ** 2 + vel[..., 1] ** 2 ), 0.0 );
+
+    gap = np.where( (state != NO_BALL)[:, None, :], balls, np.inf );
+    times = _reach( gap, speed[:, :, None] + speed[:, None, :] ).min( axis=2 );
+    times = np.minimum( times, _reach( holes, speed[..., None] ).min( axis=2 ) );
+
+    # a cushion can only be reached by moving towards it, and that part of
+    # the velocity only shrinks
+    gap, towards = _cushions( pos, vel );
+    with np.errstate( divide='ignore' ):
+        reached = np.where( towards > 0.0, np.maximum( gap, 0.0 ) / towards, np.inf );
+    times = np.minimum( times, reached.min( axis=2 ) );
+
+    # time until every axis of the ball has stopped
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        stop = np.where( vel == 0.0, 0.0, np.where( acc * vel < 0.0, -vel / acc, np.inf ) ).max( axis=2 );
+
+    times = np.where( rolling, times, np.inf ).min( axis=1 );
+    stop = np.where( rolling, stop, np.inf ).min( axis=1 );
+    return np.minimum( np.maximum( times, SIM_RATE ), stop );
+
+def _event( geometry, pos, vel, acc, state ):
+    # Finds the first rolling ball (in table order) that has stopped or
+    # overlaps a cushion, hole or ball it is moving towards, and stops or
+    # bounces it. Objects are checked in the order of a Table: cushions,
+    # holes, then balls. Returns a mask of the tables that had an event.
+    dx, dy, balls, holes = geometry;
+    rolling = state == ROLLING_BALL;
+
+    stopped = rolling & (vel[..., 0] ** 2 + vel[..., 1] ** 2 < VEL_EPSILON * VEL_EPSILON);
+
+    gap, towards = _cushions( pos, vel );
+    dvx = vel[:, :, None, 0] - vel[:, None, :, 0];
+    dvy = vel[:, :, None, 1] - vel[:, None, :, 1];
+    hits = np.concatenate( [ (gap < 0.0) & (towards > 0.0),
+                             holes < 0.0,
+                             (balls < 0.0) & (dx * dvx + dy * dvy < 0.0) & (state != NO_BALL)[:, None, :] ],
+                           axis=2 ) & rolling[..., None];
+
+    events = stopped | hits.any( axis=2 );
+    done = events.any( axis=1 );
+    t = np.flatnonzero( done );
+    a = np.argmax( events[ t ], axis=1 );
+
+    # the ball stopped: it becomes a still ball
+    stop = stopped[ t, a ];
+    ts, s = t[ stop ], a[ stop ];
+    vel[ ts, s ] = 0.0;
+    acc[ ts, s ] = 0.0;
+    state[ ts, s ] = STILL_BALL;
+
+    t, a = t[ ~stop ], a[ ~stop ];
+    b = np.argmax( hits[ t, a ], axis=1 );
+
+    # cushions reverse one axis of the velocity and acceleration
+    for axis, first in ( ( 1, 0 ), ( 0, len( HCUSHIONS ) ) ):
+        hit = (b >= first) & (b < first + 2);
+        vel[ t[ hit ], a[ hit ], axis ] *= -1;
+        acc[ t[ hit ], a[ hit ], axis ] *= -1;
+
+    # holes take the ball off the table
+    hit = (b >= CUSHION_COUNT) & (b < CUSHION_COUNT + HOLE_COUNT);
+    state[ t[ hit ], a[ hit ] ] = NO_BALL;
+    vel[ t[ hit ], a[ hit ] ] = 0.0;
+    acc[ t[ hit ], a[ hit ] ] = 0.0;
+
+    # balls collide elastically, a still ball starts rolling first
+    hit = b >= CUSHION_COUNT + HOLE_COUNT;
+    t, a, b = t[ hit ], a[ hit ], b[ hit ] - CUSHION_COUNT - HOLE_COUNT;
+    state[ t, b ] = ROLLING_BALL;
+    n = pos[ t, a ] - pos[ t, b ];
+    n /= np.hypot( n[:, 0], n[:, 1] )[:, None];
+    v_rel_n = np.einsum( 'ij,ij->i', vel[ t, a ] - vel[ t, b ], n )[:, None];
+    vel[ t, a ] -= v_rel_n * n;
+    vel[ t, b ] += v_rel_n * n;
+    # like phylib_bounce(), a ball that is now too slow keeps its old drag
+    for ball in ( a, b ):
+        moving = np.hypot( vel[ t, ball, 0 ], vel[ t, ball, 1 ] ) > VEL_EPSILON;
+        acc[ t, ball ] = np.where( moving[:, None], drag( vel[ t, ball ] ), acc[ t, ball ] );
+
+    return done;
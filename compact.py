@@ -0,0 +1,17 @@
+import argparse;
+import Physics;
+
+# Maintenance command for phylib.db, see Database.compact()
+parser = argparse.ArgumentParser(description="Compacts the shots of the games nobody has played for a while")
+parser.add_argument("--days", type=float, default=30, help="how long a game must have been idle (default 30)")
+parser.add_argument("--drop", action="store_true", help="keep only the final table of each shot")
+parser.add_argument("--vacuum", action="store_true", help="run the full VACUUM an existing database needs once")
+args = parser.parse_args()
+
+db = Physics.Database()
+db.createDB()
+stats = db.compact(maxAge=args.days*24*3600, downsample=not args.drop, vacuum=args.vacuum)
+db.close()
+print(f"Compacted {stats['shots']} shots: removed {stats['frames']} frames and {stats['orphans']} orphaned rows, "
+      f"freed {stats['pages']} pages")
+print(f"{stats['packed']} packed shots of those games were already compact")
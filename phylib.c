@@ -6,7 +6,11 @@
  * @date 2024-01-29
  */
 
+#define _POSIX_C_SOURCE 200112L //For sysconf() in the parallel batch (PART 8)
+
 #include "phylib.h"
+#include <pthread.h>
+#include <unistd.h>
 
 // PART 1: C Library for objects within the billiard simulation
 
@@ -291,106 +295,162 @@ double phylib_dot_product(phylib_coord a, phylib_coord b) {
 }
 
 /**
- * @brief Calculates the distance between 2 objects. obj1 MUST be a PHYLIB_ROLLING_BALL, if not return -1.0.
- * Otherwise the distance between objects is calculates following rules outlined in A1.
- * @param obj1 @param obj2 
- * @return double 
+ * @brief Returns where an object sits on the table: the position of a ball or hole, (0, y) for a horizontal
+ * cushion and (x, 0) for a vertical cushion.
+ * @param object 
+ * @return phylib_coord 
  */
-double phylib_distance(phylib_object *obj1, phylib_object *obj2) {
-    //Check if either objects are NULL OR if obj1 is NOT a rolling ball. If so return -1.0
-    if (obj1 == NULL || obj2 == NULL || obj1->type != PHYLIB_ROLLING_BALL) {
-        return -1.0;
+static phylib_coord phylib_object_pos(phylib_object *object) {
+    switch(object->type) {
+        case PHYLIB_ROLLING_BALL:
+            return object->obj.rolling_ball.pos;
+        case PHYLIB_STILL_BALL:
+            return object->obj.still_ball.pos;
+        case PHYLIB_HOLE:
+            return object->obj.hole.pos;
+        case PHYLIB_HCUSHION:
+            return (phylib_coord){0.0, object->obj.hcushion.y};
+        case PHYLIB_VCUSHION:
+            return (phylib_coord){object->obj.vcushion.x, 0.0};
+        default:
+            return (phylib_coord){0.0, 0.0};
     }
+}
 
-    double distance;
-    phylib_coord position; 
-    position = obj1->obj.rolling_ball.pos;
-
-    //Switch case handles the collision physics based on the type of the 2nd object (obj2).
-    switch(obj2->type) {
+/**
+ * @brief Calculates the distance between a rolling ball at 'position' and an object of the given type sitting at 'other'
+ * (see phylib_object_pos). Follows the rules of phylib_distance().
+ * @param position @param type @param other 
+ * @return double 
+ */
+static double phylib_distance_to(phylib_coord position, phylib_obj type, phylib_coord other) {
+    //Switch case handles the collision physics based on the type of the 2nd object
+    switch(type) {
         case PHYLIB_ROLLING_BALL:
-            //Calculate the distance between the centers of the balls and subtract 2 ball radius's (diameter)
-            distance = phylib_length(phylib_sub(position, obj2->obj.rolling_ball.pos)) - PHYLIB_BALL_DIAMETER;
-            break;
         case PHYLIB_STILL_BALL:
             //Calculate the distance between the centers of the balls and subtract 2 ball radius's (diameter)
-            distance = phylib_length(phylib_sub(position, obj2->obj.still_ball.pos)) - PHYLIB_BALL_DIAMETER;
-            break;
+            return phylib_length(phylib_sub(position, other)) - PHYLIB_BALL_DIAMETER;
         case PHYLIB_HOLE:
             //Calculate the distance to hole center and subtract hole radius
-            distance = phylib_length(phylib_sub(position, obj2->obj.hole.pos)) - PHYLIB_HOLE_RADIUS;
-            break;
+            return phylib_length(phylib_sub(position, other)) - PHYLIB_HOLE_RADIUS;
         case PHYLIB_HCUSHION:
             //Calculate the distance between the center of the ball and the horizontal cushion and subtract ball radius
-            distance = fabs(position.y - obj2->obj.hcushion.y) - PHYLIB_BALL_RADIUS;
-            break;
+            return fabs(position.y - other.y) - PHYLIB_BALL_RADIUS;
         case PHYLIB_VCUSHION:
             //Calculate the distance between the center of the ball and the vertical cushion and subtract ball radius
-            distance = fabs(position.x - obj2->obj.vcushion.x) - PHYLIB_BALL_RADIUS;
-            break;
+            return fabs(position.x - other.x) - PHYLIB_BALL_RADIUS;
         default:
         //In this case, object 2 is not a valid type, exit (return -1.0 as stated in description)
         return -1.0;
     }
+}
 
-    return distance; //Return the distance
+/**
+ * @brief Calculates the distance between 2 objects. obj1 MUST be a PHYLIB_ROLLING_BALL, if not return -1.0.
+ * Otherwise the distance between objects is calculates following rules outlined in A1.
+ * @param obj1 @param obj2 
+ * @return double 
+ */
+double phylib_distance(phylib_object *obj1, phylib_object *obj2) {
+    //Check if either objects are NULL OR if obj1 is NOT a rolling ball. If so return -1.0
+    if (obj1 == NULL || obj2 == NULL || obj1->type != PHYLIB_ROLLING_BALL) {
+        return -1.0;
+    }
+
+    return phylib_distance_to(obj1->obj.rolling_ball.pos, obj2->type, phylib_object_pos(obj2)); //Return the distance
 }
 
 // PART 3: Functions to simulate the balls movement on the table
 
 /**
- * @brief Updates a 'new' phylib_object that represents the 'old' phylib_object after it was rolled for a 
- * period of 'time'. Updates the values in 'new' according to the equations for position and velocity. 
- * If either velocities change sign (change direction) during the time interval then the velocity and corresponding 
- * acceleration are set to 0.
- * @param new @param old @param time 
+ * @brief Computes the position and velocity of a rolling ball after it rolled for a period of 'time', given its old
+ * position, velocity and acceleration. Works directly on coordinates so it can be shared by phylib_roll() and the
+ * compact phylib_state tables. See phylib_roll() for the rules (including clearing old_acc on a sign change).
+ * @param new_pos @param new_vel @param old_pos @param old_vel @param old_acc @param time 
  */
-void phylib_roll(phylib_object *new, phylib_object *old, double time) {
-    //Check if new or old point to a NULL location OR if old or new are NOT rolling balls. If so return.
-    if (new == NULL || old == NULL || old->type != PHYLIB_ROLLING_BALL || new->type != PHYLIB_ROLLING_BALL) {
-        return;
-    }
-
+static void phylib_roll_coords(phylib_coord *new_pos, phylib_coord *new_vel, phylib_coord old_pos, phylib_coord old_vel,
+                               phylib_coord *old_acc, double time) {
     //Calculate the velocity of the new ball using formula: v = u + at
-    phylib_coord new_vel;
-    new_vel.x = old->obj.rolling_ball.vel.x + (old->obj.rolling_ball.acc.x * time);
-    new_vel.y = old->obj.rolling_ball.vel.y + (old->obj.rolling_ball.acc.y * time);
+    phylib_coord vel;
+    vel.x = old_vel.x + (old_acc->x * time);
+    vel.y = old_vel.y + (old_acc->y * time);
 
     //Check for change in direction in the x-axis (sign change)
-    if (old->obj.rolling_ball.acc.x != 0) {
+    if (old_acc->x != 0) {
         /* Calculate the time it takes for the ball's velocity in the x-direction to become 0. 
            Formula is derived from: v = u + at. 
            v is zero (since it is time to stop)
-           u is initial velocity (old->obj.rolling_ball.vel.x)
-           a is acceleration (old->obj.rolling_ball.acc.x). 
+           u is initial velocity (old_vel.x)
+           a is acceleration (old_acc->x). 
                 a is multiplied by -1 (negative) to handle the deceleration. Time to stop is velocity 
                 and acceleration in opposite directions (deceleration) 
            Rearranging the equation gives t = u / a which equals time to reach zero velocity */
-        double time_to_zero_x = old->obj.rolling_ball.vel.x / (-1 * old->obj.rolling_ball.acc.x);
+        double time_to_zero_x = old_vel.x / (-1 * old_acc->x);
         //Check if time to zero falls within 0 and 'time'
         if(time_to_zero_x >= 0 && time_to_zero_x <= time) {
             //If velocity changes sign, set velocity and acceleration to 0
-            new_vel.x = 0;
-            old->obj.rolling_ball.acc.x = 0;
+            vel.x = 0;
+            old_acc->x = 0;
         }
     }
     //Check for change in direction in the y-axis (sign change)
-    if (old->obj.rolling_ball.acc.y != 0) {
+    if (old_acc->y != 0) {
         //Calculate the time it takes for velocity in the y-direction to become 0 (same as x). 
-        double time_to_zero_y = old->obj.rolling_ball.vel.y / (-1 * old->obj.rolling_ball.acc.y);
+        double time_to_zero_y = old_vel.y / (-1 * old_acc->y);
         //Check if time to zero falls within 0 and 'time'
         if (time_to_zero_y >= 0 && time_to_zero_y <= time) {
             //If velocity changes sign, set velocity and acceleration to 0
-            new_vel.y = 0;
-            old->obj.rolling_ball.acc.y = 0;
+            vel.y = 0;
+            old_acc->y = 0;
         }
     }
 
-    new->obj.rolling_ball.vel = new_vel; //Assign the calculated velocity to the 'new' updated ball
+    *new_vel = vel; //Assign the calculated velocity to the 'new' updated ball
 
     // Update the position (x and y) of the new ball using the equation of motion: s = ut + 0.5at^2
-    new->obj.rolling_ball.pos.x = old->obj.rolling_ball.pos.x + old->obj.rolling_ball.vel.x * time + 0.5 * old->obj.rolling_ball.acc.x * time * time;
-    new->obj.rolling_ball.pos.y = old->obj.rolling_ball.pos.y + old->obj.rolling_ball.vel.y * time + 0.5 * old->obj.rolling_ball.acc.y * time * time;
+    new_pos->x = old_pos.x + old_vel.x * time + 0.5 * old_acc->x * time * time;
+    new_pos->y = old_pos.y + old_vel.y * time + 0.5 * old_acc->y * time * time;
+}
+
+/**
+ * @brief Updates a 'new' phylib_object that represents the 'old' phylib_object after it was rolled for a 
+ * period of 'time'. Updates the values in 'new' according to the equations for position and velocity. 
+ * If either velocities change sign (change direction) during the time interval then the velocity and corresponding 
+ * acceleration are set to 0.
+ * @param new @param old @param time 
+ */
+void phylib_roll(phylib_object *new, phylib_object *old, double time) {
+    //Check if new or old point to a NULL location OR if old or new are NOT rolling balls. If so return.
+    if (new == NULL || old == NULL || old->type != PHYLIB_ROLLING_BALL || new->type != PHYLIB_ROLLING_BALL) {
+        return;
+    }
+
+    phylib_roll_coords(&new->obj.rolling_ball.pos, &new->obj.rolling_ball.vel,
+                       old->obj.rolling_ball.pos, old->obj.rolling_ball.vel, &old->obj.rolling_ball.acc, time);
+}
+
+/**
+ * @brief Checks whether a ball moving with velocity 'vel' has stopped (speed less then PHYLIB_VEL_EPSILON).
+ * If it has, velocity and acceleration are reset to 0 and 1 is returned. Otherwise, returns 0.
+ * @param vel @param acc 
+ * @return unsigned char 
+ */
+static unsigned char phylib_stopped_coords(phylib_coord *vel, phylib_coord *acc) {
+    //Calculate the speed of the ball with equals length of the velocity
+    double speed = phylib_length(*vel);
+
+    //Check if speed is less then PHYLIB_VEL_EPSILON (meaning it has stopped)
+    if (speed < PHYLIB_VEL_EPSILON) {
+        //Reset all the properties (vel and acc)
+        vel->x = 0;
+        vel->y = 0;
+        acc->x = 0;
+        acc->y = 0;
+
+        return 1; //Meaning the ball stopped
+    }
+
+    return 0; //If this is reached that means the ball was not slowed down enough to be considered stopped
 }
 
 /**
@@ -406,22 +466,67 @@ unsigned char phylib_stopped(phylib_object *object) {
         return 0; 
     }
 
-    //Calculate the speed of the ball with equals length of the velocity
-    double speed = phylib_length(object->obj.rolling_ball.vel); //Calculate the speed (length of the velocity)
-
-    //Check if speed is less then PHYLIB_VEL_EPSILON (meaning it has stopped)
-    if (speed < PHYLIB_VEL_EPSILON) {
-        //Convert to STILL_BALL and reset all the properties (vel and acc)
+    //Check if the ball has slowed down enough to be considered stopped
+    if (phylib_stopped_coords(&object->obj.rolling_ball.vel, &object->obj.rolling_ball.acc)) {
+        //Convert to STILL_BALL
         object->type = PHYLIB_STILL_BALL;
-        object->obj.rolling_ball.vel.x = 0;
-        object->obj.rolling_ball.vel.y = 0;
-        object->obj.rolling_ball.acc.x = 0;
-        object->obj.rolling_ball.acc.y = 0;
 
         return 1; //Meaning the ball stopped and has successfully converted
     }
 
-    return 0; //If this is reached that means the ball was not slowed down enough to be considered stopped
+    return 0;
+}
+
+/**
+ * @brief Handles the elastic collision of two balls a and b given their positions, velocities and accelerations.
+ * Updates the velocities of both balls and recomputes their accelerations (drag) from the new velocities.
+ * @param pos_a @param vel_a @param acc_a @param pos_b @param vel_b @param acc_b 
+ */
+static void phylib_bounce_balls(phylib_coord pos_a, phylib_coord *vel_a, phylib_coord *acc_a,
+                                phylib_coord pos_b, phylib_coord *vel_b, phylib_coord *acc_b) {
+    //Calculate the position of a relative to b. Call it r_ab. r_ab = r_a - r_b
+    phylib_coord r_ab = phylib_sub(pos_a, pos_b);
+
+    //Calculate the velocity of a with respect to b. Call it v_rel
+    phylib_coord v_rel = phylib_sub(*vel_a, *vel_b);
+
+    //Length of r_ab. Used for next step
+    double r_ab_length = phylib_length(r_ab);
+    //Divide the x and y components of r_ab by the length of r_ab. Call it n
+    phylib_coord n = {r_ab.x / r_ab_length, r_ab.y / r_ab_length};
+
+    //Ratio of the relative velocity v_rel by computing dot product of v_rel with respect to n. Call it v_rel_n
+    double v_rel_n = phylib_dot_product(v_rel, n);
+
+    phylib_coord v_a, v_b; //Variables used for updating and storing new velocities
+
+    //Update the x velocity of ball a by subtracting v_rel * n.x (x component of vector n)
+    v_a.x = vel_a->x - v_rel_n * n.x;
+    //Same for the y velocity
+    v_a.y = vel_a->y - v_rel_n * n.y;
+
+    //Now update the x velocity of ball b by adding the product of v_rel and vector n
+    v_b.x = vel_b->x + v_rel_n * n.x;
+    //Same for y velocity
+    v_b.y = vel_b->y + v_rel_n * n.y;
+
+    //Now update the new velocities
+    *vel_a = v_a;
+    *vel_b = v_b;
+
+    //Compute the speeds of a and b as the lengths of their velocities
+    double speed_a = phylib_length(*vel_a);
+    double speed_b = phylib_length(*vel_b);
+
+    //If speed > PHYLIB_VEL_EPSILON then set acceleration to the negative velocity divided by speed * PHYLIB_DRAG
+    if (speed_a > PHYLIB_VEL_EPSILON) {
+        acc_a->x = -(vel_a->x / speed_a) * PHYLIB_DRAG;
+        acc_a->y = -(vel_a->y / speed_a) * PHYLIB_DRAG;
+    } 
+    if (speed_b > PHYLIB_VEL_EPSILON) {
+        acc_b->x = -(vel_b->x / speed_b) * PHYLIB_DRAG;
+        acc_b->y = -(vel_b->y / speed_b) * PHYLIB_DRAG;
+    } 
 }
 
 /**
@@ -430,10 +535,9 @@ unsigned char phylib_stopped(phylib_object *object) {
  * @param a @param b 
  */
 void phylib_bounce(phylib_object **a, phylib_object **b) {
-    phylib_coord r_ab, v_rel;
     unsigned char old_number;
     //Check that the objects are not NULL or not ROLLING_BALL's. If so return.
-    if (a == NULL || *a == NULL | (*a)->type != PHYLIB_ROLLING_BALL) {
+    if (a == NULL || *a == NULL || (*a)->type != PHYLIB_ROLLING_BALL) {
         return;
     }
 
@@ -468,55 +572,14 @@ void phylib_bounce(phylib_object **a, phylib_object **b) {
             vel.x = 0;
             acc.x = 0;
             vel.y = 0;
-            acc.x = 0;
+            acc.y = 0;
             free(*b); //Free the original STILL_BALL memory (get rid of it)
             (*b) = phylib_new_rolling_ball(old_number, &original_coord, &vel, &acc); //Create a ROLLING_BALL with the same properties
             //Automatically proceed to case 5 (no break statement)
 
         case PHYLIB_ROLLING_BALL:
-            //Calculate the position of a relative to b. Call it r_ab. r_ab = r_a - r_b
-            r_ab = phylib_sub((*a)->obj.rolling_ball.pos, (*b)->obj.rolling_ball.pos);
-
-            //Calculate the velocity of a with respect to b. Call it v_rel
-            v_rel = phylib_sub((*a)->obj.rolling_ball.vel, (*b)->obj.rolling_ball.vel);
-
-            //Length of r_ab. Used for next step
-            double r_ab_length = phylib_length(r_ab);
-            //Divide the x and y components of r_ab by the length of r_ab. Call it n
-            phylib_coord n = {r_ab.x / r_ab_length, r_ab.y / r_ab_length};
-
-            //Ratio of the relative velocity v_rel by computing dot product of v_rel with respect to n. Call it v_rel_n
-            double v_rel_n = phylib_dot_product(v_rel, n);
-
-            phylib_coord v_a, v_b; //Variables used for updating and storing new velocities
-
-            //Update the x velocity of ball a by subtracting v_rel * n.x (x component of vector n)
-            v_a.x = (*a)->obj.rolling_ball.vel.x - v_rel_n * n.x;
-            //Same for the y velocity
-            v_a.y = (*a)->obj.rolling_ball.vel.y - v_rel_n * n.y;
-
-            //Now update the x velocity of ball b by adding the product of v_rel and vector n
-            v_b.x = (*b)->obj.rolling_ball.vel.x + v_rel_n * n.x;
-            //Same for y velocity
-            v_b.y = (*b)->obj.rolling_ball.vel.y + v_rel_n * n.y;
-
-            //Now update the new velocities
-            (*a)->obj.rolling_ball.vel = v_a;
-            (*b)->obj.rolling_ball.vel = v_b;
-
-            //Compute the speeds of a and b as the lengths of their velocities
-            double speed_a = phylib_length((*a)->obj.rolling_ball.vel);
-            double speed_b = phylib_length((*b)->obj.rolling_ball.vel);
-
-            //If speed > PHYLIB_VEL_EPSILON then set acceleration to the negative velocity divided by speed * PHYLIB_DRAG
-            if (speed_a > PHYLIB_VEL_EPSILON) {
-                (*a)->obj.rolling_ball.acc.x = -((*a)->obj.rolling_ball.vel.x / speed_a) * PHYLIB_DRAG;
-                (*a)->obj.rolling_ball.acc.y = -((*a)->obj.rolling_ball.vel.y / speed_a) * PHYLIB_DRAG;
-            } 
-            if (speed_b > PHYLIB_VEL_EPSILON) {
-                (*b)->obj.rolling_ball.acc.x = -((*b)->obj.rolling_ball.vel.x / speed_b) * PHYLIB_DRAG;
-                (*b)->obj.rolling_ball.acc.y = -((*b)->obj.rolling_ball.vel.y / speed_b) * PHYLIB_DRAG;
-            } 
+            phylib_bounce_balls((*a)->obj.rolling_ball.pos, &(*a)->obj.rolling_ball.vel, &(*a)->obj.rolling_ball.acc,
+                                (*b)->obj.rolling_ball.pos, &(*b)->obj.rolling_ball.vel, &(*b)->obj.rolling_ball.acc);
     }
 }
 
@@ -544,6 +607,212 @@ unsigned char phylib_rolling(phylib_table *t) {
     return rolling; //Return number of rolling balls found in table
 }
 
+/* Broad-phase: a uniform grid over the table holding the objects that do not move during a segment
+   (STILL_BALL's and holes). A cell is at least as wide as the furthest a ball can be from an object it
+   touches (PHYLIB_HOLE_RADIUS), so a ball can only touch objects in its own cell or a neighbouring one. */
+
+#define PHYLIB_GRID_CELL    (2*PHYLIB_HOLE_RADIUS) //mm
+#define PHYLIB_GRID_COLS    (6) //PHYLIB_TABLE_WIDTH / PHYLIB_GRID_CELL, rounded up
+#define PHYLIB_GRID_ROWS    (12) //PHYLIB_TABLE_LENGTH / PHYLIB_GRID_CELL, rounded up
+
+typedef struct {
+    int head[PHYLIB_GRID_ROWS * PHYLIB_GRID_COLS]; //First object in each cell, -1 if the cell is empty
+    int next[PHYLIB_MAX_OBJECTS]; //Next object in the same cell, -1 at the end of the cell
+    int moving[PHYLIB_MAX_OBJECTS]; //Cushions and ROLLING_BALL's, which are not kept in cells
+    int moving_count;
+} phylib_grid;
+
+/**
+ * @brief Returns the grid column (or row) containing the coordinate v, clamped to the grid.
+ * @param v @param cells
+ * @return int
+ */
+static int phylib_grid_index(double v, int cells) {
+    int index = (int)floor(v / PHYLIB_GRID_CELL);
+    return (index < 0) ? 0 : ((index >= cells) ? cells - 1 : index);
+}
+
+/**
+ * @brief Fills the grid with every STILL_BALL and hole in the table, bucketed by the cell of their center.
+ * Objects in a cell are linked in increasing index order. Cushions and ROLLING_BALL's are listed separately.
+ * @param grid @param state
+ */
+static void phylib_grid_build(phylib_grid *grid, phylib_state *state) {
+    for (int c = 0; c < PHYLIB_GRID_ROWS * PHYLIB_GRID_COLS; c++) {
+        grid->head[c] = -1;
+    }
+    grid->moving_count = 0;
+    for (int j = 0; j < PHYLIB_MAX_OBJECTS; j++) {
+        if (state->type[j] != PHYLIB_NO_OBJECT && state->type[j] != PHYLIB_STILL_BALL && state->type[j] != PHYLIB_HOLE) {
+            grid->moving[grid->moving_count++] = j;
+        }
+    }
+    //Insert backwards so each cell's list ends up in increasing index order
+    for (int j = PHYLIB_MAX_OBJECTS - 1; j >= 0; j--) {
+        if (state->type[j] == PHYLIB_STILL_BALL || state->type[j] == PHYLIB_HOLE) {
+            int c = phylib_grid_index(state->pos[j].y, PHYLIB_GRID_ROWS) * PHYLIB_GRID_COLS +
+                    phylib_grid_index(state->pos[j].x, PHYLIB_GRID_COLS);
+            grid->next[j] = grid->head[c];
+            grid->head[c] = j;
+        }
+    }
+}
+
+/**
+ * @brief Collects, in increasing index order, the objects that ball i could touch while its center stays inside
+ * the box [lo, hi]: STILL_BALL's and holes from the surrounding grid cells, cushions the box comes within a cell
+ * of, and other ROLLING_BALL's whose own boxes (box_lo/box_hi) come within a ball diameter of it.
+ * Writes the indices to candidates and returns how many there are.
+ * @param state @param grid @param i @param lo @param hi @param box_lo @param box_hi @param candidates
+ * @return int
+ */
+static int phylib_grid_candidates(phylib_state *state, phylib_grid *grid, int i, phylib_coord lo, phylib_coord hi,
+                                  phylib_coord *box_lo, phylib_coord *box_hi, int *candidates) {
+    int count = 0;
+
+    for (int k = 0; k < grid->moving_count; k++) {
+        int j = grid->moving[k];
+        if (j == i) {
+            continue;
+        }
+        switch (state->type[j]) {
+            case PHYLIB_HCUSHION:
+                //Only near the cushion's edge of the table
+                if (lo.y - state->pos[j].y < PHYLIB_GRID_CELL && state->pos[j].y - hi.y < PHYLIB_GRID_CELL) {
+                    candidates[count++] = j;
+                }
+                break;
+            case PHYLIB_VCUSHION:
+                if (lo.x - state->pos[j].x < PHYLIB_GRID_CELL && state->pos[j].x - hi.x < PHYLIB_GRID_CELL) {
+                    candidates[count++] = j;
+                }
+                break;
+            case PHYLIB_ROLLING_BALL:
+                //Sweep-and-prune style box overlap test against the other moving balls
+                if (box_lo[j].x - hi.x < PHYLIB_BALL_DIAMETER && lo.x - box_hi[j].x < PHYLIB_BALL_DIAMETER &&
+                    box_lo[j].y - hi.y < PHYLIB_BALL_DIAMETER && lo.y - box_hi[j].y < PHYLIB_BALL_DIAMETER) {
+                    candidates[count++] = j;
+                }
+                break;
+            default:
+                break; //STILL_BALL's and holes come from the grid below
+        }
+    }
+
+    //Every cell the box overlaps plus one cell of margin on every side
+    int col_lo = phylib_grid_index(lo.x, PHYLIB_GRID_COLS) - 1, col_hi = phylib_grid_index(hi.x, PHYLIB_GRID_COLS) + 1;
+    int row_lo = phylib_grid_index(lo.y, PHYLIB_GRID_ROWS) - 1, row_hi = phylib_grid_index(hi.y, PHYLIB_GRID_ROWS) + 1;
+    col_lo = (col_lo < 0) ? 0 : col_lo;
+    row_lo = (row_lo < 0) ? 0 : row_lo;
+    col_hi = (col_hi >= PHYLIB_GRID_COLS) ? PHYLIB_GRID_COLS - 1 : col_hi;
+    row_hi = (row_hi >= PHYLIB_GRID_ROWS) ? PHYLIB_GRID_ROWS - 1 : row_hi;
+
+    for (int row = row_lo; row <= row_hi; row++) {
+        for (int col = col_lo; col <= col_hi; col++) {
+            for (int j = grid->head[row * PHYLIB_GRID_COLS + col]; j != -1; j = grid->next[j]) {
+                //Insertion sort keeps the candidates in the same order phylib_segment used to check them in
+                int pos = count++;
+                while (pos > 0 && candidates[pos - 1] > j) {
+                    candidates[pos] = candidates[pos - 1];
+                    pos--;
+                }
+                candidates[pos] = j;
+            }
+        }
+    }
+    return count;
+}
+
+/**
+ * @brief phylib_bounce() for a compact table: ball a (a ROLLING_BALL) collides with object b. Nothing is allocated
+ * or freed; a ball that drops into a hole simply leaves its slot empty.
+ * @param state @param a @param b
+ */
+static void phylib_state_bounce(phylib_state *state, int a, int b) {
+    switch (state->type[b]) {
+        case PHYLIB_HCUSHION:
+            //Negate (sign change) the y values of velocity and acceleration
+            state->vel[a].y = -state->vel[a].y;
+            state->acc[a].y = -state->acc[a].y;
+            break;
+        case PHYLIB_VCUSHION:
+            //Negate (sign change) the x values of velocity and acceleration
+            state->vel[a].x = -state->vel[a].x;
+            state->acc[a].x = -state->acc[a].x;
+            break;
+        case PHYLIB_HOLE:
+            state->type[a] = PHYLIB_NO_OBJECT;
+            break;
+        case PHYLIB_STILL_BALL:
+            //The still ball starts rolling from rest, then continues as a ball-ball collision
+            state->type[b] = PHYLIB_ROLLING_BALL;
+            state->vel[b] = (phylib_coord){0.0, 0.0};
+            state->acc[b] = (phylib_coord){0.0, 0.0};
+            //fall through
+        case PHYLIB_ROLLING_BALL:
+            phylib_bounce_balls(state->pos[a], &state->vel[a], &state->acc[a], state->pos[b], &state->vel[b], &state->acc[b]);
+            break;
+    }
+}
+
+/**
+ * @brief The fixed time step simulation behind phylib_segment(), on compact tables. dest becomes src after the
+ * next segment. Like phylib_roll(), the accelerations of balls in src are cleared when they change sign.
+ * @param dest @param src
+ */
+static void phylib_step_state(phylib_state *dest, phylib_state *src) {
+    memcpy(dest, src, sizeof(phylib_state)); //Copy the whole table in one go
+
+    double time = PHYLIB_SIM_RATE; //Set inital time to PHYLIB_SIM_RATE
+
+    //Broad-phase: still balls and holes don't move during a segment, so bucket them once
+    phylib_grid grid;
+    phylib_grid_build(&grid, dest);
+    phylib_coord box_lo[PHYLIB_MAX_OBJECTS], box_hi[PHYLIB_MAX_OBJECTS];
+    int candidates[PHYLIB_MAX_OBJECTS];
+
+    //Simulate the table for each time increment until MAX_TIME is reached
+    for ( ; time <= PHYLIB_MAX_TIME; time += PHYLIB_SIM_RATE) {
+        //Apply roll to the rolling balls
+        for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+            if (dest->type[i] == PHYLIB_ROLLING_BALL) {
+                phylib_roll_coords(&dest->pos[i], &dest->vel[i], src->pos[i], src->vel[i], &src->acc[i], time);
+                box_lo[i] = box_hi[i] = dest->pos[i];
+            }
+        }
+
+        //Check for stopping conditions and collisions after rolling the balls
+        for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+            //Only rolling balls can stop or collide
+            if (dest->type[i] != PHYLIB_ROLLING_BALL) {
+                continue;
+            }
+            // Check if the ball has stopped
+            if (phylib_stopped_coords(&dest->vel[i], &dest->acc[i])) {
+                dest->type[i] = PHYLIB_STILL_BALL; //If stopped, change its type to STILL_BALL
+                dest->time += time;
+                return;
+            }
+
+            //Check for collisions with the objects near the ball
+            int count = phylib_grid_candidates(dest, &grid, i, dest->pos[i], dest->pos[i], box_lo, box_hi, candidates);
+            for (int k = 0; k < count; k++) {
+                int j = candidates[k];
+                double distance = phylib_distance_to(dest->pos[i], dest->type[j], dest->pos[j]);
+                //If a collision is detected, bounce
+                if (distance < 0.0 && distance != -1.0) {
+                    phylib_state_bounce(dest, i, j);
+                    dest->time += time;
+                    return;
+                }
+            }
+        }
+    }
+    // Update the simulation time
+    time += PHYLIB_SIM_RATE;
+    dest->time += time;
+}
+
 /**
  * @brief Returns a segment of a pool shot. If there are no ROLLING_BALL's on the table, return NULL.
  * Otherwise, return a copy of the table. The returned table should be the result of applying phylib_roll()
@@ -559,55 +828,817 @@ phylib_table *phylib_segment(phylib_table *table) {
         return NULL;
     }
 
-    phylib_table *copyTable = phylib_copy_table(table); //Create a copy of the table
-    //Check if the copy was successful. If not return NULL
-    if (copyTable == NULL) {
-        return NULL;
+    //Simulate on compact copies of the table so no objects are allocated until the result is built
+    phylib_state start, end;
+    phylib_pack_table(&start, table);
+    phylib_step_state(&end, &start);
+
+    //phylib_roll() clears the acceleration of the original balls when they change direction, keep doing that
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+        if (table->object[i] != NULL && table->object[i]->type == PHYLIB_ROLLING_BALL) {
+            table->object[i]->obj.rolling_ball.acc = start.acc[i];
+        }
     }
 
-    double time = PHYLIB_SIM_RATE; //Set inital time to PHYLIB_SIM_RATE
+    return phylib_unpack_table(&end); //Return the table after the segment
+}
 
-    //Simulate the table for each time increment until MAX_TIME is reached
-    for ( ; time <= PHYLIB_MAX_TIME; time += PHYLIB_SIM_RATE) {
-        //Iterate over each object in the table
+// PART 4: Event-driven simulation
+
+/**
+ * @brief Advances a rolling ball in place by 'time' seconds using the closed-form equations of motion.
+ * Unlike phylib_roll() this never overshoots: once an axis' velocity reaches 0 within the interval, that
+ * axis is frozen at the position where it stopped and its velocity and acceleration are set to 0.
+ * @param pos @param vel @param acc @param time
+ */
+static void phylib_advance(phylib_coord *pos, phylib_coord *vel, phylib_coord *acc, double time) {
+    double *p[2] = {&pos->x, &pos->y};
+    double *v[2] = {&vel->x, &vel->y};
+    double *a[2] = {&acc->x, &acc->y};
+
+    for (int k = 0; k < 2; k++) {
+        double t = time;
+        unsigned char stops = 0;
+        //Same sign change check as phylib_roll(): the axis stops if v = u + at reaches 0 inside the interval
+        if (*a[k] != 0) {
+            double time_to_zero = *v[k] / (-1 * *a[k]);
+            if (time_to_zero >= 0 && time_to_zero <= time) {
+                t = time_to_zero; //Only move up to the point where the axis stops
+                stops = 1;
+            }
+        }
+        *p[k] += *v[k] * t + 0.5 * *a[k] * t * t; //s = ut + 0.5at^2
+        if (stops) {
+            *v[k] = 0;
+            *a[k] = 0;
+        } else {
+            *v[k] += *a[k] * t; //v = u + at
+        }
+    }
+}
+
+/**
+ * @brief Returns the time from now until a rolling ball's velocity on one axis becomes 0 (the axis stops),
+ * or INFINITY if the axis never stops (it is not moving, or it is not decelerating).
+ * @param vel @param acc
+ * @return double
+ */
+static double phylib_axis_stop_time(double vel, double acc) {
+    if (vel == 0 || acc == 0) {
+        return (vel == 0) ? 0.0 : INFINITY;
+    }
+    double time_to_zero = vel / (-1 * acc);
+    return (time_to_zero >= 0) ? time_to_zero : INFINITY;
+}
+
+/**
+ * @brief Finds the real roots of a*t^3 + b*t^2 + c*t + d = 0 (falling back to the quadratic and linear
+ * cases when the leading coefficients vanish). Writes them to roots and returns how many there are.
+ * @param a @param b @param c @param d @param roots
+ * @return int
+ */
+static int phylib_cubic_roots(double a, double b, double c, double d, double roots[3]) {
+    double scale = fabs(a) + fabs(b) + fabs(c) + fabs(d);
+    if (scale == 0) {
+        return 0;
+    }
+
+    //Cubic term is negligible: solve b*t^2 + c*t + d = 0 instead
+    if (fabs(a) <= 1e-12 * scale) {
+        if (fabs(b) <= 1e-12 * scale) {
+            if (c == 0) {
+                return 0;
+            }
+            roots[0] = -d / c;
+            return 1;
+        }
+        double disc = c * c - 4 * b * d;
+        if (disc < 0) {
+            return 0;
+        }
+        //Numerically stable form of the quadratic formula
+        double q = -0.5 * (c + copysign(sqrt(disc), c));
+        int n = 0;
+        roots[n++] = q / b;
+        if (q != 0) {
+            roots[n++] = d / q;
+        }
+        return n;
+    }
+
+    //Depressed cubic t = s - b/3a gives s^3 + p*s + q = 0
+    double B = b / a, C = c / a, D = d / a;
+    double p = C - B * B / 3.0;
+    double q = 2.0 * B * B * B / 27.0 - B * C / 3.0 + D;
+    double shift = -B / 3.0;
+    double disc = q * q / 4.0 + p * p * p / 27.0;
+
+    if (disc > 0) {
+        //One real root (Cardano)
+        double sq = sqrt(disc);
+        roots[0] = cbrt(-q / 2.0 + sq) + cbrt(-q / 2.0 - sq) + shift;
+        return 1;
+    }
+    if (p == 0) {
+        roots[0] = shift; //Triple root
+        return 1;
+    }
+    //Three real roots (trigonometric method)
+    double m = 2.0 * sqrt(-p / 3.0);
+    double arg = 3.0 * q / (p * m);
+    arg = (arg > 1.0) ? 1.0 : ((arg < -1.0) ? -1.0 : arg);
+    double theta = acos(arg) / 3.0;
+    double third = 2.0 * acos(-1.0) / 3.0; //2*pi/3
+    for (int k = 0; k < 3; k++) {
+        roots[k] = m * cos(theta - third * k) + shift;
+    }
+    return 3;
+}
+
+/**
+ * @brief Returns the first time in (0, horizon] at which two objects come into contact, or -1.0 if they
+ * do not. The relative position of the objects is d(t) = d0 + dv*t + 0.5*da*t^2, and contact means
+ * |d(t)| <= radius, so the contact times are the roots of the quartic f(t) = |d(t)|^2 - radius^2.
+ * The roots of f'(t) (a cubic, solved in closed form) split the interval into pieces on which f is monotone,
+ * and the first piece where f changes sign is narrowed down by bisection.
+ * Objects that already overlap only count as touching now if they are moving towards each other, unless
+ * capture is set (holes capture any ball inside them).
+ * @param d0 @param dv @param da @param radius @param horizon @param capture
+ * @return double
+ */
+static double phylib_contact_time(phylib_coord d0, phylib_coord dv, phylib_coord da,
+                                  double radius, double horizon, unsigned char capture) {
+    //Cheap rejection: the gap can close by at most |dv|*t + 0.5*|da|*t^2 before the horizon
+    double reach = phylib_length(dv) * horizon + 0.5 * phylib_length(da) * horizon * horizon;
+    if (phylib_length(d0) - reach > radius) {
+        return -1.0;
+    }
+
+    //Coefficients of f(t) = c4*t^4 + c3*t^3 + c2*t^2 + c1*t + c0
+    phylib_coord half_a = {0.5 * da.x, 0.5 * da.y};
+    double c4 = phylib_dot_product(half_a, half_a);
+    double c3 = 2 * phylib_dot_product(half_a, dv);
+    double c2 = phylib_dot_product(dv, dv) + 2 * phylib_dot_product(half_a, d0);
+    double c1 = 2 * phylib_dot_product(dv, d0);
+    double c0 = phylib_dot_product(d0, d0) - radius * radius;
+
+    if (c0 <= 0 && (capture || c1 < 0)) {
+        return 0.0; //Already touching and closing in (or inside a hole)
+    }
+
+    //Break points: 0, the roots of f'(t) inside (0, horizon) in increasing order, and horizon
+    double points[5], roots[3];
+    int n = phylib_cubic_roots(4 * c4, 3 * c3, 2 * c2, c1, roots);
+    int count = 0;
+    points[count++] = 0.0;
+    for (int k = 0; k < n; k++) {
+        if (roots[k] > 0 && roots[k] < horizon) {
+            int pos = count++;
+            while (pos > 1 && points[pos - 1] > roots[k]) {
+                points[pos] = points[pos - 1];
+                pos--;
+            }
+            points[pos] = roots[k];
+        }
+    }
+    points[count++] = horizon;
+
+    for (int k = 0; k + 1 < count; k++) {
+        double lo = points[k], hi = points[k + 1];
+        double f_lo = (((c4 * lo + c3) * lo + c2) * lo + c1) * lo + c0;
+        double f_hi = (((c4 * hi + c3) * hi + c2) * hi + c1) * hi + c0;
+        if (f_lo > 0 && f_hi <= 0) {
+            //f is monotone on [lo, hi]: bisect until the interval can't shrink any further
+            for (int iter = 0; iter < 100 && hi - lo > 0; iter++) {
+                double mid = 0.5 * (lo + hi);
+                if (mid <= lo || mid >= hi) {
+                    break;
+                }
+                double f_mid = (((c4 * mid + c3) * mid + c2) * mid + c1) * mid + c0;
+                if (f_mid > 0) {
+                    lo = mid;
+                } else {
+                    hi = mid;
+                }
+            }
+            return hi; //Earliest time known to be in contact
+        }
+    }
+    return -1.0;
+}
+
+/**
+ * @brief Returns the first time in [0, horizon] at which the ROLLING_BALL a touches object b (following the same
+ * rules as phylib_distance() becoming negative), or -1.0 if it does not happen.
+ * @param state @param a @param b @param horizon
+ * @return double
+ */
+static double phylib_event_time(phylib_state *state, int a, int b, double horizon) {
+    phylib_coord d0 = phylib_sub(state->pos[a], state->pos[b]);
+    phylib_coord dv = state->vel[a], da = state->acc[a];
+
+    switch (state->type[b]) {
+        case PHYLIB_ROLLING_BALL:
+            dv = phylib_sub(state->vel[a], state->vel[b]);
+            da = phylib_sub(state->acc[a], state->acc[b]);
+            return phylib_contact_time(d0, dv, da, PHYLIB_BALL_DIAMETER, horizon, 0);
+        case PHYLIB_STILL_BALL:
+            return phylib_contact_time(d0, dv, da, PHYLIB_BALL_DIAMETER, horizon, 0);
+        case PHYLIB_HOLE:
+            return phylib_contact_time(d0, dv, da, PHYLIB_HOLE_RADIUS, horizon, 1);
+        case PHYLIB_HCUSHION:
+            //Only the y-axis matters for a horizontal cushion
+            d0.x = dv.x = da.x = 0.0;
+            return phylib_contact_time(d0, dv, da, PHYLIB_BALL_RADIUS, horizon, 0);
+        case PHYLIB_VCUSHION:
+            //Only the x-axis matters for a vertical cushion
+            d0.y = dv.y = da.y = 0.0;
+            return phylib_contact_time(d0, dv, da, PHYLIB_BALL_RADIUS, horizon, 0);
+        default:
+            return -1.0;
+    }
+}
+
+/**
+ * @brief The event-driven simulation behind phylib_segment_event(), on compact tables. dest becomes src after
+ * the next segment.
+ * @param dest @param src
+ */
+static void phylib_event_state(phylib_state *dest, phylib_state *src) {
+    memcpy(dest, src, sizeof(phylib_state)); //Copy the whole table in one go
+
+    double elapsed = 0.0; //Time simulated so far in this segment
+
+    //Broad-phase: still balls and holes don't move during a segment, so bucket them once
+    phylib_grid grid;
+    phylib_grid_build(&grid, dest);
+    phylib_coord box_lo[PHYLIB_MAX_OBJECTS], box_hi[PHYLIB_MAX_OBJECTS];
+    int candidates[PHYLIB_MAX_OBJECTS];
+
+    while (elapsed < PHYLIB_MAX_TIME) {
+        //A ball that is already too slow stops right away (same rule as phylib_stopped)
+        unsigned char stopped = 0;
         for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
-            phylib_object *current = copyTable->object[i]; //Store current object in 'current' 
-            //If object in 'current' not NULL and is a ROLLING_BALL
-            if (current != NULL && current->type == PHYLIB_ROLLING_BALL) {
-                phylib_roll(current, table->object[i], time); // Apply roll to the rolling balls
+            if (dest->type[i] == PHYLIB_ROLLING_BALL && phylib_stopped_coords(&dest->vel[i], &dest->acc[i])) {
+                dest->type[i] = PHYLIB_STILL_BALL;
+                stopped = 1;
             }
         }
+        if (stopped) {
+            dest->time += elapsed;
+            return;
+        }
 
-        //Check for stopping conditions and collisions after rolling the balls
+        //Motion is a single parabola per ball until the next time an axis of some ball stops
+        double horizon = PHYLIB_MAX_TIME - elapsed;
         for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
-            phylib_object *current = copyTable->object[i];
-            if (current != NULL && current->type == PHYLIB_ROLLING_BALL) {
-                // Check if the ball has stopped
-                if (phylib_stopped(current)) {
-                    current->type = PHYLIB_STILL_BALL; //If stopped, change its type to STILL_BALL
-                    copyTable->time += time;
-                    return copyTable; //Return the updated table
+            if (dest->type[i] == PHYLIB_ROLLING_BALL) {
+                double tx = phylib_axis_stop_time(dest->vel[i].x, dest->acc[i].x);
+                double ty = phylib_axis_stop_time(dest->vel[i].y, dest->acc[i].y);
+                //An axis that is already at rest must not keep accelerating
+                if (tx == 0) {
+                    dest->acc[i].x = 0;
+                } else if (tx < horizon) {
+                    horizon = tx;
+                }
+                if (ty == 0) {
+                    dest->acc[i].y = 0;
+                } else if (ty < horizon) {
+                    horizon = ty;
                 }
             }
+        }
 
-            //Check for collisions with other objects
-            for (int j = 0; j < PHYLIB_MAX_OBJECTS; j++) {
-                if (j != i && copyTable->object[j] != NULL) {
-                    double distance = phylib_distance(current, copyTable->object[j]);
-                    //If a collision is detected, apply phylib_bounce() 
-                    if (distance < 0.0 && distance != -1.0) {
-                        phylib_bounce(&(copyTable->object[i]), &(copyTable->object[j]));
-                        copyTable->time += time;
-                        return copyTable; //Return the updated table
-                    }
+        //Broad-phase: the box each rolling ball sweeps before the horizon (each axis is monotone until then)
+        for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+            if (dest->type[i] == PHYLIB_ROLLING_BALL) {
+                phylib_coord end = dest->pos[i], vel = dest->vel[i], acc = dest->acc[i];
+                phylib_advance(&end, &vel, &acc, horizon);
+                box_lo[i].x = fmin(dest->pos[i].x, end.x);
+                box_lo[i].y = fmin(dest->pos[i].y, end.y);
+                box_hi[i].x = fmax(dest->pos[i].x, end.x);
+                box_hi[i].y = fmax(dest->pos[i].y, end.y);
+            }
+        }
+
+        //Find the earliest collision before the horizon. Pairs are checked in the same order as phylib_segment
+        double first = horizon;
+        int hit_a = -1, hit_b = -1;
+        for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+            if (dest->type[i] != PHYLIB_ROLLING_BALL) {
+                continue;
+            }
+            int count = phylib_grid_candidates(dest, &grid, i, box_lo[i], box_hi[i], box_lo, box_hi, candidates);
+            for (int k = 0; k < count; k++) {
+                int j = candidates[k];
+                //Skip rolling ball pairs that were already checked from the other side
+                if (dest->type[j] == PHYLIB_ROLLING_BALL && j < i) {
+                    continue;
+                }
+                double t = phylib_event_time(dest, i, j, first);
+                if (t >= 0.0 && (hit_a == -1 || t < first)) {
+                    first = t;
+                    hit_a = i;
+                    hit_b = j;
                 }
             }
         }
+
+        //Jump every rolling ball straight to the event
+        for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+            if (dest->type[i] == PHYLIB_ROLLING_BALL) {
+                phylib_advance(&dest->pos[i], &dest->vel[i], &dest->acc[i], first);
+            }
+        }
+        elapsed += first;
+
+        if (hit_a != -1) {
+            phylib_state_bounce(dest, hit_a, hit_b);
+            dest->time += elapsed;
+            return;
+        }
+        //Otherwise the horizon was reached: a ball stopped (checked at the top of the loop), an axis of a
+        //ball stopped while the other axis keeps moving, or PHYLIB_MAX_TIME was reached
     }
-    // Update the simulation time
-    time += PHYLIB_SIM_RATE;
-    copyTable->time += time;
-    return copyTable; //Return the final table after simulation is complete
+
+    dest->time += elapsed;
+}
+
+/**
+ * @brief Event-driven version of phylib_segment(). Returns the same kind of segment table, but instead of stepping
+ * every ball forward by PHYLIB_SIM_RATE and re-checking every pair of objects, it computes exactly when the next
+ * event happens (a ball hitting a ball or cushion, dropping into a hole or stopping under PHYLIB_DRAG) and jumps
+ * straight there. Returns NULL if there are no ROLLING_BALL's on the table.
+ * @param table
+ * @return phylib_table*
+ */
+phylib_table *phylib_segment_event(phylib_table *table) {
+    //Check if the table is NULL or if the table has no ROLLING_BALL's. If so return NULL.
+    if (table == NULL || phylib_rolling(table) == 0) {
+        return NULL;
+    }
+
+    phylib_state start, end;
+    phylib_pack_table(&start, table);
+    phylib_event_state(&end, &start);
+
+    return phylib_unpack_table(&end); //Return the table after the segment
+}
+
+// PART 5: Compact tables
+
+/**
+ * @brief Copies every object of table into the compact table state. Empty slots become PHYLIB_NO_OBJECT.
+ * @param state @param table
+ */
+void phylib_pack_table(phylib_state *state, phylib_table *table) {
+    state->time = table->time;
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+        phylib_object *object = table->object[i];
+        //Start from an empty slot
+        state->type[i] = PHYLIB_NO_OBJECT;
+        state->number[i] = 0;
+        state->pos[i] = state->vel[i] = state->acc[i] = (phylib_coord){0.0, 0.0};
+        if (object == NULL) {
+            continue;
+        }
+        state->type[i] = object->type;
+        state->pos[i] = phylib_object_pos(object);
+        if (object->type == PHYLIB_STILL_BALL) {
+            state->number[i] = object->obj.still_ball.number;
+        } else if (object->type == PHYLIB_ROLLING_BALL) {
+            state->number[i] = object->obj.rolling_ball.number;
+            state->vel[i] = object->obj.rolling_ball.vel;
+            state->acc[i] = object->obj.rolling_ball.acc;
+        }
+    }
+}
+
+/**
+ * @brief Allocates a new phylib_table holding the objects of the compact table state.
+ * Returns NULL if memory allocation fails.
+ * @param state
+ * @return phylib_table*
+ */
+phylib_table *phylib_unpack_table(phylib_state *state) {
+    phylib_table *newTable = (phylib_table *)malloc(sizeof(phylib_table));
+    //Check if memory allocation is successful. If not return NULL
+    if (newTable == NULL) {
+        return NULL;
+    }
+    newTable->time = state->time;
+
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+        switch (state->type[i]) {
+            case PHYLIB_STILL_BALL:
+                newTable->object[i] = phylib_new_still_ball(state->number[i], &state->pos[i]);
+                break;
+            case PHYLIB_ROLLING_BALL:
+                newTable->object[i] = phylib_new_rolling_ball(state->number[i], &state->pos[i], &state->vel[i], &state->acc[i]);
+                break;
+            case PHYLIB_HOLE:
+                newTable->object[i] = phylib_new_hole(&state->pos[i]);
+                break;
+            case PHYLIB_HCUSHION:
+                newTable->object[i] = phylib_new_hcushion(state->pos[i].y);
+                break;
+            case PHYLIB_VCUSHION:
+                newTable->object[i] = phylib_new_vcushion(state->pos[i].x);
+                break;
+            default:
+                newTable->object[i] = NULL;
+                continue;
+        }
+        //If allocation for the object fails, free what was allocated and return NULL
+        if (newTable->object[i] == NULL) {
+            for (int j = i + 1; j < PHYLIB_MAX_OBJECTS; j++) {
+                newTable->object[j] = NULL;
+            }
+            phylib_free_table(newTable);
+            return NULL;
+        }
+    }
+
+    return newTable;
+}
+
+/**
+ * @brief Returns the number of ROLLING_BALLS in the compact table state
+ * @param state
+ * @return unsigned char
+ */
+unsigned char phylib_state_rolling(phylib_state *state) {
+    unsigned char rolling = 0;
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+        if (state->type[i] == PHYLIB_ROLLING_BALL) {
+            rolling++;
+        }
+    }
+    return rolling;
+}
+
+/**
+ * @brief Simulates the next segment of a shot on compact tables with the given engine, writing the table at the end
+ * of the segment to dest. Returns 0 (and leaves dest untouched) if there are no ROLLING_BALL's in src, otherwise 1.
+ * @param dest @param src @param engine
+ * @return unsigned char
+ */
+unsigned char phylib_state_segment(phylib_state *dest, phylib_state *src, phylib_engine engine) {
+    if (dest == NULL || src == NULL || phylib_state_rolling(src) == 0) {
+        return 0;
+    }
+
+    if (engine == PHYLIB_ENGINE_EVENT) {
+        phylib_event_state(dest, src);
+    } else {
+        phylib_step_state(dest, src);
+    }
+    return 1;
+}
+
+/**
+ * @brief Allocates an empty arena. Its block of states is only allocated on the first push.
+ * @return phylib_arena*
+ */
+phylib_arena *phylib_new_arena(void) {
+    phylib_arena *newArena = (phylib_arena *)malloc(sizeof(phylib_arena));
+    //Check if memory allocation is successful. If not return NULL
+    if (newArena == NULL) {
+        return NULL;
+    }
+    newArena->states = NULL;
+    newArena->count = 0;
+    newArena->capacity = 0;
+
+    return newArena;
+}
+
+/**
+ * @brief Appends an uninitialised state to the arena, doubling its block of memory when it is full.
+ * Returns NULL if memory allocation fails. Growing the block moves it, so pointers returned by earlier calls
+ * are only valid until the next push.
+ * @param arena
+ * @return phylib_state*
+ */
+phylib_state *phylib_arena_push(phylib_arena *arena) {
+    if (arena == NULL) {
+        return NULL;
+    }
+    if (arena->count == arena->capacity) {
+        int capacity = (arena->capacity == 0) ? 16 : 2 * arena->capacity;
+        phylib_state *states = (phylib_state *)realloc(arena->states, capacity * sizeof(phylib_state));
+        if (states == NULL) {
+            return NULL;
+        }
+        arena->states = states;
+        arena->capacity = capacity;
+    }
+
+    return &arena->states[arena->count++];
+}
+
+/**
+ * @brief Simulates the next segment of the shot held in the arena, starting from its last state, and appends the
+ * table at the end of the segment. Returns 0 when the shot is over (nothing is rolling) or memory runs out, otherwise 1.
+ * @param arena @param engine
+ * @return unsigned char
+ */
+unsigned char phylib_arena_segment(phylib_arena *arena, phylib_engine engine) {
+    if (arena == NULL || arena->count == 0 || phylib_state_rolling(&arena->states[arena->count - 1]) == 0) {
+        return 0;
+    }
+    if (phylib_arena_push(arena) == NULL) {
+        return 0;
+    }
+
+    return phylib_state_segment(&arena->states[arena->count - 1], &arena->states[arena->count - 2], engine);
+}
+
+/**
+ * @brief Empties the arena so the next shot can reuse its memory.
+ * @param arena
+ */
+void phylib_arena_reset(phylib_arena *arena) {
+    if (arena != NULL) {
+        arena->count = 0;
+    }
+}
+
+/**
+ * @brief Free's the arena's block of states, then free's the arena.
+ * @param arena
+ */
+void phylib_free_arena(phylib_arena *arena) {
+    if (arena == NULL) {
+        return;
+    }
+    free(arena->states);
+    free(arena);
+}
+
+// PART 6: Whole shots
+
+/**
+ * @brief Strikes the cue ball (ball number 0) of the compact table: it becomes a ROLLING_BALL with velocity (xvel, yvel)
+ * and the matching drag, computed the same way as phylib_bounce(). Returns 1 if there is a cue ball, otherwise 0.
+ * @param state @param xvel @param yvel
+ * @return unsigned char
+ */
+unsigned char phylib_strike(phylib_state *state, double xvel, double yvel) {
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+        if ((state->type[i] == PHYLIB_STILL_BALL || state->type[i] == PHYLIB_ROLLING_BALL) && state->number[i] == 0) {
+            state->type[i] = PHYLIB_ROLLING_BALL;
+            state->vel[i] = (phylib_coord){xvel, yvel};
+            state->acc[i] = (phylib_coord){0.0, 0.0};
+
+            //If speed > PHYLIB_VEL_EPSILON then set acceleration to the negative velocity divided by speed * PHYLIB_DRAG
+            double speed = phylib_length(state->vel[i]);
+            if (speed > PHYLIB_VEL_EPSILON) {
+                state->acc[i].x = -(xvel / speed) * PHYLIB_DRAG;
+                state->acc[i].y = -(yvel / speed) * PHYLIB_DRAG;
+            }
+            return 1;
+        }
+    }
+    return 0; //No cue ball on the table
+}
+
+/**
+ * @brief Runs a whole shot in one call: strikes the cue ball of table with velocity (xvel, yvel) and simulates
+ * segments until every ball is at rest (or PHYLIB_MAX_TIME has passed since the shot started). The arena is reset
+ * and then holds the struck table followed by the table at the end of every segment, in order. table itself is
+ * left untouched. Returns the number of segments, or -1 if there is no cue ball or memory allocation fails.
+ * @param arena @param table @param xvel @param yvel @param engine
+ * @return int
+ */
+int phylib_shoot(phylib_arena *arena, phylib_table *table, double xvel, double yvel, phylib_engine engine) {
+    if (arena == NULL || table == NULL) {
+        return -1;
+    }
+    phylib_arena_reset(arena);
+
+    phylib_state *start = phylib_arena_push(arena);
+    if (start == NULL) {
+        return -1;
+    }
+    phylib_pack_table(start, table);
+    if (!phylib_strike(start, xvel, yvel)) {
+        phylib_arena_reset(arena);
+        return -1;
+    }
+
+    double start_time = start->time;
+    while (arena->states[arena->count - 1].time - start_time < PHYLIB_MAX_TIME && phylib_arena_segment(arena, engine)) {
+        //Keep simulating segments until nothing is rolling
+    }
+
+    return arena->count - 1;
+}
+
+// PART 7: Frame sampling
+
+/**
+ * @brief Returns the number of balls (STILL_BALL's and ROLLING_BALL's) in the compact table state
+ * @param state
+ * @return int
+ */
+int phylib_state_balls(phylib_state *state) {
+    int balls = 0;
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+        if (state->type[i] == PHYLIB_STILL_BALL || state->type[i] == PHYLIB_ROLLING_BALL) {
+            balls++;
+        }
+    }
+    return balls;
+}
+
+/**
+ * @brief Writes one (number, x, y) triple for every ball of 'first' (in slot order) to positions, with the balls
+ * where they are in 'state' after rolling for 'time' (like Table.roll() in Physics.py). A ball that is no longer
+ * in 'state' has dropped into a hole and gets x and y set to NAN. Returns the position after the last triple.
+ * @param first @param state @param time @param positions
+ * @return double*
+ */
+static double *phylib_write_positions(phylib_state *first, phylib_state *state, double time, double *positions) {
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+        if (first->type[i] != PHYLIB_STILL_BALL && first->type[i] != PHYLIB_ROLLING_BALL) {
+            continue; //Only the balls of 'first' have a place
+        }
+        phylib_coord pos = state->pos[i];
+        if (state->type[i] == PHYLIB_ROLLING_BALL && time > 0) {
+            //Compute where it rolls to, without touching the state
+            phylib_coord vel, acc = state->acc[i];
+            phylib_roll_coords(&pos, &vel, state->pos[i], state->vel[i], &acc, time);
+        } else if (state->type[i] != PHYLIB_STILL_BALL && state->type[i] != PHYLIB_ROLLING_BALL) {
+            pos.x = pos.y = NAN; //Dropped into a hole
+        }
+        *positions++ = first->number[i];
+        *positions++ = pos.x;
+        *positions++ = pos.y;
+    }
+    return positions;
+}
+
+/**
+ * @brief Samples the animation frames of a whole shot held in the arena (see phylib_shoot), every 'interval' seconds.
+ * Segment k contributes (int)((time_k - time_k-1) / interval) frames, each rolled from the table at the start of the
+ * segment exactly like Table.roll() in Physics.py. 
+ * If times and positions are not NULL, the start time of every frame is written to times and, for every frame, one
+ * (number, x, y) triple per ball of the struck table (in slot order) to positions. A ball that has dropped into a hole
+ * has x and y set to NAN. Returns the number of frames.
+ * @param arena @param interval @param times @param positions
+ * @return int
+ */
+int phylib_shot_frames(phylib_arena *arena, double interval, double *times, double *positions) {
+    if (arena == NULL || arena->count == 0 || interval <= 0) {
+        return 0;
+    }
+
+    phylib_state *first = &arena->states[0];
+    int frames = 0;
+
+    for (int k = 1; k < arena->count; k++) {
+        phylib_state *start = &arena->states[k - 1];
+        //Calculate the frames by dividing segments time by the frame rate and rounds to integer
+        int count = (int)((arena->states[k].time - start->time) / interval);
+
+        for (int f = 0; f < count; f++, frames++) {
+            if (times == NULL || positions == NULL) {
+                continue; //Only counting
+            }
+            double frameTime = f * interval;
+            times[frames] = start->time + frameTime;
+
+            positions = phylib_write_positions(first, start, frameTime, positions);
+        }
+    }
+
+    return frames;
+}
+
+// PART 8: Batch shot evaluation
+
+/**
+ * @brief Evaluates many candidate shots from the same table without building any phylib_table's: for every shot s,
+ * the cue ball is struck with velocity (velocities[2s], velocities[2s+1]) and the shot is simulated until every ball
+ * is at rest (see phylib_shoot). The table time at rest goes to times[s], and one (number, x, y) triple per ball of
+ * table (NAN for pocketed balls, see phylib_shot_frames) goes to positions. Returns the number of shots evaluated,
+ * or -1 if there is no cue ball.
+ * @param table @param velocities @param shots @param engine @param times @param positions
+ * @return int
+ */
+int phylib_shoot_batch(phylib_table *table, double *velocities, int shots, phylib_engine engine,
+                       double *times, double *positions) {
+    if (table == NULL) {
+        return -1;
+    }
+
+    phylib_state first, state[2];
+    phylib_pack_table(&first, table);
+
+    for (int s = 0; s < shots; s++) {
+        //Two compact tables take turns being the start and the end of each segment
+        int current = 0;
+        memcpy(&state[current], &first, sizeof(phylib_state));
+        if (!phylib_strike(&state[current], velocities[2 * s], velocities[2 * s + 1])) {
+            return -1;
+        }
+        while (state[current].time - first.time < PHYLIB_MAX_TIME &&
+               phylib_state_segment(&state[1 - current], &state[current], engine)) {
+            current = 1 - current;
+        }
+
+        times[s] = state[current].time;
+        positions = phylib_write_positions(&first, &state[current], 0.0, positions);
+    }
+
+    return shots;
+}
+
+//One thread's share of a parallel batch: a contiguous run of shots and the matching slices of the output buffers
+typedef struct {
+    phylib_table *table;
+    double *velocities;
+    int shots;
+    phylib_engine engine;
+    double *times;
+    double *positions;
+    int result;
+} phylib_batch_job;
+
+/**
+ * @brief Thread entry point for phylib_shoot_batch_parallel(): runs phylib_shoot_batch() on one job.
+ * @param arg
+ * @return void*
+ */
+static void *phylib_batch_worker(void *arg) {
+    phylib_batch_job *job = (phylib_batch_job *)arg;
+    job->result = phylib_shoot_batch(job->table, job->velocities, job->shots, job->engine, job->times, job->positions);
+    return NULL;
+}
+
+/**
+ * @brief phylib_shoot_batch() spread over 'threads' native threads (0 means one per online CPU). The shots are split
+ * into contiguous runs, and each thread writes only its own slice of times and positions, so the results are in input
+ * order and identical to a single-threaded run. table must not change while this runs. Returns the number of shots
+ * evaluated, or -1 if there is no cue ball.
+ * @param table @param velocities @param shots @param engine @param times @param positions @param threads
+ * @return int
+ */
+int phylib_shoot_batch_parallel(phylib_table *table, double *velocities, int shots, phylib_engine engine,
+                                double *times, double *positions, int threads) {
+    if (table == NULL) {
+        return -1;
+    }
+    if (threads <= 0) {
+        long cpus = sysconf(_SC_NPROCESSORS_ONLN);
+        threads = (cpus > 0) ? (int)cpus : 1;
+    }
+    if (threads > shots) {
+        threads = (shots > 0) ? shots : 1;
+    }
+    if (threads == 1) {
+        return phylib_shoot_batch(table, velocities, shots, engine, times, positions);
+    }
+
+    phylib_state state;
+    phylib_pack_table(&state, table);
+    int stride = 3 * phylib_state_balls(&state); //Doubles per shot in positions
+
+    phylib_batch_job *jobs = (phylib_batch_job *)malloc(threads * sizeof(phylib_batch_job));
+    pthread_t *ids = (pthread_t *)malloc(threads * sizeof(pthread_t));
+    if (jobs == NULL || ids == NULL) {
+        free(jobs);
+        free(ids);
+        return phylib_shoot_batch(table, velocities, shots, engine, times, positions);
+    }
+
+    int first = 0;
+    for (int t = 0; t < threads; t++) {
+        //Hand out the remainder one shot at a time to the first threads
+        int count = shots / threads + (t < shots % threads);
+        jobs[t] = (phylib_batch_job){table, velocities + 2 * first, count, engine, times + first, positions + stride * first, 0};
+        //If a thread can't be started, run its share on this thread instead
+        if (pthread_create(&ids[t], NULL, phylib_batch_worker, &jobs[t]) != 0) {
+            phylib_batch_worker(&jobs[t]);
+            ids[t] = pthread_self();
+        }
+        first += count;
+    }
+
+    int result = shots;
+    for (int t = 0; t < threads; t++) {
+        if (!pthread_equal(ids[t], pthread_self())) {
+            pthread_join(ids[t], NULL);
+        }
+        if (jobs[t].result < 0) {
+            result = -1;
+        }
+    }
+
+    free(jobs);
+    free(ids);
+    return result;
 }
 
 //A2: New Function in the A2 Description
@@ -23,7 +23,9 @@
 #define PHYLIB_DRAG             (150.0) //mm/s^2
 #define PHYLIB_MAX_TIME         (600) //s
 
+#ifndef PHYLIB_MAX_OBJECTS //Can be raised at build time (e.g. -DPHYLIB_MAX_OBJECTS=64) for drills with more balls
 #define PHYLIB_MAX_OBJECTS      (26) //15 numbered balls, 1 cue ball, 6 holes, 4 cushions
+#endif
 
 typedef enum {
     PHYLIB_STILL_BALL   =0,
@@ -33,6 +35,12 @@ typedef enum {
     PHYLIB_VCUSHION     =4,
 } phylib_obj;
 
+//Which simulation engine produces the segments of a shot (see phylib_segment and phylib_segment_event)
+typedef enum {
+    PHYLIB_ENGINE_STEP  =0,
+    PHYLIB_ENGINE_EVENT =1,
+} phylib_engine;
+
 // "phylib_coord" is now a data type to represent the coordinates of a ball (x, y)
 typedef struct {
     double x;
@@ -86,6 +94,26 @@ typedef struct {
     phylib_object *object[PHYLIB_MAX_OBJECTS];
 } phylib_table;
 
+#define PHYLIB_NO_OBJECT        (255) //Type of an empty slot in a phylib_state (a NULL pointer in a phylib_table)
+
+//"phylib_state" is a compact table: every object is stored in the same slot of a set of contiguous arrays instead of being 
+//malloc'd separately, so a whole table is copied with a single memcpy. Cushions keep their y (HCUSHION) or x (VCUSHION) in pos
+typedef struct {
+    double time;
+    unsigned char type[PHYLIB_MAX_OBJECTS]; //phylib_obj, or PHYLIB_NO_OBJECT
+    unsigned char number[PHYLIB_MAX_OBJECTS];
+    phylib_coord pos[PHYLIB_MAX_OBJECTS];
+    phylib_coord vel[PHYLIB_MAX_OBJECTS];
+    phylib_coord acc[PHYLIB_MAX_OBJECTS];
+} phylib_state;
+
+//"phylib_arena" holds the phylib_state of every segment of a shot in one block of memory that is reused from shot to shot
+typedef struct {
+    phylib_state *states;
+    int count;
+    int capacity;
+} phylib_arena;
+
 //Function prototypes for constructor methods
 
 phylib_object *phylib_new_still_ball(unsigned char number, phylib_coord *pos);
@@ -131,6 +159,50 @@ unsigned char phylib_rolling(phylib_table *t);
 
 phylib_table *phylib_segment(phylib_table *table);
 
+//PART 4: Event-driven simulation
+
+phylib_table *phylib_segment_event(phylib_table *table);
+
+//PART 5: Compact tables
+
+void phylib_pack_table(phylib_state *state, phylib_table *table);
+
+phylib_table *phylib_unpack_table(phylib_state *state);
+
+unsigned char phylib_state_rolling(phylib_state *state);
+
+unsigned char phylib_state_segment(phylib_state *dest, phylib_state *src, phylib_engine engine);
+
+phylib_arena *phylib_new_arena(void);
+
+phylib_state *phylib_arena_push(phylib_arena *arena);
+
+unsigned char phylib_arena_segment(phylib_arena *arena, phylib_engine engine);
+
+void phylib_arena_reset(phylib_arena *arena);
+
+void phylib_free_arena(phylib_arena *arena);
+
+//PART 6: Whole shots
+
+unsigned char phylib_strike(phylib_state *state, double xvel, double yvel);
+
+int phylib_shoot(phylib_arena *arena, phylib_table *table, double xvel, double yvel, phylib_engine engine);
+
+//PART 7: Frame sampling
+
+int phylib_state_balls(phylib_state *state);
+
+int phylib_shot_frames(phylib_arena *arena, double interval, double *times, double *positions);
+
+//PART 8: Batch shot evaluation
+
+int phylib_shoot_batch(phylib_table *table, double *velocities, int shots, phylib_engine engine,
+                       double *times, double *positions);
+
+int phylib_shoot_batch_parallel(phylib_table *table, double *velocities, int shots, phylib_engine engine,
+                                double *times, double *positions, int threads);
+
 //NEW FUNCTION FOR A2 
 
 char *phylib_object_string( phylib_object *object );
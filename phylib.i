@@ -16,6 +16,9 @@
 
 %include "phylib.h"
 
+/* size in bytes of one compact table, for sizing arenas from Python */
+%constant int PHYLIB_STATE_SIZE = sizeof( phylib_state );
+
 /******************************************************************************/
 /* this creates a phylib_coord class in the phylib python module              */
 /******************************************************************************/
@@ -103,6 +106,45 @@
 }
 
 
+/******************************************************************************/
+/* raise the Python error set by these methods instead of returning None      */
+/******************************************************************************/
+
+%exception phylib_table::shoot {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
+
+%exception phylib_table::evaluate {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
+
+%exception phylib_table::export_balls {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
+
+%exception phylib_table::import_balls {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
+
+%exception phylib_arena::shoot {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
+
+%exception phylib_arena::sample {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
+
+%exception phylib_arena::get_table {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
+
 /******************************************************************************/
 
 %extend phylib_table {
@@ -130,9 +172,256 @@
 
   /****************************************************************************/
 
-  phylib_table *segment()
+  /* engine selects the fixed time step or the event-driven simulation */
+  /* other Python threads keep running while the segment is simulated   */
+  phylib_table *segment( phylib_engine engine = PHYLIB_ENGINE_STEP )
   {
-    return phylib_segment( $self );
+    phylib_table *ptr;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (engine == PHYLIB_ENGINE_EVENT)
+      ptr = phylib_segment_event( $self );
+    else
+      ptr = phylib_segment( $self );
+    Py_END_ALLOW_THREADS
+    return ptr;
+  }
+
+  /****************************************************************************/
+
+  /* runs a whole shot natively and returns only the table at rest */
+  %newobject shoot;
+  phylib_table *shoot( double xvel, double yvel,
+                       phylib_engine engine = PHYLIB_ENGINE_STEP )
+  {
+    phylib_table *ptr;
+    phylib_arena *arena = phylib_new_arena();
+    int segments = -1;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (arena)
+      segments = phylib_shoot( arena, $self, xvel, yvel, engine );
+    Py_END_ALLOW_THREADS
+    if (segments < 0)
+    {
+      phylib_free_arena( arena );
+      PyErr_SetString( PyExc_ValueError, "no cue ball or malloc error" );
+      return NULL;
+    }
+    ptr = phylib_unpack_table( &arena->states[arena->count - 1] );
+    phylib_free_arena( arena );
+    if (!ptr)
+    {
+      PyErr_SetString( PyExc_ValueError, "malloc error" );
+      return NULL;
+    }
+    return ptr;
+  }
+
+  /****************************************************************************/
+
+  /* evaluates one shot per (vx, vy) pair in a buffer of doubles and returns */
+  /* (shots, balls, times, positions), see phylib_shoot_batch_parallel      */
+  PyObject *evaluate( PyObject *velocities,
+                      phylib_engine engine = PHYLIB_ENGINE_EVENT,
+                      int threads = 1 )
+  {
+    Py_buffer view;
+    PyObject *times, *positions;
+    phylib_state state;
+    int shots, balls, result;
+
+    if (PyObject_GetBuffer( velocities, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT ) < 0)
+      return NULL;
+    if (view.itemsize != sizeof( double ) || !view.format || strcmp( view.format, "d" ))
+    {
+      PyBuffer_Release( &view );
+      PyErr_SetString( PyExc_ValueError, "velocities must be a buffer of doubles" );
+      return NULL;
+    }
+    shots = (int)(view.len / (2 * sizeof( double )));
+
+    phylib_pack_table( &state, $self );
+    balls = phylib_state_balls( &state );
+    times = PyByteArray_FromStringAndSize( NULL, shots * sizeof( double ) );
+    positions = PyByteArray_FromStringAndSize( NULL, shots * balls * 3 * sizeof( double ) );
+    if (!times || !positions)
+    {
+      Py_XDECREF( times );
+      Py_XDECREF( positions );
+      PyBuffer_Release( &view );
+      return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    result = phylib_shoot_batch_parallel( $self, (double *)view.buf, shots, engine,
+                                          (double *)PyByteArray_AS_STRING( times ),
+                                          (double *)PyByteArray_AS_STRING( positions ),
+                                          threads );
+    Py_END_ALLOW_THREADS
+    if (result < 0)
+    {
+      Py_DECREF( times );
+      Py_DECREF( positions );
+      PyBuffer_Release( &view );
+      PyErr_SetString( PyExc_ValueError, "no cue ball" );
+      return NULL;
+    }
+    PyBuffer_Release( &view );
+    return Py_BuildValue( "(iiNN)", shots, balls, times, positions );
+  }
+
+  /****************************************************************************/
+
+  /* returns [(type, number, x, y), ...] for every ball, in the order of the */
+  /* objects, without making a Python object for each of them              */
+  PyObject *balls()
+  {
+    PyObject *list = PyList_New( 0 );
+    PyObject *ball;
+
+    if (!list)
+      return NULL;
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++)
+    {
+      phylib_object *object = $self->object[i];
+      if (!object || (object->type != PHYLIB_STILL_BALL && object->type != PHYLIB_ROLLING_BALL))
+        continue;
+      /* still and rolling balls start with the same number and pos */
+      ball = Py_BuildValue( "(iidd)", object->type, object->obj.still_ball.number,
+                            object->obj.still_ball.pos.x, object->obj.still_ball.pos.y );
+      if (!ball || PyList_Append( list, ball ) < 0)
+      {
+        Py_XDECREF( ball );
+        Py_DECREF( list );
+        return NULL;
+      }
+      Py_DECREF( ball );
+    }
+    return list;
+  }
+
+  /****************************************************************************/
+
+  /* returns (balls, data): a bytearray of 8 doubles per ball, in the order */
+  /* of the objects: number, type, x, y, vx, vy, ax, ay                     */
+  PyObject *export_balls()
+  {
+    PyObject *data;
+    double *ball;
+    int balls = 0;
+
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++)
+      if ($self->object[i] && ($self->object[i]->type == PHYLIB_STILL_BALL ||
+                               $self->object[i]->type == PHYLIB_ROLLING_BALL))
+        balls++;
+
+    data = PyByteArray_FromStringAndSize( NULL, balls * 8 * sizeof( double ) );
+    if (!data)
+      return NULL;
+    ball = (double *)PyByteArray_AS_STRING( data );
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++)
+    {
+      phylib_object *object = $self->object[i];
+      if (!object || (object->type != PHYLIB_STILL_BALL && object->type != PHYLIB_ROLLING_BALL))
+        continue;
+      ball[0] = object->obj.still_ball.number;
+      ball[1] = object->type;
+      ball[2] = object->obj.still_ball.pos.x;
+      ball[3] = object->obj.still_ball.pos.y;
+      if (object->type == PHYLIB_ROLLING_BALL)
+      {
+        ball[4] = object->obj.rolling_ball.vel.x;
+        ball[5] = object->obj.rolling_ball.vel.y;
+        ball[6] = object->obj.rolling_ball.acc.x;
+        ball[7] = object->obj.rolling_ball.acc.y;
+      }
+      else
+        ball[4] = ball[5] = ball[6] = ball[7] = 0.0;
+      ball += 8;
+    }
+    return Py_BuildValue( "(iN)", balls, data );
+  }
+
+  /****************************************************************************/
+
+  /* replaces every ball of the table by the balls in a buffer of doubles */
+  /* laid out like export_balls()                                        */
+  void import_balls( PyObject *balls )
+  {
+    Py_buffer view;
+    double *ball;
+    int count, i;
+
+    if (PyObject_GetBuffer( balls, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT ) < 0)
+      return;
+    if (view.itemsize != sizeof( double ) || !view.format || strcmp( view.format, "d" ) ||
+        view.len % (8 * sizeof( double )))
+    {
+      PyBuffer_Release( &view );
+      PyErr_SetString( PyExc_ValueError, "balls must be a buffer of 8 doubles per ball" );
+      return;
+    }
+    count = (int)(view.len / (8 * sizeof( double )));
+
+    for (i = 0; i < PHYLIB_MAX_OBJECTS; i++)
+    {
+      if ($self->object[i] && ($self->object[i]->type == PHYLIB_STILL_BALL ||
+                               $self->object[i]->type == PHYLIB_ROLLING_BALL))
+      {
+        free( $self->object[i] );
+        $self->object[i] = NULL;
+      }
+    }
+
+    ball = (double *)view.buf;
+    for (int k = 0; k < count; k++, ball += 8)
+    {
+      phylib_object *object;
+      phylib_coord pos = { ball[2], ball[3] };
+      phylib_coord vel = { ball[4], ball[5] };
+      phylib_coord acc = { ball[6], ball[7] };
+
+      if ((int)ball[1] == PHYLIB_STILL_BALL)
+        object = phylib_new_still_ball( (unsigned char)ball[0], &pos );
+      else if ((int)ball[1] == PHYLIB_ROLLING_BALL)
+        object = phylib_new_rolling_ball( (unsigned char)ball[0], &pos, &vel, &acc );
+      else
+      {
+        PyErr_SetString( PyExc_ValueError, "bad type" );
+        break;
+      }
+      if (!object)
+      {
+        PyErr_SetString( PyExc_ValueError, "malloc error" );
+        break;
+      }
+
+      for (i = 0; i < PHYLIB_MAX_OBJECTS && $self->object[i]; i++);
+      if (i == PHYLIB_MAX_OBJECTS)
+      {
+        free( object );
+        PyErr_SetString( PyExc_ValueError, "too many balls" );
+        break;
+      }
+      $self->object[i] = object;
+    }
+    PyBuffer_Release( &view );
+  }
+
+  /****************************************************************************/
+
+  /* the ball with this number, or None */
+  phylib_object *get_ball( unsigned char number )
+  {
+    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++)
+    {
+      phylib_object *object = $self->object[i];
+      if (object && (object->type == PHYLIB_STILL_BALL || object->type == PHYLIB_ROLLING_BALL) &&
+          object->obj.still_ball.number == number)
+        return object;
+    }
+    return NULL;
   }
 
   /****************************************************************************/
@@ -160,3 +449,85 @@
     phylib_free_table( $self );
   }
 };
+
+/******************************************************************************/
+/* this creates a phylib_arena class holding every segment of a whole shot    */
+/******************************************************************************/
+
+%extend phylib_arena {
+
+  /* constructor method */
+  phylib_arena()
+  {
+    return phylib_new_arena();
+  }
+
+  /****************************************************************************/
+
+  /* strikes the cue ball of table and simulates the shot until it is at rest */
+  int shoot( phylib_table *table, double xvel, double yvel,
+             phylib_engine engine = PHYLIB_ENGINE_STEP )
+  {
+    int segments;
+
+    Py_BEGIN_ALLOW_THREADS
+    segments = phylib_shoot( $self, table, xvel, yvel, engine );
+    Py_END_ALLOW_THREADS
+    if (segments < 0)
+      PyErr_SetString( PyExc_ValueError, "no cue ball or malloc error" );
+    return segments;
+  }
+
+  /****************************************************************************/
+
+  /* table i of the shot: 0 is the struck table, then one per segment */
+  %newobject get_table;
+  phylib_table *get_table( int i )
+  {
+    phylib_table *ptr;
+
+    if (i < 0 || i >= $self->count)
+    {
+      PyErr_SetString( PyExc_IndexError, "table index out of range" );
+      return NULL;
+    }
+    ptr = phylib_unpack_table( &$self->states[i] );
+    if (!ptr)
+      PyErr_SetString( PyExc_ValueError, "malloc error" );
+    return ptr;
+  }
+
+  /****************************************************************************/
+
+  /* samples every frame of the shot into two packed buffers of doubles:    */
+  /* returns (frames, balls, times, positions), see phylib_shot_frames      */
+  PyObject *sample( double interval )
+  {
+    int frames = phylib_shot_frames( $self, interval, NULL, NULL );
+    int balls = ($self->count > 0) ? phylib_state_balls( &$self->states[0] ) : 0;
+    PyObject *times, *positions;
+
+    times = PyByteArray_FromStringAndSize( NULL, frames * sizeof( double ) );
+    positions = PyByteArray_FromStringAndSize( NULL, frames * balls * 3 * sizeof( double ) );
+    if (!times || !positions)
+    {
+      Py_XDECREF( times );
+      Py_XDECREF( positions );
+      return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    phylib_shot_frames( $self, interval,
+                        (double *)PyByteArray_AS_STRING( times ),
+                        (double *)PyByteArray_AS_STRING( positions ) );
+    Py_END_ALLOW_THREADS
+    return Py_BuildValue( "(iiNN)", frames, balls, times, positions );
+  }
+
+  /****************************************************************************/
+
+  /* free the arena and its states */
+  ~phylib_arena()
+  {
+    phylib_free_arena( $self );
+  }
+};
@@ -1,11 +1,19 @@
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import parse_qs, urlparse, urlencode
 import random
 import math
 import json
+import queue
+import gzip
+import zlib
+import hashlib
+import html
+import threading
+import time
+from collections import OrderedDict
 from Physics import Table, Coordinate, StillBall, RollingBall
-from Physics import TABLE_WIDTH, BALL_DIAMETER, TABLE_LENGTH, DRAG, VEL_EPSILON
-from Physics import Game, Database
+from Physics import TABLE_WIDTH, BALL_DIAMETER, TABLE_LENGTH, DRAG, VEL_EPSILON, STILL_BALL
+from Physics import Game, Database, ShotCache, WriteBehind, SimulationPool, FramePages, FrameEncoder, FRAME_INTERVAL, ENGINE_EVENT, STORAGE_PACKED, ballFills
 
 def createDatabase():
     db = Database()
@@ -14,211 +22,789 @@ def createDatabase():
 def nudge():
     return random.uniform( -1.5, 1.5 )
 
-def createFullRackTable():
+# The rack every game starts at. Without nudged, every ball is exactly where its nudges are centred on
+def createFullRackTable(nudged=True):
     table = Table()  # Create and set up your initial table
+    # The balls are collected as (number, type, x, y, vx, vy, ax, ay) rows and added in one call
+    balls = []
     # Position the cue ball
-    pos = Coordinate(TABLE_WIDTH / 2.0 + random.uniform(-3.0, 3.0), TABLE_LENGTH - TABLE_WIDTH / 2.0)
-    cue_ball = StillBall(0, pos)
-    table += cue_ball
+    balls.append((0, STILL_BALL, TABLE_WIDTH / 2.0 + (random.uniform(-3.0, 3.0) if nudged else 0.0), TABLE_LENGTH - TABLE_WIDTH / 2.0, 0.0, 0.0, 0.0, 0.0))
 
     # Define the starting position for the rack
     starting_x = TABLE_WIDTH / 2.0
     starting_y = TABLE_WIDTH / 2.0
     ball_offset = BALL_DIAMETER + 4.0  # Slight offset between the balls
 
+    # Each ball is nudged off its spot, unless nudged is False
+    offset = nudge if nudged else lambda: 0.0
+
     # Triangular rack: 1 + 2 + 3 + 4 + 5 balls
     ball_number = 1  # Start with ball 1 (after the cue ball)
     for row in range(1, 6):  # 5 rows in a standard rack
         for ball_in_row in range(row):
-            x_pos = starting_x - (ball_offset / 2.0) * (row - 1) + ball_in_row * ball_offset + nudge()
-            y_pos = starting_y - math.sqrt(3.0) / 2.0 * ball_offset * (row - 1) + nudge()
+            x_pos = starting_x - (ball_offset / 2.0) * (row - 1) + ball_in_row * ball_offset + offset()
+            y_pos = starting_y - math.sqrt(3.0) / 2.0 * ball_offset * (row - 1) + offset()
 
-            ball = StillBall(ball_number, Coordinate(x_pos, y_pos))
-            table += ball
+            balls.append((ball_number, STILL_BALL, x_pos, y_pos, 0.0, 0.0, 0.0, 0.0))
             ball_number += 1
 
-    return table
+    return table.importBalls(balls)
 
-class RequestHandler(BaseHTTPRequestHandler):
+# ShotCache of the opening break, set by setUp(). Its cells are centred on the rack and are wide enough for every
+# nudge of createFullRackTable(), so every break with the same cue velocity is simulated once. Only the first shot
+# of a game uses it: a cached break was simulated from a rack a few mm off, which is close enough there but not for
+# any later shot, those only hit Game.cache for the very same table
+BREAK_CACHE = None
+
+# Pages of frames served by /frames, rendered from the saved segments of each shot when first asked for (set by setUp())
+FRAME_PAGES = None
+# Most frames /frames sends at once
+MAX_PAGE = 100
+
+# Creates the database and sets up how shots are simulated, saved and served. Only called by run(), never when the
+# module is imported: every SimulationPool worker process imports this module again and needs none of this
+def setUp(workers=2, queueSize=8, deadline=10.0):
+    global FRAME_PAGES, BREAK_CACHE
     createDatabase()
-    current_table = createFullRackTable()
+    # Repeated and replayed shots are only simulated once
+    Game.cache = ShotCache()
+    BREAK_CACHE = ShotCache(tolerance=6.0, velocityTolerance=1.0, origin=createFullRackTable(nudged=False))
+    # Each shot is saved as one packed ShotData row instead of a row per frame and ball
+    Game.storage = STORAGE_PACKED
+    # Shots are saved after the response has been sent, so /shoot only waits for the simulation
+    Game.writer = WriteBehind()
+    # Shots are simulated in worker processes, each within deadline seconds (see SimulationPool)
+    Game.pool = SimulationPool(workers, queueSize, deadline)
+    FRAME_PAGES = FramePages(Game.db)
 
-    def do_GET(self):
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
+# A game being played: its Game and the table it is at. lock is held while a shot is played on the table
+class GameSession:
+    def __init__(self, game, table):
+        self.game = game
+        self.table = table
+        self.lock = threading.Lock()
+        self.lastUsed = time.monotonic()
+        # Set once the session has been put away, a new one must be looked up
+        self.evicted = False
 
-            html_content = """
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>8-Ball Pool Game</title>
-                <style>
-                    body {
-                        font-family: 'Calibri', sans-serif;
-                        background-color: #f4f4f4;
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        height: 100vh;
-                        margin: 0;
-                        position: relative;
-                    }
+# Keeps the table of every game being played in memory, each game behind its own lock so shots of different
+# games are played at the same time. At most maxGames games are kept, and none idle for more than maxIdle
+# seconds: the least recently used idle games are put away in the database (see Database.saveGameTable())
+# and picked up again on their next request
+class SessionManager:
+    def __init__(self, maxGames=500, maxIdle=15*60):
+        self.maxGames = maxGames
+        self.maxIdle = maxIdle
+        self.sessions = OrderedDict()  # game ID -> GameSession, least recently used first
+        self.evicting = {}  # game ID -> GameSession being put away
+        self.lock = threading.Lock()
 
-                    h1 {
-                        text-align: center;
-                        color: #333;
-                    }
+    # Starts a new game on a full rack and returns its session
+    def create(self, gameName, player1Name, player2Name):
+        game = Game(gameName=gameName, player1Name=player1Name, player2Name=player2Name)
+        game.engine = ENGINE_EVENT
+        # Until the break has been played (see BREAK_CACHE)
+        if BREAK_CACHE is not None:
+            game.cache = BREAK_CACHE
+        session = GameSession(game, createFullRackTable())
+        with self.lock:
+            self.sessions[game.gameID] = session
+        self.evict(keep=game.gameID)
+        return session
 
-                    form {
-                        background: white;
-                        padding: 20px;
-                        border-radius: 10px;
-                        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-                    }
+    # Returns the session of a game, picking it up from the database if it was put away, or None for an unknown game
+    def get(self, gameID):
+        with self.lock:
+            session = self.sessions.get(gameID)
+            if session is not None:
+                self.sessions.move_to_end(gameID)
+                session.lastUsed = time.monotonic()
+                return session
+            evicting = self.evicting.get(gameID)
+
+        # Wait until a game being put away is saved, or we would pick up the table it was at before
+        if evicting is not None:
+            with evicting.lock:
+                pass
+
+        table = Game.db.loadGameTable(gameID)
+        if table is None:
+            return None
+        # Game(gameID) loads the game but keeps its ID one past the one it was created with
+        game = Game(gameID=gameID)
+        game.gameID = gameID
+        game.engine = ENGINE_EVENT
+        session = GameSession(game, table)
+        with self.lock:
+            # Another request may have picked it up first
+            session = self.sessions.setdefault(gameID, session)
+        # Not this one though: play() would find it put away before it could lock it, and pick it up again forever
+        self.evict(keep=gameID)
+        return session
+
+    # Runs play(session) with the game's session locked. Returns play()'s result, or None for an unknown game
+    def play(self, gameID, play):
+        while True:
+            session = self.get(gameID)
+            if session is None:
+                return None
+            with session.lock:
+                # Put away while we waited for the lock: look it up again
+                if session.evicted:
+                    continue
+                result = play(session)
+                session.lastUsed = time.monotonic()
+            # Any game idle for too long is put away on the next request
+            self.evict()
+            return result
+
+    # Puts away the least recently used games beyond maxGames, and every game idle for more than maxIdle seconds.
+    # Games in the middle of a shot, and the game keep, are left alone
+    def evict(self, everything=False, keep=None):
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            for gameID, session in list(self.sessions.items()):
+                if not everything and len(self.sessions) <= self.maxGames and now - session.lastUsed <= self.maxIdle:
+                    break
+                if gameID != keep and session.lock.acquire(blocking=False):
+                    session.evicted = True
+                    del self.sessions[gameID]
+                    self.evicting[gameID] = session
+                    evicted.append((gameID, session))
+        for gameID, session in evicted:
+            try:
+                Game.db.saveGameTable(gameID, session.table)
+            finally:
+                with self.lock:
+                    del self.evicting[gameID]
+                session.lock.release()
+
+    # Puts every game away, before the server exits
+    def close(self):
+        self.evict(everything=True)
+
+# Every game being played
+SESSIONS = SessionManager()
+
+# Responses smaller than this are sent as they are, compressing them would save next to nothing
+MIN_COMPRESS = 1024
+
+# A response that never changes, built (and compressed) once at startup. Its ETag lets the browser ask whether its
+# copy is still good (If-None-Match) and get a 304 without the body
+class StaticResponse:
+    def __init__(self, body, contentType):
+        self.body = body.encode('utf-8')
+        self.contentType = contentType
+        self.etag = '"%s"' % hashlib.sha1(self.body).hexdigest()
+        self.encoded = {"gzip": gzip.compress(self.body, 9), "deflate": zlib.compress(self.body, 9)}
+
+# The landing page with the form that starts a game
+LANDING_PAGE = StaticResponse("""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>8-Ball Pool Game</title>
+        <style>
+            body {
+                font-family: 'Calibri', sans-serif;
+                background-color: #f4f4f4;
+                display: flex;
+                justify-content: center;
+                align-items: center;
+                height: 100vh;
+                margin: 0;
+                position: relative;
+            }
+
+            h1 {
+                text-align: center;
+                color: #333;
+            }
+
+            form {
+                background: white;
+                padding: 20px;
+                border-radius: 10px;
+                box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
+            }
+
+            label {
+                display: block;
+                margin-bottom: 5px;
+                color: #333;
+            }
 
-                    label {
-                        display: block;
-                        margin-bottom: 5px;
-                        color: #333;
+            input[type="text"] {
+                width: 100%;
+                padding: 10px;
+                margin-bottom: 20px;
+                border-radius: 5px;
+                border: 1px solid #ddd;
+                box-sizing: border-box; /* Added for consistent sizing */
+            }
+
+            input[type="submit"] {
+                width: 100%;
+                background-color: #4CAF50;
+                color: white;
+                padding: 15px 20px;
+                margin: 10px 0;
+                border: none;
+                border-radius: 5px;
+                cursor: pointer;
+            }
+
+            input[type="submit"]:hover {
+                background-color: #45a049;
+            }
+            footer {
+                position: absolute;
+                bottom: 10px;
+                left: 10px;
+                color: #333;
+                font-size: 14px;
+            }
+        </style>
+    </head>
+    <body>
+        <form id="start-form" action="start" method="post">
+            <h1>Welcome to the 8-Ball Pool Game</h1>
+            <label for="game-name">Game Name:</label>
+            <input type="text" id="game-name" name="gameName" required>
+            <label for="player1-name">Player 1:</label>
+            <input type="text" id="player1-name" name="player1" required>
+            <label for="player2-name">Player 2:</label>
+            <input type="text" id="player2-name" name="player2" required>
+            <input type="submit" value="Start Game">
+        </form>
+        <footer>
+            Written and Developed by Hisham Issa (hissa01@uoguelph.ca). March 2024.
+        </footer>
+    </body>
+    </html>
+""", 'text/html')
+
+# The style of the game page
+GAME_STYLE = StaticResponse("""
+    body {
+        font-family: 'Calibri', sans-serif;
+        background-color: #f4f4f4;
+        text-align: center;
+        margin: 0;
+        position: relative;
+    }
+    h1 {
+        color: #333;
+        margin: 20px 0;
+    }
+    .player-name {
+        position: absolute;
+        top: 50%;
+        transform: translateY(-50%);
+        font-size: 24px;
+        color: #333;
+    }
+    .player1-desc, .player2-desc {
+        position: absolute;
+        top: 60%; /* Slightly below the player name */
+        font-size: 16px; /* Smaller font size for the description */
+        color: #555;
+    }
+     .player1-desc {
+        left: 10px;
+    }
+    .player2-desc {
+        right: 10px;
+    }
+    .player1 {
+        left: 10px;
+    }
+    .player2 {
+        right: 10px;
+    }
+    .svg-container {
+        width: 33%;
+        height: auto;
+        margin: 0 auto; 
+        margin-left: 560px;
+    }
+    .svg-container svg {
+        width: 66%;
+        height: auto;
+        display: block;
+    }
+    #cue-ball {
+        stroke: white;
+        stroke-width: 1;
+    }
+    footer {
+        position: absolute;
+        bottom: 0px;
+        left: 10px;
+        color: #333;
+        font-size: 8px;
+    }
+    .turn-indicator {
+        font-size: 18px;
+        color: #333;
+        margin: 20px 0;
+    }
+""", 'text/css')
+
+# The script of the game page: aiming the cue ball, sending the shot to /shoot and playing it back
+GAME_SCRIPT = StaticResponse(r"""
+    let isDragging = false;
+    let line = null; 
+
+    let startX, startY;
+    const VEL_EPSILON = 0.01;
+    const DRAG = 150.0;
+    // how /shoot sends the shot: 'keyframes' (interpolated here), 'delta' (every frame),
+    // 'pages' (fetched from /frames a page at a time) or 'stream' (every frame as it is rendered)
+    const SHOT_FORMAT = 'keyframes';
+    // frames asked for per /frames request
+    const PAGE_SIZE = 100;
+    // simulated seconds shown per second, about the speed of the 2 ms per 10 ms frames
+    const PLAYBACK_RATE = 5.0;
+
+    const svgContainer = document.getElementById('svg-container');
+    const cueBall = document.getElementById('cue-ball');
+
+    document.addEventListener('DOMContentLoaded', initializeCueBallInteraction);
+
+    function initializeCueBallInteraction() {
+        const svg = document.querySelector('svg');
+        let isDragging = false;
+        let line = null;
+        let animationComplete = true;
+
+        const cueBall = document.getElementById('cue-ball');
+        const svgContainer = document.getElementById('svg-container');
+
+        let gameID = document.getElementById('game-id').value;
+        let gameName = document.getElementById('game-name').value;
+        let player1Name = document.getElementById('player1-name').value;
+        let player2Name = document.getElementById('player2-name').value;
+        let currentTurn = document.getElementById("turn-indicator").textContent.split(": ")[1].trim();
+
+        if (!cueBall) {
+            console.error("No Cue Ball")
+            return;
+        }
+
+        function getMousePosition(evt) {
+            let CTM = svg.getScreenCTM();
+            return {
+                x: (evt.clientX - CTM.e) / CTM.a,
+                y: (evt.clientY - CTM.f) / CTM.d
+                };
+            }
+
+        function createLine(x1, y1, x2, y2) {
+            let line = document.createElementNS('http://www.w3.org/2000/svg', 'line');
+            line.setAttribute('x1', x1);
+            line.setAttribute('y1', y1);
+            line.setAttribute('x2', x2);
+            line.setAttribute('y2', y2);
+            line.style.stroke = 'black';
+            line.style.strokeWidth = '12';
+            svg.appendChild(line);
+            return line;
+        }
+
+        function finishShot() {
+            animationComplete = true;
+            currentTurn = (currentTurn === player1Name) ? player2Name : player1Name;
+            document.getElementById("turn-indicator").textContent = "Turn: " + currentTurn;
+            // Reinitialize the cue ball interaction after the shot animation is complete
+            initializeCueBallInteraction();
+        }
+
+        // Plays a shot sent as a delta frame stream (see FrameEncoder in Physics.py): the first
+        // frame is drawn once and every later frame only moves the balls that changed, in place
+        function playDeltaFrames(buffer) {
+            const view = new DataView(buffer);
+            const decoder = new TextDecoder();
+            if (decoder.decode(new Uint8Array(buffer, 0, 4)) !== 'PHYF') {
+                console.error("Bad frame stream");
+                finishShot();
+                return;
+            }
+            let offset = 8; // skip the frame interval, frames are shown as fast as before
+            const ballCount = view.getUint16(offset, true);
+            const frameCount = view.getUint32(offset + 2, true);
+            offset += 6;
+            const numbers = Array.from(new Uint8Array(buffer, offset, ballCount));
+            offset += ballCount;
+            let length = view.getUint32(offset, true);
+            const firstFrame = decoder.decode(new Uint8Array(buffer, offset + 4, length));
+            offset += 4 + length;
+            length = view.getUint32(offset, true);
+            const fills = decoder.decode(new Uint8Array(buffer, offset + 4, length)).split(';').map(pair => pair.split(','));
+            offset += 4 + length;
+
+            if (frameCount === 0) {
+                finishShot();
+                return;
+            }
+            svgContainer.innerHTML = firstFrame;
+            // the balls are the last circles of the frame, after the holes
+            const circles = Array.from(svgContainer.querySelectorAll('circle'));
+            const balls = circles.slice(circles.length - ballCount);
+
+            let currentFrame = 1;
+            function displayNextFrame() {
+                if (currentFrame < frameCount) {
+                    const changes = view.getUint8(offset);
+                    offset += 1;
+                    for (let k = 0; k < changes; k++) {
+                        const index = view.getUint8(offset);
+                        const type = view.getUint8(offset + 1);
+                        const ball = balls[index];
+                        if (type === 255) { // pocketed
+                            ball.setAttribute('visibility', 'hidden');
+                        } else {
+                            ball.setAttribute('cx', view.getFloat32(offset + 2, true));
+                            ball.setAttribute('cy', view.getFloat32(offset + 6, true));
+                            ball.setAttribute('fill', fills[index][type]);
+                        }
+                        offset += 10;
+                    }
+                    currentFrame++;
+                    setTimeout(displayNextFrame, 2);
+                } else {
+                    // rolling balls are drawn without an id, so tag the cue ball again
+                    const cue = numbers.indexOf(0);
+                    if (cue >= 0 && balls[cue].getAttribute('visibility') !== 'hidden') {
+                        balls[cue].setAttribute('id', 'cue-ball');
                     }
+                    finishShot();
+                }
+            }
+            animationComplete = false;
+            displayNextFrame();
+        }
 
-                    input[type="text"] {
-                        width: 100%;
-                        padding: 10px;
-                        margin-bottom: 20px;
-                        border-radius: 5px;
-                        border: 1px solid #ddd;
-                        box-sizing: border-box; /* Added for consistent sizing */
+        // Position of a keyframe ball [number, type, x, y, vx, vy, ax, ay] after rolling for t
+        // seconds, exactly as phylib_roll computes the frames the server renders: once an axis'
+        // velocity reaches 0 within t, its acceleration is dropped for the whole of t
+        function rollBall(ball, t) {
+            const pos = [ball[2], ball[3]];
+            for (let axis = 0; axis < 2; axis++) {
+                const v = ball[4 + axis];
+                let a = ball[6 + axis];
+                if (a !== 0 && v / -a >= 0 && v / -a <= t) {
+                    a = 0;
+                }
+                pos[axis] += v * t + 0.5 * a * t * t;
+            }
+            return pos;
+        }
+
+        // Plays a shot sent as keyframes (see Shot.keyframes() in Physics.py), computing every
+        // frame at the display's refresh rate from the keyframe it falls in
+        function playKeyframes(shot) {
+            svgContainer.innerHTML = shot.svg;
+            // the balls are the last circles of the table, in the order of shot.balls
+            const circles = Array.from(svgContainer.querySelectorAll('circle'));
+            const balls = {};
+            shot.balls.forEach((number, index) => {
+                balls[number] = { circle: circles[circles.length - shot.balls.length + index], fills: shot.fills[index] };
+            });
+            const keyframes = shot.keyframes;
+            const startTime = keyframes[0].time;
+            const endTime = keyframes[keyframes.length - 1].time;
+            let current = 0;
+            let started = null;
+
+            function draw(keyframe, t) {
+                const seen = {};
+                for (const ball of keyframe.balls) {
+                    const pos = rollBall(ball, t - keyframe.time);
+                    const target = balls[ball[0]];
+                    if (!target) continue;
+                    target.circle.setAttribute('cx', pos[0]);
+                    target.circle.setAttribute('cy', pos[1]);
+                    target.circle.setAttribute('fill', target.fills[ball[1]]);
+                    seen[ball[0]] = true;
+                }
+                // balls missing from the keyframe have been pocketed
+                for (const number in balls) {
+                    if (!seen[number]) balls[number].circle.setAttribute('visibility', 'hidden');
+                }
+            }
+
+            function displayNextFrame(now) {
+                if (started === null) started = now;
+                const t = startTime + (now - started) / 1000.0 * PLAYBACK_RATE;
+                if (t >= endTime) {
+                    draw(keyframes[keyframes.length - 1], endTime);
+                    const cue = balls[0];
+                    if (cue && cue.circle.getAttribute('visibility') !== 'hidden') {
+                        cue.circle.setAttribute('id', 'cue-ball');
                     }
+                    finishShot();
+                    return;
+                }
+                while (current + 1 < keyframes.length && keyframes[current + 1].time <= t) {
+                    current++;
+                }
+                draw(keyframes[current], t);
+                requestAnimationFrame(displayNextFrame);
+            }
+            animationComplete = false;
+            requestAnimationFrame(displayNextFrame);
+        }
 
-                    input[type="submit"] {
-                        width: 100%;
-                        background-color: #4CAF50;
-                        color: white;
-                        padding: 15px 20px;
-                        margin: 10px 0;
-                        border: none;
-                        border-radius: 5px;
-                        cursor: pointer;
+        // Plays a shot sent as pages: shows each page as soon as it arrives, asking /frames for
+        // the next page while the current one is being shown
+        function playPages(shot) {
+            function fetchPage(start) {
+                return fetch(`/frames?shot=${shot.shot}&from=${start}&to=${start + PAGE_SIZE}`)
+                    .then(response => response.json());
+            }
+
+            function playPage(pagePromise, start) {
+                pagePromise.then(page => {
+                    const next = start + page.svgs.length;
+                    const nextPage = next < shot.frames ? fetchPage(next) : null;
+                    let index = 0;
+                    function displayNextFrame() {
+                        if (index < page.svgs.length) {
+                            svgContainer.innerHTML = page.svgs[index++];
+                            setTimeout(displayNextFrame, 2);
+                        } else if (nextPage && page.svgs.length) {
+                            playPage(nextPage, next);
+                        } else {
+                            finishShot();
+                        }
                     }
+                    displayNextFrame();
+                });
+            }
+
+            animationComplete = false;
+            if (shot.frames === 0) {
+                finishShot();
+                return;
+            }
+            playPage(fetchPage(0), 0);
+        }
 
-                    input[type="submit"]:hover {
-                        background-color: #45a049;
+        // Plays a shot streamed by /shoot as Server-Sent Events: a "frame" event per frame, shown
+        // as soon as it arrives, then an "end" event once the shot is over
+        function playStream(response) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            const frames = [];
+            let buffer = '';
+            let ended = false;
+            let waiting = false; // displayNextFrame ran out of frames and waits for more
+            let index = 0;
+
+            function read() {
+                reader.read().then(({ done, value }) => {
+                    if (value) buffer += decoder.decode(value, { stream: true });
+                    let end;
+                    while ((end = buffer.indexOf('\n\n')) >= 0) {
+                        const event = buffer.slice(0, end);
+                        buffer = buffer.slice(end + 2);
+                        const type = (event.match(/^event: (.*)$/m) || [])[1];
+                        const data = (event.match(/^data: (.*)$/m) || [])[1];
+                        if (type === 'frame') frames.push(JSON.parse(data));
+                        else if (type === 'end') ended = true;
                     }
-                    footer {
-                        position: absolute;
-                        bottom: 10px;
-                        left: 10px;
-                        color: #333;
-                        font-size: 14px;
+                    if (done) ended = true;
+                    if (waiting) {
+                        waiting = false;
+                        displayNextFrame();
                     }
-                </style>
-            </head>
-            <body>
-                <form id="start-form" action="start" method="post">
-                    <h1>Welcome to the 8-Ball Pool Game</h1>
-                    <label for="game-name">Game Name:</label>
-                    <input type="text" id="game-name" name="gameName" required>
-                    <label for="player1-name">Player 1:</label>
-                    <input type="text" id="player1-name" name="player1" required>
-                    <label for="player2-name">Player 2:</label>
-                    <input type="text" id="player2-name" name="player2" required>
-                    <input type="submit" value="Start Game">
-                </form>
-                <footer>
-                    Written and Developed by Hisham Issa (hissa01@uoguelph.ca). March 2024.
-                </footer>
-            </body>
-            </html>
-            """
-            self.wfile.write(html_content.encode())
-        elif self.path.startswith('/game'):
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
+                    if (!done) read();
+                });
+            }
+
+            function displayNextFrame() {
+                if (index < frames.length) {
+                    svgContainer.innerHTML = frames[index];
+                    frames[index++] = null; // shown, no need to keep it
+                    setTimeout(displayNextFrame, 2);
+                } else if (ended) {
+                    finishShot();
+                } else {
+                    waiting = true;
+                }
+            }
+
+            animationComplete = false;
+            read();
+            displayNextFrame();
+        }
+
+        function finalizeShot(vx, vy) {
+            fetch('/shoot', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ 
+                    gameID: gameID,
+                    gameName: gameName, 
+                    player1Name: player1Name,
+                    player2Name: player2Name,
+                    vx: vx, 
+                    vy: vy,
+                    format: SHOT_FORMAT
+                })
+            })
+            .then(response => SHOT_FORMAT === 'delta' ? response.arrayBuffer().then(playDeltaFrames)
+                            : SHOT_FORMAT === 'pages' ? response.json().then(playPages)
+                           : SHOT_FORMAT === 'stream' ? playStream(response)
+                                                      : response.json().then(playKeyframes));
+        }
+
+        cueBall.addEventListener('mousedown', function(evt) {
+            isDragging = true;
+            const pos = getMousePosition(evt);
+            startX = pos.x
+            startY = pos.y
+            line = createLine(startX, startY, startX, startY);
+        });
+
+        svgContainer.addEventListener('mousemove', function(evt) {
+            if (isDragging && line) {
+                const pos = getMousePosition(evt);
+                line.setAttribute('x2', pos.x);
+                line.setAttribute('y2', pos.y);
+            }
+        });
+
+        window.addEventListener('mouseup', function(evt) {
+            if (isDragging) {
+                isDragging = false;
+                let pt = svg.createSVGPoint();
+                pt.x = evt.clientX;
+                pt.y = evt.clientY;
+                let cursorPoint = pt.matrixTransform(svg.getScreenCTM().inverse());
+
+                let vx = -(cursorPoint.x - startX) * 3;
+                let vy = -(cursorPoint.y - startY) * 3;
+                if (line) svg.removeChild(line);
+                finalizeShot(vx, vy);
+            }
+        });
+    };
+""", 'application/javascript')
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    # The content coding to send a response in: "gzip" or "deflate" if the browser accepts one (Accept-Encoding),
+    # else None
+    def acceptedEncoding(self):
+        accepted = {}
+        for part in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = part.partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        for encoding in ("gzip", "deflate"):
+            if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+                return encoding
+        return None
+
+    # Sends body with a 200, compressed when it is large enough and the browser accepts it. encoded holds the
+    # body already compressed in each coding, and etag the ETag of the body (see StaticResponse)
+    def sendBody(self, body, contentType, encoded=None, etag=None):
+        encoding = self.acceptedEncoding() if len(body) >= MIN_COMPRESS else None
+        if encoding and encoded:
+            body = encoded[encoding]
+        elif encoding:
+            body = gzip.compress(body, 6) if encoding == 'gzip' else zlib.compress(body, 6)
+
+        self.send_response(200)
+        self.send_header('Content-type', contentType)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        if etag:
+            # Each coding of the body is a different representation, with its own ETag
+            self.send_header('ETag', etag[:-1] + '-' + encoding + '"' if encoding else etag)
+            # The browser may keep it, but must check with us (and get a 304) before using it
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Sends a StaticResponse, or a 304 without it if the browser's copy is still good
+    def sendStatic(self, response):
+        tags = [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]
+        # Any coding of the same body will do
+        if '*' in tags or any(tag.split('-')[0].rstrip('"') == response.etag.rstrip('"') for tag in tags):
+            self.send_response(304)
+            self.send_header('ETag', response.etag)
+            self.send_header('Vary', 'Accept-Encoding')
             self.end_headers()
+            return
+        self.sendBody(response.body, response.contentType, response.encoded, response.etag)
 
+    def do_GET(self):
+        if self.path == '/':
+            self.sendStatic(LANDING_PAGE)
+        elif self.path == '/game.css':
+            self.sendStatic(GAME_STYLE)
+        elif self.path == '/game.js':
+            self.sendStatic(GAME_SCRIPT)
+        elif self.path.startswith('/frames'):
+            # Frames from (included) to (excluded) of a shot played with format "pages"
+            query = parse_qs(urlparse(self.path).query)
+            try:
+                shotID = int(query["shot"][0])
+                start = int(query.get("from", ["0"])[0])
+                stop = min(int(query.get("to", [str(start + MAX_PAGE)])[0]), start + MAX_PAGE)
+            except (KeyError, ValueError):
+                self.send_error(400, "shot, from and to must be integers")
+                return
+
+            page = FRAME_PAGES.page(shotID, start, stop)
+            if page is None:
+                self.send_error(404, "No such shot")
+                return
+            frames, svgs = page
+            response = json.dumps({"shot": shotID, "from": max(start, 0), "frames": frames, "svgs": svgs}).encode('utf-8')
+            self.sendBody(response, 'application/json')
+        elif self.path.startswith('/game'):
             query = parse_qs(urlparse(self.path).query)
             gameName = query.get("gameName", [""])[0]
             player1 = query.get("player1", [""])[0]
             player2 = query.get("player2", [""])[0]
             initial_turn = random.choice([player1, player2])
 
-            svgTable = RequestHandler.current_table.svg()
+            # The table the game is at, or a new game if the page wasn't opened through /start
+            try:
+                gameID = int(query.get("gameID", [""])[0])
+                session = SESSIONS.get(gameID)
+            except ValueError:
+                session = None
+            if session is None:
+                session = SESSIONS.create(gameName, player1, player2)
+            gameID = session.game.gameID
+            svgTable = SESSIONS.play(gameID, lambda session: session.table.svg())
+
+            # The names come from the query string: escaped, they can't add markup or scripts of their own to the page
+            gameName, player1, player2, initial_turn = (html.escape(name, quote=True)
+                                                        for name in (gameName, player1, player2, initial_turn))
 
             game_content = f"""
             <html>
             <head>
                 <title>Pool Table</title>
-                <style>
-                    body {{
-                        font-family: 'Calibri', sans-serif;
-                        background-color: #f4f4f4;
-                        text-align: center;
-                        margin: 0;
-                        position: relative;
-                    }}
-                    h1 {{
-                        color: #333;
-                        margin: 20px 0;
-                    }}
-                    .player-name {{
-                        position: absolute;
-                        top: 50%;
-                        transform: translateY(-50%);
-                        font-size: 24px;
-                        color: #333;
-                    }}
-                    .player1-desc, .player2-desc {{
-                        position: absolute;
-                        top: 60%; /* Slightly below the player name */
-                        font-size: 16px; /* Smaller font size for the description */
-                        color: #555;
-                    }}
-                     .player1-desc {{
-                        left: 10px;
-                    }}
-                    .player2-desc {{
-                        right: 10px;
-                    }}
-                    .player1 {{
-                        left: 10px;
-                    }}
-                    .player2 {{
-                        right: 10px;
-                    }}
-                    .svg-container {{
-                        width: 33%;
-                        height: auto;
-                        margin: 0 auto; 
-                        margin-left: 560px;
-                    }}
-                    .svg-container svg {{
-                        width: 66%;
-                        height: auto;
-                        display: block;
-                    }}
-                    #cue-ball {{
-                        stroke: white;
-                        stroke-width: 1;
-                    }}
-                    footer {{
-                        position: absolute;
-                        bottom: 0px;
-                        left: 10px;
-                        color: #333;
-                        font-size: 8px;
-                    }}
-                    .turn-indicator {{
-                        font-size: 18px;
-                        color: #333;
-                        margin: 20px 0;
-                    }}
-                </style>
+                <link rel="stylesheet" href="/game.css">
             </head>
             <body>
                 <h1>Pool Table</h1>
+                <input type="hidden" id="game-id" value="{gameID}">
                 <input type="hidden" id="game-name" value="{gameName}">
                 <input type="hidden" id="player1-name" value="{player1}">
                 <div class="player-name player1">Player 1: {player1}</div>
@@ -233,129 +819,11 @@ class RequestHandler(BaseHTTPRequestHandler):
                 <footer>
                     Written and Developed by Hisham Issa (hissa01@uoguelph.ca). March 2024.
                 </footer>
-                <script>
-                    let isDragging = false;
-                    let line = null; 
-                    
-                    let startX, startY;
-                    const VEL_EPSILON = 0.01;
-                    const DRAG = 150.0;
-
-                    const svgContainer = document.getElementById('svg-container');
-                    const cueBall = document.getElementById('cue-ball');
-
-                    document.addEventListener('DOMContentLoaded', initializeCueBallInteraction);
-
-                    function initializeCueBallInteraction() {{
-                        const svg = document.querySelector('svg');
-                        let isDragging = false;
-                        let line = null;
-                        let animationComplete = true;
-
-                        const cueBall = document.getElementById('cue-ball');
-                        const svgContainer = document.getElementById('svg-container');
-
-                        let gameName = document.getElementById('game-name').value;
-                        let player1Name = document.getElementById('player1-name').value;
-                        let player2Name = document.getElementById('player2-name').value;
-                        let currentTurn = document.getElementById("turn-indicator").textContent.split(": ")[1].trim();
-
-                        if (!cueBall) {{
-                            console.error("No Cue Ball")
-                            return;
-                        }}
-
-                        function getMousePosition(evt) {{
-                            let CTM = svg.getScreenCTM();
-                            return {{
-                                x: (evt.clientX - CTM.e) / CTM.a,
-                                y: (evt.clientY - CTM.f) / CTM.d
-                                }};
-                            }}
-
-                        function createLine(x1, y1, x2, y2) {{
-                            let line = document.createElementNS('http://www.w3.org/2000/svg', 'line');
-                            line.setAttribute('x1', x1);
-                            line.setAttribute('y1', y1);
-                            line.setAttribute('x2', x2);
-                            line.setAttribute('y2', y2);
-                            line.style.stroke = 'black';
-                            line.style.strokeWidth = '12';
-                            svg.appendChild(line);
-                            return line;
-                        }}
-
-                        function finalizeShot(vx, vy) {{
-                            fetch('/shoot', {{
-                                method: 'POST',
-                                headers: {{ 'Content-Type': 'application/json' }},
-                                body: JSON.stringify({{ 
-                                    gameName: gameName, 
-                                    player1Name: player1Name,
-                                    player2Name: player2Name,
-                                    vx: vx, 
-                                    vy: vy 
-                                }})
-                            }})
-                            .then(response => response.json())
-                            .then(svgFrames => {{
-                                // Handle the SVG frames here, e.g., animate them
-                                let currentFrame = 0;
-                                function displayNextFrame() {{
-                                    if (currentFrame < svgFrames.length) {{
-                                        svgContainer.innerHTML = svgFrames[currentFrame];
-                                        currentFrame++;
-                                        setTimeout(displayNextFrame, 2);
-                                    }} else {{
-                                        animationComplete = true;
-                                        currentTurn = (currentTurn === player1Name) ? player2Name : player1Name;
-                                        document.getElementById("turn-indicator").textContent = "Turn: " + currentTurn;
-                                        // Reinitialize the cue ball interaction after the shot animation is complete
-                                        initializeCueBallInteraction();
-                                    }}
-                                }}
-                                animationComplete = false;
-                                displayNextFrame();
-                            }});
-                        }}
-
-                        cueBall.addEventListener('mousedown', function(evt) {{
-                            isDragging = true;
-                            const pos = getMousePosition(evt);
-                            startX = pos.x
-                            startY = pos.y
-                            line = createLine(startX, startY, startX, startY);
-                        }});
-
-                        svgContainer.addEventListener('mousemove', function(evt) {{
-                            if (isDragging && line) {{
-                                const pos = getMousePosition(evt);
-                                line.setAttribute('x2', pos.x);
-                                line.setAttribute('y2', pos.y);
-                            }}
-                        }});
-
-                        window.addEventListener('mouseup', function(evt) {{
-                            if (isDragging) {{
-                                isDragging = false;
-                                let pt = svg.createSVGPoint();
-                                pt.x = evt.clientX;
-                                pt.y = evt.clientY;
-                                let cursorPoint = pt.matrixTransform(svg.getScreenCTM().inverse());
-
-                                let vx = -(cursorPoint.x - startX) * 3;
-                                let vy = -(cursorPoint.y - startY) * 3;
-                                if (line) svg.removeChild(line);
-                                finalizeShot(vx, vy);
-                            }}
-                        }});
-                    }};
-                </script>
+                <script src="/game.js"></script>
             </body>
             </html>
             """
-            self.wfile.write(game_content.encode())
-            # self.wfile.write(table.svg().encode())
+            self.sendBody(game_content.encode(), 'text/html')
 
     def do_POST(self):
         if self.path == '/start':
@@ -363,14 +831,19 @@ class RequestHandler(BaseHTTPRequestHandler):
             post_data = self.rfile.read(content_length).decode('utf-8')
             post_data = parse_qs(post_data)
 
+            gameName = post_data.get("gameName", [""])[0]
             player1 = post_data["player1"][0]
             player2 = post_data["player2"][0]
 
             first_player = random.choice([player1, player2])
 
-            # Redirect to the game page with the first player's name as a query parameter
+            # Start the game on its own table
+            session = SESSIONS.create(gameName, player1, player2)
+
+            # Redirect to the game page with the game and the first player's name as query parameters
             self.send_response(303)
-            self.send_header('Location', f'/game?player1={player1}&player2={player2}&first_player={first_player}')
+            self.send_header('Location', '/game?' + urlencode({"gameID": session.game.gameID, "gameName": gameName, "player1": player1,
+                                                               "player2": player2, "first_player": first_player}))
             self.end_headers()
 
         if self.path == '/shoot':
@@ -381,26 +854,177 @@ class RequestHandler(BaseHTTPRequestHandler):
             player2Name = post_data['player2Name']
             xvel = float(post_data.get('vx', 0) or 0)
             yvel = float(post_data.get('vy', 0) or 0)
+            shotFormat = post_data.get('format')
             print(gameName, player1Name, player2Name, xvel, yvel)
+            try:
+                gameID = int(post_data.get('gameID'))
+            except (TypeError, ValueError):
+                self.send_error(400, "gameID must be an integer")
+                return
 
-            game = Game(gameName=gameName, player1Name=player1Name, player2Name=player2Name)
+            # Plays the shot on the game's table, with the game locked. Returns the content type and the response
+            def play(session):
+                result = shoot(session)
+                # The break is played, the next shots only hit the cache for the very same table (see BREAK_CACHE)
+                session.game.cache = Game.cache
+                return result
 
-            AllSVGs, RequestHandler.current_table = game.shoot(gameName, player1Name, RequestHandler.current_table, xvel, yvel)
-            
-            svg_Frames = AllSVGs.split('<?xml version="1.0" encoding="UTF-8" standalone="no"?>')[1:]
-            svg_Frames = [f'<?xml version="1.0" encoding="UTF-8" standalone="no"?>{frame}' for frame in svg_Frames if frame.strip()]
+            def shoot(session):
+                game = session.game
 
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            response = json.dumps(svg_Frames)
-            self.end_headers()
-            self.wfile.write(response.encode('utf-8'))
+                # format "keyframes" sends only the table at every segment boundary, the page interpolates the frames
+                if shotFormat == 'keyframes':
+                    table = session.table
+                    keyframes, session.table = game.shootKeyframes(game.gameName, player1Name, table, xvel, yvel)
+                    return 'application/json', json.dumps({
+                        "svg": table.svg(),
+                        "balls": [number for _, number, _, _ in table.balls()],
+                        "fills": [ballFills(number) for _, number, _, _ in table.balls()],
+                        "keyframes": keyframes,
+                    }).encode('utf-8')
+
+                # format "pages" only sends the shot ID and its number of frames, the page asks /frames for them
+                if shotFormat == 'pages':
+                    frames, session.table = game.shootFrames(game.gameName, player1Name, session.table, xvel, yvel)
+                    # /frames needs the shot ID, so wait for the (single row) shot to be saved
+                    shotID = game.saved.result()
+                    FRAME_PAGES.add(shotID, frames)
+                    return 'application/json', json.dumps({"shot": shotID, "frames": len(frames), "interval": FRAME_INTERVAL}).encode('utf-8')
+
+                # format "stream" sends every frame as a Server-Sent Event as soon as it is rendered
+                if shotFormat == 'stream':
+                    session.table = self.streamShot(game.playShot(game.gameName, player1Name, session.table, xvel, yvel))
+                    return 'text/event-stream', None
+
+                # format "delta" sends a FrameEncoder stream instead of a JSON array of SVG documents
+                if shotFormat == 'delta':
+                    encoder = FrameEncoder()
+                    _, session.table = game.shoot(game.gameName, player1Name, session.table, xvel, yvel, encoder)
+                    return 'application/octet-stream', encoder.data()
+
+                AllSVGs, session.table = game.shoot(game.gameName, player1Name, session.table, xvel, yvel)
+
+                svg_Frames = AllSVGs.split('<?xml version="1.0" encoding="UTF-8" standalone="no"?>')[1:]
+                svg_Frames = [f'<?xml version="1.0" encoding="UTF-8" standalone="no"?>{frame}' for frame in svg_Frames if frame.strip()]
+                return 'application/json', json.dumps(svg_Frames).encode('utf-8')
+
+            try:
+                result = SESSIONS.play(gameID, play)
+            except queue.Full:
+                # Too many shots are waiting for a worker (see SimulationPool): turn the shot away without waiting
+                self.send_response(503)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            except TimeoutError:
+                # The shot was cancelled, the table is still where it was before it
+                self.send_error(504, "The shot took too long to simulate")
+                return
+            except ValueError as error:
+                # The shot can't be played on this table (no cue ball), raised again here by the worker that tried
+                self.send_error(400, f"The shot can't be played: {error}")
+                return
+            if result is None:
+                self.send_error(404, "No such game")
+                return
+            contentType, response = result
+            # Already sent while it was played
+            if response is None:
+                return
+
+            self.sendBody(response, contentType)
+
+    # Sends the svg frames of a Game.playShot() generator as "frame" events while it renders them, then an "end"
+    # event. There is no Content-Length: the response ends when the connection is closed. If the page goes away the
+    # rest of the shot is still played (and saved) without being sent. Returns the table at the end of the shot
+    def streamShot(self, frames):
+        # The stream is compressed as a whole, flushed after every event so each one can be shown as it arrives
+        encoding = self.acceptedEncoding()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31 if encoding == 'gzip' else 15) if encoding else None
+
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        connected = [True]
+        def send(event, last=False):
+            if compressor:
+                event = compressor.compress(event) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+            if connected[0]:
+                try:
+                    self.wfile.write(event)
+                    self.wfile.flush()
+                except OSError:
+                    connected[0] = False
+
+        try:
+            while True:
+                send(b"event: frame\ndata: " + json.dumps(next(frames)).encode('utf-8') + b"\n\n")
+        except StopIteration as stop:
+            send(b"event: end\ndata: {}\n\n", last=True)
+            return stop.value
+
+# HTTP server that serves requests on a fixed set of threads, instead of a new thread for every request, so each
+# thread keeps its database connection (see ConnectionManager) from one request to the next. While every thread is
+# busy, at most backlog accepted connections wait for one
+class PooledHTTPServer(HTTPServer):
+
+    def __init__(self, server_address, handler_class, threads=16, backlog=64):
+        super().__init__(server_address, handler_class)
+        self.requests = queue.Queue(backlog)
+        self.threads = [threading.Thread(target=self.serveRequests, name=f"HTTPServer-{index}", daemon=True)
+                        for index in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    # Called by serve_forever() for every connection accepted: hands it to the next free thread
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    # Body of every thread, stops at the None queued by server_close()
+    def serveRequests(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    # Closes the socket, then stops every thread once the requests they were given are served
+    def server_close(self):
+        super().server_close()
+        for _ in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
 
-def run(server_class=HTTPServer, handler_class=RequestHandler, port=54466):
+# Requests are served by a pool of threads, games only wait for their own shots (see SessionManager).
+# Shots are simulated by a pool of worker processes, each within deadline seconds, with at most queueSize
+# shots waiting for one of them (see SimulationPool)
+def run(server_class=PooledHTTPServer, handler_class=RequestHandler, port=54466, workers=2, queueSize=8, deadline=10.0):
+    setUp(workers, queueSize, deadline)
     server_address = ('', port)
     httpd = server_class(server_address, handler_class)
     print(f"Starting httpd on port {port}")
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    finally:
+        # Let the requests being served finish, then put every game away and save the shots still waiting to be
+        # written before exiting
+        httpd.server_close()
+        SESSIONS.close()
+        Game.writer.close()
+        Game.pool.close()
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,334 @@
+import contextlib
+import io
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import unittest
+from Physics import Database, Game, Table, Shot, WriteBehind, CONNECTIONS, TABLE_CACHE, STILL_BALL
+from Physics import ENGINE_EVENT, STORAGE_ROWS, STORAGE_PACKED, SCHEMA_VERSION
+
+# Every test gets a new phylib.db in a directory of its own
+class DatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        self.db = Database(reset=True)
+        self.db.createDB()
+
+    def tearDown(self):
+        CONNECTIONS.closeAll(self.db.databaseName)
+        TABLE_CACHE.clear(self.db.databaseName)
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    # A table holding the cue ball and the 1 ball, at time
+    def table(self, time=0.0):
+        table = Table().importBalls([(0, STILL_BALL, 675.0, 2000.0, 0.0, 0.0, 0.0, 0.0),
+                                     (1, STILL_BALL, 675.0, 675.0, 0.0, 0.0, 0.0, 0.0)])
+        table.time = time
+        return table
+
+class TestReadTables(DatabaseTestCase):
+
+    def test_build_tables_without_rows(self):
+        self.assertEqual(self.db.buildTables([]), [])
+
+    def test_shot_without_frames(self):
+        self.db.setGame("game", "one", "two")
+        shotID = self.db.newShot("game", "one")
+        self.assertEqual(self.db.readShotFrames(shotID), [])
+
+    def test_read_tables_matches_read_table(self):
+        first = self.db.writeTable(self.table(0.0))
+        self.db.writeTable(self.table(1.5))
+        tables = self.db.readTables(first, first + 3)
+        self.assertIsNone(tables[2])
+        for index in range(2):
+            self.assertEqual(str(tables[index]), str(self.db.readTable(first + index)))
+
+class TestWriteShotTables(DatabaseTestCase):
+
+    # The frames of a shot, the cue ball rolling towards the 1 ball
+    def frames(self):
+        shot = Shot()
+        shot.run(self.table(), 0.0, -400.0, ENGINE_EVENT)
+        return [shot[0].roll(frame * 0.1) for frame in range(10)]
+
+    # Time, then number, type, position and velocity of every ball
+    def state(self, table):
+        return table.time, [row[:6] for row in table.exportBalls().tolist()]
+
+    def test_reads_back_what_was_written(self):
+        self.db.setGame("game", "one", "two")
+        shotID = self.db.newShot("game", "one")
+        tables = self.frames()
+        tableIDs = self.db.writeShotTables(shotID, tables)
+        self.assertEqual(tableIDs, list(range(tableIDs[0], tableIDs[0] + len(tables))))
+        # readTable() works the accelerations out again from the velocities, so only compare the rest
+        read = self.db.readShotFrames(shotID)
+        self.assertEqual([self.state(table) for table in read], [self.state(table) for table in tables])
+        self.assertEqual(self.state(self.db.readTable(tableIDs[3])), self.state(tables[3]))
+        # The next table gets the next ID
+        self.assertEqual(self.db.writeTable(self.table()), tableIDs[-1] + 1)
+
+    # A frame that can't be written leaves none of the shot behind
+    def test_all_or_nothing(self):
+        self.db.setGame("game", "one", "two")
+        shotID = self.db.newShot("game", "one")
+        with self.assertRaises(AttributeError):
+            self.db.writeShotTables(shotID, self.frames() + [None])
+        for table in ("TTable", "Ball", "BallTable", "TableShot"):
+            self.assertEqual(self.db.cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0], 0)
+        self.assertEqual(self.db.readShotFrames(shotID), [])
+
+class TestShotData(DatabaseTestCase):
+
+    # Saves the tables of a whole shot of the cue ball onto the 1 ball with writeShotData(). Returns the shot ID and the Shot
+    def writeShot(self):
+        shot = Shot()
+        shot.run(self.table(), 0.0, -1000.0, ENGINE_EVENT)
+        self.db.setGame("game", "one", "two")
+        shotID = self.db.newShot("game", "one")
+        self.db.writeShotData(shotID, [shot[index] for index in range(len(shot))])
+        return shotID, shot
+
+    def test_reads_back_what_was_written(self):
+        shotID, shot = self.writeShot()
+        tables = self.db.readShotData(shotID)
+        self.assertEqual([str(table) for table in tables], [str(shot[index]) for index in range(len(shot))])
+        self.assertIsNone(self.db.readShotData(shotID + 1))
+
+    # Any time of the shot is rolled from the segment it falls in
+    def test_read_shot_table(self):
+        shotID, shot = self.writeShot()
+        for time in (0.0, 0.4, shot[1].time, shot[1].time + 0.3, shot.final().time):
+            segment = max(index for index in range(len(shot)) if shot[index].time <= time)
+            expected = shot[segment].roll(time - shot[segment].time)
+            table = self.db.readShotTable(shotID, time)
+            self.assertEqual(table.time, time)
+            self.assertEqual(table.exportBalls().tolist(), expected.exportBalls().tolist())
+        self.assertIsNone(self.db.readShotTable(shotID + 1, 0.0))
+
+    # A game saving packed shots writes no frames at all
+    def test_game_saves_packed_shots(self):
+        game = Game(gameName="game", player1Name="one", player2Name="two")
+        game.engine = ENGINE_EVENT
+        game.storage = STORAGE_PACKED
+        _, final = game.shoot("game", "one", self.table(), 0.0, -400.0)
+        shotID = game.saved.result()
+        self.assertEqual(self.db.readShotFrames(shotID), [])
+        self.assertEqual(str(self.db.readShotData(shotID)[-1]), str(final))
+
+class TestMigrate(DatabaseTestCase):
+
+    INDEXES = ["BallTableByBall", "BallTableByTable", "GameByName", "PlayerByGame", "PlayerByName", "ShotByGame", "TableShotByShot"]
+
+    def indexes(self):
+        self.db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+        return [name for name, in self.db.cursor.fetchall()]
+
+    def test_new_database(self):
+        self.assertEqual(self.db.cursor.execute("PRAGMA user_version").fetchone()[0], SCHEMA_VERSION)
+        self.assertEqual(self.indexes(), self.INDEXES)
+
+    # A database from before the indexes and the Shot columns, with a shot already played
+    def test_old_database(self):
+        self.db.setGame("game", "one", "two")
+        shotID = self.db.newShot("game", "one")
+        self.db.writeShotTables(shotID, [self.table(0.0), self.table(1.0)])
+        for index in self.INDEXES:
+            self.db.cursor.execute(f"DROP INDEX {index}")
+        self.db.cursor.execute("ALTER TABLE Shot DROP COLUMN CREATED")
+        self.db.cursor.execute("ALTER TABLE Shot DROP COLUMN COMPACTED")
+        self.db.cursor.execute("PRAGMA user_version = 0")
+        self.db.conn.commit()
+
+        Database().createDB()
+
+        self.assertEqual(self.db.cursor.execute("PRAGMA user_version").fetchone()[0], SCHEMA_VERSION)
+        self.assertEqual(self.indexes(), self.INDEXES)
+        created, compacted = self.db.cursor.execute("SELECT CREATED, COMPACTED FROM Shot WHERE SHOTID = ?",
+                                                    (shotID,)).fetchone()
+        self.assertIsNotNone(created)
+        self.assertEqual(compacted, 0)
+        self.assertEqual([table.time for table in self.db.readShotFrames(shotID)], [0.0, 1.0])
+
+        # Migrating again changes nothing
+        self.db.migrateDB()
+        self.assertEqual(self.db.cursor.execute("SELECT CREATED FROM Shot").fetchone()[0], created)
+
+    # The frames of a shot are found through the index, not by scanning TableShot
+    def test_read_shot_frames_uses_the_index(self):
+        self.db.cursor.execute("EXPLAIN QUERY PLAN SELECT TABLEID FROM TableShot WHERE SHOTID = ?", (1,))
+        self.assertIn("TableShotByShot", " ".join(str(row) for row in self.db.cursor.fetchall()))
+
+class TestConnections(DatabaseTestCase):
+
+    # Returns the (connection, cursor) another thread gets
+    def otherThread(self):
+        entries = []
+        thread = threading.Thread(target=lambda: entries.append(CONNECTIONS.get(self.db.databaseName)))
+        thread.start()
+        thread.join()
+        return entries[0]
+
+    def test_one_connection_per_thread(self):
+        conn = self.db.conn
+        self.assertIs(Database().conn, conn)
+        self.assertIs(self.db.cursor, Database().cursor)
+        self.assertIsNot(self.otherThread()[0], conn)
+
+    def test_pragmas(self):
+        pragmas = {name: self.db.cursor.execute(f"PRAGMA {name}").fetchone()[0]
+                   for name in ("journal_mode", "auto_vacuum", "synchronous", "temp_store")}
+        # auto_vacuum 2 is INCREMENTAL, synchronous 1 NORMAL and temp_store 2 MEMORY
+        self.assertEqual(pragmas, {"journal_mode": "wal", "auto_vacuum": 2, "synchronous": 1, "temp_store": 2})
+
+    # Another thread connects and reads what this one committed while this one is in the middle of a write
+    def test_readers_see_commits(self):
+        first = self.db.writeTable(self.table(0.0))
+        self.db.cursor.execute("BEGIN IMMEDIATE")
+        self.db.cursor.execute("INSERT INTO TTable (TIME) VALUES (5.0)")
+        conn, cursor = self.otherThread()
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM TTable").fetchone()[0], first + 1)
+        self.db.conn.commit()
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM TTable").fetchone()[0], first + 2)
+
+    def test_close_all(self):
+        conn = self.db.conn
+        other = self.otherThread()[0]
+        CONNECTIONS.closeAll(self.db.databaseName)
+        self.assertTrue(conn.closed and other.closed)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            other.execute("SELECT 1")
+        # The next use opens a new one
+        self.assertIsNot(self.db.conn, conn)
+
+    def test_close_commits(self):
+        self.db.cursor.execute("INSERT INTO TTable (TIME) VALUES (5.0)")
+        CONNECTIONS.close(self.db.databaseName)
+        self.assertEqual(self.db.cursor.execute("SELECT TIME FROM TTable").fetchone()[0], 5.0)
+
+class TestWriteBehind(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = WriteBehind(maxsize=2, timeout=0.1)
+
+    def tearDown(self):
+        self.writer.close()
+
+    def test_writes_in_order(self):
+        written = []
+        futures = [self.writer.submit(written.append, number) for number in range(10)]
+        self.writer.flush()
+        self.assertEqual(written, list(range(10)))
+        self.assertTrue(all(future.done() for future in futures))
+
+    def test_future_holds_the_result_or_the_error(self):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            failed = self.writer.submit(int, "not a number")
+            future = self.writer.submit(max, 3, 4)
+            self.assertEqual(future.result(timeout=10), 4)
+        self.assertIsInstance(failed.exception(), ValueError)
+        self.assertIn("writing behind", output.getvalue())
+
+    # With the writer stuck on one write and maxsize more queued, the next submit() gives up after the timeout
+    def test_backpressure(self):
+        started, release = threading.Event(), threading.Event()
+        def block():
+            started.set()
+            release.wait()
+        self.writer.submit(block)
+        started.wait()
+        self.writer.submit(int)
+        self.writer.submit(int)
+        with self.assertRaises(queue.Full):
+            self.writer.submit(int)
+        release.set()
+        self.writer.flush()
+
+    def test_close_writes_what_is_queued(self):
+        written = []
+        for number in range(5):
+            self.writer.submit(written.append, number)
+        self.writer.close()
+        self.assertEqual(written, list(range(5)))
+        self.assertFalse(self.writer.thread.is_alive())
+        with self.assertRaises(RuntimeError):
+            self.writer.submit(written.append, 5)
+
+class TestGameWriteBehind(DatabaseTestCase):
+
+    # The shot is saved on the writer thread, the Future gives its ID once it is committed
+    def test_game_saves_behind(self):
+        game = Game(gameName="game", player1Name="one", player2Name="two")
+        game.engine = ENGINE_EVENT
+        game.writer = WriteBehind()
+        try:
+            game.shoot("game", "one", self.table(), 0.0, -400.0)
+            shotID = game.saved.result(timeout=10)
+        finally:
+            game.writer.close()
+        self.assertGreater(len(self.db.readShotFrames(shotID)), 1)
+
+class TestCompact(DatabaseTestCase):
+
+    # Plays a gentle shot of player one, saved the way storage says. Returns the shot ID
+    def playShot(self, storage):
+        game = Game(gameName="game", player1Name="one", player2Name="two")
+        game.engine = ENGINE_EVENT
+        game.storage = storage
+        game.shoot("game", "one", self.table(), 0.0, -400.0)
+        return game.saved.result()
+
+    def test_compacts_frames_and_counts_packed_shots(self):
+        rowsShot = self.playShot(STORAGE_ROWS)
+        packedShot = self.playShot(STORAGE_PACKED)
+        frames = self.db.readShotFrames(rowsShot)
+
+        stats = self.db.compact(maxAge=-1)
+
+        self.assertEqual(stats["shots"], 1)
+        self.assertEqual(stats["packed"], 1)
+        kept = self.db.readShotFrames(rowsShot)
+        self.assertEqual(stats["frames"], len(frames) - len(kept))
+        self.assertLess(len(kept), len(frames))
+        self.assertEqual(str(kept[-1]), str(frames[-1]))
+        self.assertIsNotNone(self.db.readShotData(packedShot))
+
+        # Nothing is left to compact the second time
+        self.assertEqual(self.db.compact(maxAge=-1)["shots"], 0)
+
+    def test_recent_games_are_left_alone(self):
+        rowsShot = self.playShot(STORAGE_ROWS)
+        frames = len(self.db.readShotFrames(rowsShot))
+        stats = self.db.compact(maxAge=3600)
+        self.assertEqual((stats["shots"], stats["packed"]), (0, 0))
+        self.assertEqual(len(self.db.readShotFrames(rowsShot)), frames)
+
+    # Every orphan lookup of removeOrphans() goes through an index, so a batch never scans a table per row
+    def test_orphan_lookups_use_indexes(self):
+        self.db.setGame("game", "one", "two")
+        shotID = self.db.newShot("game", "one")
+        self.db.writeShotTables(shotID, [self.table(frame * 0.01) for frame in range(2000)])
+        for table, orphan in Database.ORPHANS:
+            self.db.cursor.execute(f"EXPLAIN QUERY PLAN DELETE FROM {table} WHERE rowid BETWEEN ? AND ? AND {orphan}",
+                                   (0, 50000))
+            plan = [row[-1] for row in self.db.cursor.fetchall()]
+            self.assertEqual([step for step in plan if step.startswith("SCAN") or "AUTOMATIC" in step], [], (table, plan))
+
+        # Dropping every other table leaves its balls and its TableShot row behind, until removeOrphans()
+        self.db.cursor.execute("DELETE FROM TTable WHERE TABLEID % 2 = 0")
+        self.db.conn.commit()
+        self.assertEqual(self.db.removeOrphans(batch=700), 2 * 1000 + 2 * 1000 + 1000)
+        counts = [self.db.cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("BallTable", "Ball", "TableShot")]
+        self.assertEqual(counts, [2 * 1000, 2 * 1000, 1000])
+        self.assertEqual([table.time for table in self.db.readShotFrames(shotID)][:2], [0.0, 0.02])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+from Physics import Game, Shot, FRAME_INTERVAL, ENGINE_EVENT
+from test_database import DatabaseTestCase
+
+# Every test plays in a new phylib.db, see DatabaseTestCase
+class GameTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.game = Game(gameName="game", player1Name="one", player2Name="two")
+        self.game.engine = ENGINE_EVENT
+
+class TestShoot(GameTestCase):
+
+    # One frame every FRAME_INTERVAL of every segment, each one the svg of the rolled table, then the last frame again
+    def test_one_frame_per_interval(self):
+        shot = Shot()
+        shot.run(self.table(), 0.0, -400.0, ENGINE_EVENT)
+        expected = []
+        for index in range(1, len(shot)):
+            start, end = shot[index - 1], shot[index]
+            for frame in range(int((end.time - start.time) / FRAME_INTERVAL)):
+                expected.append(start.roll(frame * FRAME_INTERVAL).svg())
+        expected.append(expected[-1])
+
+        svg, last = self.game.shoot("game", "one", self.table(), 0.0, -400.0)
+        self.assertEqual(svg, "".join(expected))
+        self.assertEqual(str(last), str(shot.final()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+import threading
+import unittest
+import math
+from Physics import Table, Shot, STILL_BALL, ROLLING_BALL, BALL_DIAMETER, BALL_RADIUS, DRAG, ENGINE_STEP, ENGINE_EVENT
+
+ENGINES = (ENGINE_STEP, ENGINE_EVENT)
+
+# A table holding still balls, one (number, x, y) each
+def stillTable(*balls):
+    return Table().importBalls([(number, STILL_BALL, x, y, 0.0, 0.0, 0.0, 0.0) for number, x, y in balls])
+
+# The cue ball aimed straight at the 1 ball
+def headOn():
+    return stillTable((0, 675.0, 2000.0), (1, 675.0, 1000.0))
+
+# Every ball of a table as {number: (type, x, y)}
+def ballsOf(table):
+    return {int(row[0]): (int(row[1]), row[2], row[3]) for row in table.exportBalls().tolist()}
+
+# Runs a whole shot, returns the Shot
+def runShot(table, xvel, yvel, engine):
+    shot = Shot()
+    shot.run(table, xvel, yvel, engine)
+    return shot
+
+class TestEventEngine(unittest.TestCase):
+
+    # The event engine jumps straight to the moment the balls touch
+    def test_head_on_contact(self):
+        first = runShot(headOn(), 0.0, -1000.0, ENGINE_EVENT)[1]
+        balls = ballsOf(first)
+        self.assertAlmostEqual(balls[0][2] - balls[1][2], BALL_DIAMETER, places=6)
+        self.assertEqual(balls[1][0], ROLLING_BALL)
+
+    # A ball stops after v^2 / (2 DRAG), here after bouncing off the top cushion once
+    def test_cushion_and_stop(self):
+        shot = runShot(stillTable((0, 675.0, 300.0)), 0.0, -800.0, ENGINE_EVENT)
+        self.assertAlmostEqual(shot.final().time, 800.0 / DRAG, places=6)
+        travelled = 800.0 ** 2 / (2 * DRAG)
+        self.assertAlmostEqual(ballsOf(shot.final())[0][2], BALL_RADIUS + travelled - (300.0 - BALL_RADIUS), places=6)
+
+    def test_hole(self):
+        shot = runShot(stillTable((0, 150.0, 150.0)), -500.0, -500.0, ENGINE_EVENT)
+        self.assertEqual(ballsOf(shot.final()), {})
+
+    # Both engines go through the same segments, the step engine within its time step
+    def test_matches_step_engine(self):
+        for table, xvel, yvel in [(headOn(), 0.0, -1000.0),
+                                  (stillTable((0, 675.0, 300.0)), 0.0, -800.0),
+                                  (stillTable((0, 150.0, 150.0)), -500.0, -500.0)]:
+            step = runShot(table, xvel, yvel, ENGINE_STEP)
+            event = runShot(table, xvel, yvel, ENGINE_EVENT)
+            self.assertEqual(len(step), len(event))
+            for index in range(len(step)):
+                self.assertAlmostEqual(step[index].time, event[index].time, delta=0.001)
+                stepBalls, eventBalls = ballsOf(step[index]), ballsOf(event[index])
+                self.assertEqual(stepBalls.keys(), eventBalls.keys())
+                for number, (type, x, y) in eventBalls.items():
+                    self.assertAlmostEqual(stepBalls[number][1], x, delta=1.0)
+                    self.assertAlmostEqual(stepBalls[number][2], y, delta=1.0)
+
+class TestBroadPhase(unittest.TestCase):
+
+    # The grid cells are 228 mm: the cue ball in one column still hits a ball centred in the next, on a row boundary
+    def test_collision_across_grid_cells(self):
+        for engine in ENGINES:
+            table = stillTable((0, 430.0, 2000.0), (1, 460.0, 1140.0))
+            first = runShot(table, 0.0, -1000.0, engine)[1]
+            self.assertEqual(ballsOf(first)[1][0], ROLLING_BALL)
+
+    # Balls spread over every part of the table, only one of them in the cue ball's way
+    def test_far_balls_are_left_alone(self):
+        balls = [(0, 675.0, 2400.0), (1, 675.0, 1500.0)]
+        balls += [(number, 100.0 + (number % 4) * 380.0, 100.0 + (number // 4) * 600.0) for number in range(2, 16)]
+        for engine in ENGINES:
+            first = runShot(stillTable(*balls), 0.0, -1000.0, engine)[1]
+            moved = [number for number, ball in ballsOf(first).items() if ball[0] == ROLLING_BALL and number != 0]
+            self.assertEqual(moved, [1])
+
+class TestArena(unittest.TestCase):
+
+    # Every segment is simulated on a packed copy of the table: the cushions, the holes and the balls that never
+    # move come back exactly as they were
+    def test_segments_keep_the_table(self):
+        balls = [(0, 675.0, 2400.0), (1, 675.0, 1500.0)]
+        balls += [(number, 100.0 + (number % 4) * 380.0, 100.0 + (number // 4) * 600.0) for number in range(2, 16)]
+        for engine in ENGINES:
+            shot = runShot(stillTable(*balls), 0.0, -1000.0, engine)
+            cushionsAndHoles = str(shot[0]).splitlines()[1:11]
+            for table in shot.segments():
+                self.assertEqual(str(table).splitlines()[1:11], cushionsAndHoles)
+                others = ballsOf(table)
+                self.assertEqual(sorted(others), list(range(16)))
+                for number, x, y in balls[2:]:
+                    self.assertEqual(others[number], (STILL_BALL, x, y))
+
+    # shot[i + 1] is what Table.segment() makes of shot[i]
+    def test_segments_match_table_segment(self):
+        shot = runShot(headOn(), 30.0, -1000.0, ENGINE_EVENT)
+        table = shot[0]
+        for index in range(1, len(shot)):
+            table = table.segment(ENGINE_EVENT)
+            self.assertEqual(table.time, shot[index].time)
+            self.assertEqual(table.exportBalls().tolist(), shot[index].exportBalls().tolist())
+        self.assertIsNone(table.segment(ENGINE_EVENT))
+
+    # A Shot run again reuses its arena without anything left over from the last shot
+    def test_reused_shot(self):
+        for engine in ENGINES:
+            shot = runShot(headOn(), 30.0, -1000.0, engine)
+            shot.run(stillTable((0, 675.0, 300.0)), 0.0, -800.0, engine)
+            fresh = runShot(stillTable((0, 675.0, 300.0)), 0.0, -800.0, engine)
+            self.assertEqual(len(shot), len(fresh))
+            self.assertEqual(shot.final().exportBalls().tolist(), fresh.final().exportBalls().tolist())
+
+class TestShoot(unittest.TestCase):
+
+    def test_final_table(self):
+        for engine in ENGINES:
+            table = headOn()
+            final = table.shoot(0.0, -1000.0, engine)
+            self.assertEqual(final.exportBalls().tolist(), runShot(table, 0.0, -1000.0, engine).final().exportBalls().tolist())
+            # The table shot from is left as it was
+            self.assertEqual(ballsOf(table), ballsOf(headOn()))
+
+    def test_no_cue_ball(self):
+        with self.assertRaises(ValueError):
+            stillTable((1, 675.0, 1000.0)).shoot(0.0, -1000.0)
+
+class TestFrames(unittest.TestCase):
+
+    # Every frame is where Table.roll() puts the balls of its segment, nan once a ball is pocketed
+    def test_frames_match_roll(self):
+        shot = runShot(stillTable((0, 300.0, 400.0), (1, 200.0, 200.0)), -800.0, -1200.0, ENGINE_EVENT)
+        times, positions = shot.frames(0.01)
+        self.assertEqual(positions.shape, (len(times), 2, 3))
+        positions = positions.tolist()
+        segment = 0
+        for frame, time in enumerate(times):
+            while segment + 1 < len(shot) - 1 and shot[segment + 1].time <= time:
+                segment += 1
+            rolled = ballsOf(shot[segment].roll(time - shot[segment].time))
+            for number, x, y in positions[frame]:
+                if math.isnan(x):
+                    self.assertNotIn(int(number), rolled)
+                else:
+                    self.assertAlmostEqual(x, rolled[int(number)][1], places=6)
+                    self.assertAlmostEqual(y, rolled[int(number)][2], places=6)
+        # The 1 ball drops into the corner hole while the cue ball rolls on
+        self.assertTrue(math.isnan(positions[-1][1][1]))
+        self.assertFalse(math.isnan(positions[-1][0][1]))
+
+class TestEvaluate(unittest.TestCase):
+
+    VELOCITIES = [(0.0, -1000.0), (40.0, -1000.0), (-300.0, -900.0), (0.0, -200.0), (500.0, 500.0)]
+
+    # Each shot ends where Table.shoot() ends it
+    def test_matches_shoot(self):
+        table = headOn()
+        times, positions = table.evaluate(self.VELOCITIES)
+        for index, (xvel, yvel) in enumerate(self.VELOCITIES):
+            final = table.shoot(xvel, yvel, ENGINE_EVENT)
+            self.assertEqual(times[index], final.time)
+            balls = ballsOf(final)
+            for number, x, y in positions.tolist()[index]:
+                if math.isnan(x):
+                    self.assertNotIn(int(number), balls)
+                else:
+                    self.assertEqual((x, y), balls[int(number)][1:])
+
+    def test_threads_give_the_same_results(self):
+        table = headOn()
+        velocities = [(x * 10.0, -1000.0 + x) for x in range(-20, 20)]
+        times, positions = table.evaluate(velocities, threads=1)
+        for threads in (2, 4, 0):
+            otherTimes, otherPositions = table.evaluate(velocities, threads=threads)
+            self.assertEqual(otherTimes.tolist(), times.tolist())
+            self.assertEqual(str(otherPositions.tolist()), str(positions.tolist()))
+
+    # The GIL is released while a shot is simulated, so other threads keep running
+    def test_releases_the_gil(self):
+        table = stillTable((0, 675.0, 2000.0), (1, 675.0, 1000.0), (2, 300.0, 600.0))
+        done = threading.Event()
+        def simulate():
+            for _ in range(3):
+                table.shoot(200.0, -2000.0, ENGINE_STEP)
+            done.set()
+        thread = threading.Thread(target=simulate)
+        count = 0
+        thread.start()
+        while not done.is_set():
+            count += 1
+        thread.join()
+        self.assertGreater(count, 10000)
+
+class TestBalls(unittest.TestCase):
+
+    def test_export_import_round_trip(self):
+        rows = [(0, ROLLING_BALL, 675.0, 2000.0, 10.0, -20.0, -1.5, 3.0), (7, STILL_BALL, 100.0, 200.0, 0.0, 0.0, 0.0, 0.0)]
+        table = Table().importBalls(rows)
+        self.assertEqual([tuple(row) for row in table.exportBalls().tolist()], rows)
+        # The exported buffer builds the same table again, replacing the balls that were there
+        other = stillTable((3, 1.0, 2.0)).importBalls(table.exportBalls())
+        self.assertEqual(other.exportBalls().tolist(), table.exportBalls().tolist())
+        self.assertEqual(table.cueBall().obj.rolling_ball.vel.x, 10.0)
+
+    def test_empty_table(self):
+        self.assertEqual(Table().exportBalls().tolist(), [])
+        self.assertIsNone(Table().cueBall())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,246 @@
+import math
+import queue
+import struct
+import unittest
+from Physics import Table, Shot, PackedShot, ShotCache, ShotFrames, FrameRenderer, FrameEncoder, SimulationPool
+from Physics import packShot, ballFills, STILL_BALL, ENGINE_STEP, ENGINE_EVENT, FRAME_INTERVAL
+
+# A table with the cue ball and a rack of three balls, every ball moved by (dx, dy)
+def rackTable(dx=0.0, dy=0.0):
+    return Table().importBalls([(0, STILL_BALL, 675.0 + dx, 2000.0 + dy, 0.0, 0.0, 0.0, 0.0),
+                                (1, STILL_BALL, 675.0 + dx, 675.0 + dy, 0.0, 0.0, 0.0, 0.0),
+                                (2, STILL_BALL, 644.5 + dx, 622.2 + dy, 0.0, 0.0, 0.0, 0.0),
+                                (3, STILL_BALL, 705.5 + dx, 622.2 + dy, 0.0, 0.0, 0.0, 0.0)])
+
+class TestShotCache(unittest.TestCase):
+
+    # By default only the very same table and cue velocity hit
+    def test_exact_by_default(self):
+        cache = ShotCache()
+        first = cache.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        self.assertIs(cache.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT), first)
+        self.assertIsNot(cache.run(rackTable(0.001), 0.0, -1000.0, ENGINE_EVENT), first)
+        self.assertIsNot(cache.run(rackTable(), 0.0, -1000.001, ENGINE_EVENT), first)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["shots"]), (1, 3, 3))
+
+    # Racks of createFullRackTable() are nudged by up to 1.5 mm either way, around the rack the cells are centred on
+    def test_nudged_racks_hit(self):
+        cache = ShotCache(tolerance=6.0, velocityTolerance=1.0, origin=rackTable())
+        first = cache.run(rackTable(1.5, -1.5), 0.0, -1000.0, ENGINE_EVENT)
+        self.assertIs(cache.run(rackTable(-1.5, 1.5), 0.0, -1000.2, ENGINE_EVENT), first)
+        self.assertIs(cache.run(rackTable(), 0.3, -999.7, ENGINE_EVENT), first)
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_different_shots_miss(self):
+        cache = ShotCache(tolerance=6.0, velocityTolerance=1.0, origin=rackTable())
+        cache.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        cache.run(rackTable(5.0, 0.0), 0.0, -1000.0, ENGINE_EVENT)
+        cache.run(rackTable(), 0.0, -1100.0, ENGINE_EVENT)
+        cache.run(rackTable(), 0.0, -1000.0, ENGINE_STEP)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["shots"]), (0, 4, 4))
+
+    def test_evicts_least_recently_used(self):
+        shot = Shot()
+        shot.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        cache = ShotCache(maxBytes=2 * shot.nbytes)
+        for dx in (0.0, 10.0, 20.0):
+            cache.run(rackTable(dx), 0.0, -1000.0, ENGINE_EVENT)
+        self.assertLessEqual(cache.bytes, cache.maxBytes)
+        self.assertEqual(cache.stats()["shots"], 2)
+        # The first one is gone
+        cache.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        self.assertEqual(cache.stats()["hits"], 0)
+
+    def test_packed_shots_count_their_bytes(self):
+        shot = Shot()
+        shot.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        packed = PackedShot(packShot([shot[i] for i in range(len(shot))]))
+        self.assertEqual(packed.nbytes, len(packed.body))
+        cache = ShotCache()
+        cache.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT, lambda *args: packed)
+        self.assertEqual(cache.bytes, packed.nbytes)
+
+class TestFrameRenderer(unittest.TestCase):
+
+    # A frame where nothing moved is still a frame, the same svg as the one before
+    def test_renders_every_frame_like_table_svg(self):
+        renderer = FrameRenderer()
+        table = rackTable()
+        first = renderer.render(table)
+        self.assertEqual(first, table.svg())
+        self.assertIs(renderer.render(rackTable()), first)
+        self.assertEqual(renderer.render(rackTable(1.0)), rackTable(1.0).svg())
+
+# Reads a FrameEncoder stream back: returns the interval, svg, fills and, for every frame after the first,
+# {number: (type, x, y)} of the balls that changed since the first one, with x and y nan once pocketed
+def decodeFrames(data):
+    assert data[:4] == b"PHYF"
+    interval, count, frames = struct.unpack_from("<fHI", data, 4)
+    offset = 14
+    numbers = list(data[offset:offset + count])
+    offset += count
+    strings = []
+    for _ in range(2):
+        length, = struct.unpack_from("<I", data, offset)
+        strings.append(data[offset + 4:offset + 4 + length].decode("utf-8"))
+        offset += 4 + length
+    svg, fills = strings
+
+    balls = {}
+    decoded = []
+    for frame in range(1, frames):
+        changes = data[offset]
+        offset += 1
+        for _ in range(changes):
+            index, type, x, y = struct.unpack_from("<BBff", data, offset)
+            balls[numbers[index]] = (type, x, y)
+            offset += 10
+        decoded.append(dict(balls))
+    assert offset == len(data)
+    return interval, svg, fills, decoded
+
+class TestFrameEncoder(unittest.TestCase):
+
+    # Every later frame decodes to the balls of its table, to float32 precision
+    def test_decodes_to_the_frames(self):
+        shot = Shot()
+        shot.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        tables = [shot[0].roll(frame * 0.05) for frame in range(60)]
+        # and the tables after every segment of a shot that pockets the 1 ball
+        shot.run(Table().importBalls([(0, STILL_BALL, 300.0, 400.0, 0.0, 0.0, 0.0, 0.0),
+                                      (1, STILL_BALL, 200.0, 200.0, 0.0, 0.0, 0.0, 0.0)]), -800.0, -1200.0, ENGINE_EVENT)
+        tables += [shot[index] for index in range(len(shot))]
+        encoder = FrameEncoder()
+        for table in tables:
+            self.assertIsNone(encoder.render(table))
+
+        interval, svg, fills, frames = decodeFrames(encoder.data())
+        self.assertAlmostEqual(interval, FRAME_INTERVAL, places=6)
+        self.assertEqual(svg, tables[0].svg())
+        self.assertEqual(fills, ";".join("%s,%s" % ballFills(number) for number in range(4)))
+        self.assertEqual(len(frames[-1]), 4)
+        self.assertEqual(len(frames), len(tables) - 1)
+
+        first = {number: (type, x, y) for type, number, x, y in tables[0].balls()}
+        for table, changed in zip(tables[1:], frames):
+            balls = {number: ball for number, ball in {**first, **changed}.items() if not math.isnan(ball[1])}
+            self.assertEqual(sorted(balls), sorted(number for _, number, _, _ in table.balls()))
+            for type, number, x, y in table.balls():
+                self.assertEqual(balls[number][0], type)
+                self.assertAlmostEqual(balls[number][1], x, delta=1e-3)
+                self.assertAlmostEqual(balls[number][2], y, delta=1e-3)
+
+    # A frame where nothing moved costs one byte
+    def test_still_frames(self):
+        encoder = FrameEncoder()
+        for _ in range(3):
+            encoder.render(rackTable())
+        self.assertEqual(encoder.data()[-2:], b"\x00\x00")
+        self.assertEqual(decodeFrames(encoder.data())[3], [{}, {}])
+
+    def test_no_frames(self):
+        self.assertEqual(decodeFrames(FrameEncoder().data())[1:], ("", "", []))
+
+class TestShotFrames(unittest.TestCase):
+
+    # One frame every FRAME_INTERVAL of each segment, rolled from the start of the segment, then the final table
+    def test_frames_of_every_segment(self):
+        shot = Shot()
+        shot.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        segments = [shot[index] for index in range(len(shot))]
+        expected = []
+        for start, end in zip(segments, segments[1:]):
+            for frame in range(int((end.time - start.time) / FRAME_INTERVAL)):
+                expected.append(start.roll(frame * FRAME_INTERVAL))
+        expected.append(shot.final())
+
+        frames = ShotFrames(segments)
+        self.assertEqual(len(frames), len(expected))
+        for index in (0, 1, 57, len(expected) // 2, len(expected) - 2, len(expected) - 1):
+            self.assertEqual(frames[index].exportBalls().tolist(), expected[index].exportBalls().tolist())
+        self.assertEqual(frames[-1].time, shot.final().time)
+        with self.assertRaises(IndexError):
+            frames[len(expected)]
+
+    def test_no_segments(self):
+        self.assertEqual(len(ShotFrames([])), 0)
+
+class TestSimulationPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SimulationPool(workers=1, queueSize=0, deadline=30.0)
+
+    def tearDown(self):
+        self.pool.close()
+
+    # The shot most tests give the worker, simulated here
+    def shot(self):
+        shot = Shot()
+        shot.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        return shot
+
+    # The worker's shot, sent back packed, reads like the same shot simulated here
+    def test_simulates_in_a_worker(self):
+        shot = self.shot()
+        packed = self.pool.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        self.assertIsInstance(packed, PackedShot)
+        self.assertEqual(packed.keyframes(), shot.keyframes())
+        self.assertEqual(str(packed.final()), str(shot.final()))
+
+    def test_errors_are_raised_again(self):
+        with self.assertRaises(ValueError):
+            self.pool.run(Table(), 0.0, -1000.0)
+        # The worker goes on with the next shot
+        self.assertEqual(len(self.pool.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)), len(self.shot()))
+
+    # A shot the step engine takes tens of milliseconds over is cancelled, and its worker replaced by a new one
+    def test_deadline(self):
+        with self.assertRaises(TimeoutError):
+            self.pool.run(rackTable(), 30.0, -1500.0, ENGINE_STEP, deadline=0.005)
+        self.assertEqual(self.pool.idle.qsize(), 1)
+        self.assertEqual(len(self.pool.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)), len(self.shot()))
+
+    # Waiting for a worker counts against the deadline too
+    def test_no_worker_in_time(self):
+        worker = self.pool.idle.get()
+        try:
+            with self.assertRaises(TimeoutError):
+                self.pool.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT, deadline=0.05)
+        finally:
+            self.pool.idle.put(worker)
+
+    # With the only worker taken and no room to wait, the next shot is turned away at once
+    def test_full(self):
+        self.assertTrue(self.pool.admission.acquire(blocking=False))
+        try:
+            with self.assertRaises(queue.Full):
+                self.pool.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        finally:
+            self.pool.admission.release()
+
+    def test_closed(self):
+        self.pool.close()
+        with self.assertRaises(RuntimeError):
+            self.pool.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+
+class TestPackedShot(unittest.TestCase):
+
+    def test_reads_like_the_shot(self):
+        shot = Shot()
+        shot.run(rackTable(), 0.0, -1000.0, ENGINE_EVENT)
+        packed = PackedShot(packShot([shot[i] for i in range(len(shot))]))
+        self.assertEqual(len(packed), len(shot))
+        self.assertEqual(packed.keyframes(), shot.keyframes())
+        self.assertEqual(str(packed.final()), str(shot.final()))
+        # Every table is a new one
+        packed[0].time = 99.0
+        self.assertEqual(packed[0].time, shot[0].time)
+
+    def test_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            PackedShot(b"not a shot")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,361 @@
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import http.client
+import subprocess
+import tempfile
+import threading
+import unittest
+import zlib
+from urllib.parse import urlencode
+from unittest import mock
+import server
+from Physics import Game, Table, ShotFrames, FramePages, CONNECTIONS, TABLE_CACHE, STILL_BALL, ROLLING_BALL, DRAG, STORAGE_ROWS, ENGINE_STEP, ENGINE_EVENT
+
+# Where server.py and Physics.py are, for the processes the tests start
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class TestImport(unittest.TestCase):
+
+    # SimulationPool workers import server.py again: that alone must not open the database or start any thread
+    def test_import_has_no_side_effects(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run([sys.executable, "-c", "import threading, server; print(threading.active_count())"],
+                                    cwd=directory, env=dict(os.environ, PYTHONPATH=HERE),
+                                    capture_output=True, text=True, check=True).stdout
+            self.assertEqual(output.split(), ["1"])
+            self.assertEqual(os.listdir(directory), [])
+
+@unittest.skipUnless(shutil.which("node"), "needs node to run the page's script")
+class TestGameScript(unittest.TestCase):
+
+    # The page rolls keyframe balls to the same positions as the frames the server renders with Table.roll()
+    def test_roll_ball_matches_phylib_roll(self):
+        rollBall = re.search(r"function rollBall\(ball, t\) \{.*?\n        \}", server.GAME_SCRIPT.body.decode(), re.S).group(0)
+        speed = (300.0 ** 2 + 150.0 ** 2) ** 0.5
+        ball = [3, ROLLING_BALL, 500.0, 900.0, 300.0, -150.0, -300.0 / speed * DRAG, 150.0 / speed * DRAG]
+        # Up to the time the ball stops, then past it
+        times = [0.0, 0.5, 1.0, speed / DRAG, 2.5, 4.0]
+        script = rollBall + f"\nconsole.log(JSON.stringify({times}.map(t => rollBall({ball}, t))));"
+        positions = json.loads(subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True).stdout)
+
+        for t, (x, y) in zip(times, positions):
+            # phylib_roll changes the ball it rolls from, so roll a new table every time
+            _, _, expectedX, expectedY = Table().importBalls([ball]).roll(t).balls()[0]
+            self.assertAlmostEqual(x, expectedX, places=6)
+            self.assertAlmostEqual(y, expectedY, places=6)
+
+# The server's handler, without a line on stderr for every request
+class QuietHandler(server.RequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+# Every test gets the server set up by server.setUp() with a new phylib.db in a directory of its own, served on
+# a free port of its own
+class ServerTestCase(unittest.TestCase):
+    threads = 4
+    workers = 1
+    queueSize = 1
+    deadline = 10.0
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        server.setUp(self.workers, self.queueSize, self.deadline)
+        self.httpd = server.PooledHTTPServer(('127.0.0.1', 0), QuietHandler, self.threads)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        server.SESSIONS.close()
+        server.SESSIONS.sessions.clear()
+        Game.writer.close()
+        Game.pool.close()
+        Game.cache = Game.writer = Game.pool = None
+        Game.storage = STORAGE_ROWS
+        CONNECTIONS.closeAll(Game.db.databaseName)
+        TABLE_CACHE.clear(Game.db.databaseName)
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    # Sends a request and returns the response, read
+    def request(self, method, path, body=None, headers={}):
+        conn = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=60)
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        response.body = response.read()
+        conn.close()
+        return response
+
+    # Starts a game and returns its ID
+    def startGame(self):
+        return server.SESSIONS.create("game", "one", "two").game.gameID
+
+    # Plays a shot of player one with /shoot
+    def shoot(self, gameID, vy=-400.0, shotFormat=None, headers={}):
+        body = json.dumps({"gameID": gameID, "gameName": "game", "player1Name": "one", "player2Name": "two",
+                           "vx": 0.0, "vy": vy, "format": shotFormat})
+        return self.request('POST', '/shoot', body, dict(headers, **{'Content-Type': 'application/json'}))
+
+class TestPooledHTTPServer(ServerTestCase):
+    threads = 2
+
+    # Each of the server's threads opens its connection to the database once and keeps it
+    def test_threads_reuse_their_connection(self):
+        with mock.patch.object(CONNECTIONS, "connect", wraps=CONNECTIONS.connect) as connect:
+            for _ in range(10):
+                self.assertEqual(self.request('GET', '/frames?shot=12345').status, 404)
+        self.assertLessEqual(connect.call_count, self.threads)
+
+    def test_serves_requests_at_the_same_time(self):
+        responses = []
+        requests = [threading.Thread(target=lambda: responses.append(self.request('GET', '/').status)) for _ in range(8)]
+        for thread in requests:
+            thread.start()
+        for thread in requests:
+            thread.join()
+        self.assertEqual(responses, [200] * 8)
+
+class TestSessionManager(ServerTestCase):
+
+    # The table of a session, comparable with ==
+    def balls(self, session):
+        return session.table.exportBalls().tolist()
+
+    # Games beyond maxGames are put away in the database and picked up again at the table they were at
+    def test_least_recently_used_games_are_put_away(self):
+        sessions = server.SessionManager(maxGames=1)
+        first = sessions.create("first", "one", "two")
+        first.table = first.table.shoot(0.0, -1000.0, ENGINE_EVENT)
+        second = sessions.create("second", "three", "four")
+        self.assertEqual(list(sessions.sessions), [second.game.gameID])
+        self.assertTrue(first.evicted)
+
+        again = sessions.get(first.game.gameID)
+        self.assertIsNot(again, first)
+        self.assertEqual(again.game.gameID, first.game.gameID)
+        self.assertEqual(self.balls(again), self.balls(first))
+        self.assertEqual(list(sessions.sessions), [first.game.gameID])
+
+    # With maxIdle=0 every game is put away once its shot is played, the next shot picks up where it ended
+    def test_idle_games_are_put_away(self):
+        sessions = server.SessionManager(maxIdle=0)
+        gameID = sessions.create("game", "one", "two").game.gameID
+        def play(session):
+            session.table = session.table.shoot(0.0, -1000.0, ENGINE_EVENT)
+            return self.balls(session)
+        played = sessions.play(gameID, play)
+        self.assertEqual(sessions.sessions, {})
+        self.assertEqual(sessions.play(gameID, self.balls), played)
+
+    def test_unknown_game(self):
+        self.assertIsNone(server.SessionManager().get(12345))
+        self.assertIsNone(server.SessionManager().play(12345, self.balls))
+
+    # A game in the middle of a shot is neither put away nor in the way of the other games
+    def test_games_are_locked_one_by_one(self):
+        sessions = server.SessionManager(maxIdle=0)
+        busy = sessions.create("busy", "one", "two")
+        with busy.lock:
+            other = sessions.create("other", "three", "four")
+            self.assertEqual(sessions.play(other.game.gameID, self.balls), self.balls(other))
+            self.assertFalse(busy.evicted)
+        sessions.close()
+        self.assertTrue(busy.evicted)
+        self.assertEqual(sessions.sessions, {})
+
+class TestGamePage(ServerTestCase):
+
+    # The names in the query string end up in the page as text, never as markup
+    def test_names_are_escaped(self):
+        names = {"gameName": '"><script>alert(1)</script>', "player1": "<b>one</b>", "player2": "t'w&o"}
+        response = self.request('GET', '/game?' + urlencode(dict(names, gameID=self.startGame())))
+        self.assertEqual(response.status, 200)
+        page = response.body.decode('utf-8')
+        self.assertNotIn("<script>alert", page)
+        self.assertNotIn("<b>", page)
+        self.assertIn('value="&quot;&gt;&lt;script&gt;alert(1)&lt;/script&gt;"', page)
+        self.assertIn("Player 2: t&#x27;w&amp;o", page)
+
+class TestFrames(ServerTestCase):
+
+    # Plays a shot with format "pages", returns its ID and number of frames
+    def playPages(self):
+        shot = json.loads(self.shoot(self.startGame(), shotFormat='pages').body)
+        return shot["shot"], shot["frames"]
+
+    def page(self, query):
+        response = self.request('GET', '/frames?' + query)
+        self.assertEqual(response.status, 200)
+        return json.loads(response.body)
+
+    def test_pages_of_the_saved_shot(self):
+        shotID, count = self.playPages()
+        frames = ShotFrames(Game.db.readShotData(shotID))
+        self.assertEqual(count, len(frames))
+
+        page = self.page(f"shot={shotID}&from=10&to=15")
+        self.assertEqual((page["shot"], page["from"], page["frames"]), (shotID, 10, count))
+        self.assertEqual(page["svgs"], [frames[index].svg() for index in range(10, 15)])
+        # Read back from the database by another FramePages, the same frames
+        server.FRAME_PAGES = FramePages(Game.db)
+        self.assertEqual(self.page(f"shot={shotID}&from=10&to=15")["svgs"], page["svgs"])
+
+    def test_page_sizes(self):
+        shotID, count = self.playPages()
+        self.assertEqual(len(self.page(f"shot={shotID}")["svgs"]), server.MAX_PAGE)
+        self.assertEqual(len(self.page(f"shot={shotID}&from=0&to=100000")["svgs"]), server.MAX_PAGE)
+        self.assertEqual(len(self.page(f"shot={shotID}&from={count - 3}")["svgs"]), 3)
+        self.assertEqual(self.page(f"shot={shotID}&from={count}")["svgs"], [])
+
+    def test_bad_queries(self):
+        self.assertEqual(self.request('GET', '/frames').status, 400)
+        self.assertEqual(self.request('GET', '/frames?shot=1&from=x').status, 400)
+        self.assertEqual(self.request('GET', '/frames?shot=12345').status, 404)
+
+class TestCaching(ServerTestCase):
+
+    def test_static_parts(self):
+        for path, response in (('/', server.LANDING_PAGE), ('/game.css', server.GAME_STYLE),
+                               ('/game.js', server.GAME_SCRIPT)):
+            sent = self.request('GET', path)
+            self.assertEqual(sent.status, 200)
+            self.assertEqual(sent.getheader('Content-Type'), response.contentType)
+            self.assertEqual(sent.getheader('ETag'), response.etag)
+            self.assertEqual(sent.getheader('Cache-Control'), 'no-cache')
+            self.assertEqual(sent.body, response.body)
+
+    # A browser that still has the page gets a 304 without it, whichever coding its copy is in
+    def test_not_modified(self):
+        etag = self.request('GET', '/game.js').getheader('ETag')
+        gzipped = self.request('GET', '/game.js', headers={'Accept-Encoding': 'gzip'}).getheader('ETag')
+        self.assertNotEqual(gzipped, etag)
+        for tags in (etag, gzipped, '"other", ' + etag, '*'):
+            response = self.request('GET', '/game.js', headers={'If-None-Match': tags})
+            self.assertEqual((response.status, response.body), (304, b""))
+            self.assertEqual(response.getheader('ETag'), etag)
+        self.assertEqual(self.request('GET', '/game.js', headers={'If-None-Match': '"other"'}).status, 200)
+
+    def test_compressed(self):
+        for encoding, decompress in (('gzip', gzip.decompress), ('deflate', zlib.decompress)):
+            response = self.request('GET', '/', headers={'Accept-Encoding': f'br, {encoding}'})
+            self.assertEqual(response.getheader('Content-Encoding'), encoding)
+            self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+            self.assertEqual(decompress(response.body), server.LANDING_PAGE.body)
+        # Not when the browser refuses it
+        response = self.request('GET', '/', headers={'Accept-Encoding': 'gzip;q=0, deflate;q=0'})
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(response.body, server.LANDING_PAGE.body)
+
+    # The shot's frames are compressed as they are sent
+    def test_compressed_shot(self):
+        response = self.shoot(self.startGame(), headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(int(response.getheader('Content-Length')), len(response.body))
+        self.assertGreater(len(json.loads(gzip.decompress(response.body))), 1)
+
+class TestStream(ServerTestCase):
+
+    # Starts a game at a table of the cue ball and the 1 ball, the same for every game
+    def startAt(self):
+        gameID = self.startGame()
+        server.SESSIONS.get(gameID).table = Table().importBalls([(0, STILL_BALL, 675.0, 2000.0, 0.0, 0.0, 0.0, 0.0),
+                                                                 (1, STILL_BALL, 675.0, 675.0, 0.0, 0.0, 0.0, 0.0)])
+        return gameID
+
+    # Returns the (event, data) of every Server-Sent Event of body
+    def events(self, body):
+        events = []
+        for block in body.decode('utf-8').split("\n\n")[:-1]:
+            fields = dict(line.split(": ", 1) for line in block.split("\n"))
+            events.append((fields["event"], json.loads(fields["data"])))
+        return events
+
+    # Every frame of the JSON response, one "frame" event each, then an "end" event
+    def test_frames_then_end(self):
+        frames = json.loads(self.shoot(self.startAt()).body)
+        response = self.shoot(self.startAt(), shotFormat='stream')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Type'), 'text/event-stream')
+        self.assertIsNone(response.getheader('Content-Length'))
+        events = self.events(response.body)
+        self.assertEqual(events[-1], ("end", {}))
+        self.assertEqual(events[:-1], [("frame", frame) for frame in frames])
+
+    # Compressed as a whole, every event flushed as it goes
+    def test_gzip(self):
+        played, streamed = self.startAt(), self.startAt()
+        self.shoot(played)
+        response = self.shoot(streamed, shotFormat='stream', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        events = self.events(gzip.decompress(response.body))
+        self.assertEqual(events[-1][0], "end")
+        # The next shot starts where the shot ended, like after any other shot
+        self.assertEqual(server.SESSIONS.get(streamed).table.exportBalls().tolist(),
+                         server.SESSIONS.get(played).table.exportBalls().tolist())
+
+class TestBusyServer(ServerTestCase):
+    queueSize = 0
+
+    # With the only worker taken and no room to wait, the shot is turned away at once, to be tried again
+    def test_full(self):
+        gameID = self.startGame()
+        table = server.SESSIONS.get(gameID).table.exportBalls().tolist()
+        self.assertTrue(Game.pool.admission.acquire(blocking=False))
+        try:
+            response = self.shoot(gameID)
+        finally:
+            Game.pool.admission.release()
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.getheader('Retry-After'), '1')
+        self.assertEqual(server.SESSIONS.get(gameID).table.exportBalls().tolist(), table)
+        self.assertEqual(self.shoot(gameID).status, 200)
+
+class TestSlowShot(ServerTestCase):
+    deadline = 0.005
+
+    # A shot cancelled at its deadline leaves the table where it was
+    def test_deadline(self):
+        gameID = self.startGame()
+        server.SESSIONS.get(gameID).game.engine = ENGINE_STEP
+        table = server.SESSIONS.get(gameID).table.exportBalls().tolist()
+        self.assertEqual(self.shoot(gameID, vy=-1500.0).status, 504)
+        self.assertEqual(server.SESSIONS.get(gameID).table.exportBalls().tolist(), table)
+
+class TestShoot(ServerTestCase):
+
+    def test_keyframes(self):
+        response = self.shoot(self.startGame(), shotFormat='keyframes')
+        self.assertEqual(response.status, 200)
+        self.assertGreater(len(json.loads(response.body)["keyframes"]), 1)
+
+    def test_unknown_game(self):
+        self.assertEqual(self.shoot(12345).status, 404)
+
+    def test_shot_without_cue_ball(self):
+        gameID = self.startGame()
+        server.SESSIONS.get(gameID).table = Table().importBalls([(1, STILL_BALL, 675.0, 675.0, 0.0, 0.0, 0.0, 0.0)])
+        response = self.shoot(gameID)
+        self.assertEqual(response.status, 400)
+        self.assertIn(b"no cue ball", response.body)
+
+    # The breaks of every game share one shot, whatever the nudges of their racks. Later shots don't
+    def test_breaks_are_cached(self):
+        first, second = self.startGame(), self.startGame()
+        self.assertEqual(self.shoot(first, vy=-1000.0).status, 200)
+        self.assertEqual(self.shoot(second, vy=-1000.0).status, 200)
+        self.assertEqual((server.BREAK_CACHE.hits, server.BREAK_CACHE.misses), (1, 1))
+
+        self.assertIs(server.SESSIONS.get(first).game.cache, Game.cache)
+        self.assertEqual(self.shoot(first, vy=-1000.0).status, 200)
+        self.assertEqual((server.BREAK_CACHE.hits, server.BREAK_CACHE.misses), (1, 1))
+        self.assertEqual((Game.cache.hits, Game.cache.misses), (0, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from Physics import Table, STILL_BALL, ROLLING_BALL, ENGINE_EVENT
+
+try:
+    import numpy as np
+    from VectorPhysics import TableBatch
+except ImportError:
+    np = None
+
+# The cue ball, the 1 ball in its way and the 2 ball off to the side
+def table():
+    return Table().importBalls([(0, STILL_BALL, 675.0, 2000.0, 0.0, 0.0, 0.0, 0.0),
+                                (1, STILL_BALL, 675.0, 1000.0, 0.0, 0.0, 0.0, 0.0),
+                                (2, STILL_BALL, 300.0, 600.0, 0.0, 0.0, 0.0, 0.0)])
+
+# Every ball of a table as {number: (x, y)}
+def positionsOf(table):
+    return {int(number): (x, y) for number, _, x, y, *_ in table.exportBalls().tolist()}
+
+@unittest.skipIf(np is None, "needs numpy")
+class TestTableBatch(unittest.TestCase):
+
+    def test_tables_round_trip(self):
+        rolling = Table().importBalls([(0, ROLLING_BALL, 675.0, 2000.0, 10.0, -20.0, -1.5, 3.0),
+                                       (5, STILL_BALL, 100.0, 200.0, 0.0, 0.0, 0.0, 0.0)])
+        rolling.time = 2.5
+        batch = TableBatch.fromTables([table(), rolling])
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch.table(0).exportBalls().tolist(), table().exportBalls().tolist())
+        self.assertEqual(batch.table(1).exportBalls().tolist(), rolling.exportBalls().tolist())
+        self.assertEqual(batch.table(1).time, 2.5)
+        # The first table has one ball more, the second one's last slot is empty
+        self.assertTrue(np.isnan(batch.positions()[1, 2, 1]))
+
+    # Every table of the batch ends where phylib's event engine ends its shot. Glancing hits are left out: there
+    # a SIM_RATE of difference at the collision sends the balls apart at visibly different angles
+    def test_shoot_matches_phylib(self):
+        velocities = [(0.0, -1000.0), (-300.0, -900.0), (0.0, -200.0), (600.0, -300.0)]
+        batch = TableBatch.fromTables([table()] * len(velocities))
+        segments = batch.shoot(velocities)
+        for index, (xvel, yvel) in enumerate(velocities):
+            final = table().shoot(xvel, yvel, ENGINE_EVENT)
+            self.assertAlmostEqual(batch.time[index], final.time, delta=0.01)
+            expected, actual = positionsOf(final), positionsOf(batch.table(index))
+            self.assertEqual(expected.keys(), actual.keys())
+            for number, (x, y) in expected.items():
+                self.assertAlmostEqual(actual[number][0], x, delta=1.0)
+                self.assertAlmostEqual(actual[number][1], y, delta=1.0)
+        self.assertTrue((segments > 0).all())
+        self.assertEqual(batch.rolling().tolist(), [0] * len(velocities))
+
+    # segment() only advances the tables it is given
+    def test_segment_mask(self):
+        batch = TableBatch.fromTables([table(), table()])
+        batch.strike((0.0, -1000.0))
+        advanced = batch.segment(np.array([True, False]))
+        self.assertEqual(advanced.tolist(), [True, False])
+        self.assertGreater(batch.time[0], 0.0)
+        self.assertEqual(batch.time[1], 0.0)
+
+    def test_no_cue_ball(self):
+        batch = TableBatch([[1]], [[[675.0, 1000.0]]])
+        with self.assertRaises(ValueError):
+            batch.shoot((0.0, -1000.0))
+
+if __name__ == "__main__":
+    unittest.main()